@@ -1,15 +1,68 @@
-import subprocess
+import asyncio
+import math
 import os
 import json
+import shutil
+import tempfile
 from pathlib import Path
+from ffmpeg_engine import FFmpegEngine
+from ffmpeg_capabilities import load_capabilities, recommended_settings
+from audio_cache import MusicCache
+from render_dedup import file_sha256, media_sha256
+from render_plan import RenderPlan, RenderNode, NodeCache, PlanExecutor, link_or_copy
+
+# Formatos de saída gerados a partir do quadro 1280x720 dos templates
+OUTPUT_FORMATS = {
+    '16:9': {'name': 'Paisagem (portais, YouTube)', 'size': '1280x720'},
+    '1:1': {'name': 'Quadrado (feed do Instagram)', 'size': '720x720'},
+    '9:16': {'name': 'Vertical (Reels, Stories)', 'size': '720x1280'}
+}
+
+# Modo de entrega com tamanho/bitrate máximo (limites de WhatsApp e portais)
+DELIVERY_AUDIO_KBPS = 160  # Bitrate máximo da trilha no MP4 final
+DELIVERY_SIZE_MARGIN = 0.95  # Folga para o contêiner MP4 e a variação do VBV
+DELIVERY_MIN_VIDEO_KBPS = 250  # Abaixo disso o vídeo fica ilegível
+
+# Pôster e sprite de miniaturas (scrubbing no player) do formato principal
+PREVIEW_THUMB_WIDTH = 160
+PREVIEW_MIN_INTERVAL = 2  # Segundos entre miniaturas do sprite
+PREVIEW_MAX_THUMBS = 100
+PREVIEW_SPRITE_COLUMNS = 10
 
 class AdvancedVideoGenerator:
-    def __init__(self, upload_folder='uploads', output_folder='generated_videos', assets_folder='assets'):
+    def __init__(self, upload_folder='uploads', output_folder='generated_videos', assets_folder='assets', engine=None,
+                 scratch_folder=None, cache_folder=None, capabilities=None):
         self.upload_folder = upload_folder
         self.output_folder = output_folder
         self.assets_folder = assets_folder
+        # Arquivos intermediários ficam fora do armazenamento persistente
+        # (ex.: IMOVIBE_SCRATCH_DIR=/dev/shm/imovibe para usar tmpfs)
+        self.scratch_folder = scratch_folder or os.environ.get('IMOVIBE_SCRATCH_DIR') or \
+            os.path.join(tempfile.gettempdir(), 'imovibe')
+        
+        # Capacidades do ffmpeg desta máquina (cache em disco) e padrões do
+        # agendador derivados da velocidade medida no self-test
+        self.capabilities = capabilities or load_capabilities()
+        self.scheduler_settings = recommended_settings(self.capabilities)
+        if not self.capabilities['ok']:
+            print(f"Aviso: ffmpeg não está pronto para renderizar: {'; '.join(self.capabilities['problems'])}")
+        max_encoders = int(os.environ.get('IMOVIBE_MAX_ENCODERS', self.scheduler_settings['max_concurrency']))
+        self.engine = engine or FFmpegEngine(max_encoders)
         os.makedirs(output_folder, exist_ok=True)
         os.makedirs(f"{assets_folder}/music", exist_ok=True)
+        self.music_cache = MusicCache(self.engine, f"{assets_folder}/music")
+        os.makedirs(self.scratch_folder, exist_ok=True)
+        
+        # Cache das saídas de etapas do plano (assets normalizados, áudio, vídeos finais)
+        cache_folder = cache_folder or os.environ.get('IMOVIBE_RENDER_CACHE', 'render_cache')
+        cache_max_bytes = int(os.environ.get('IMOVIBE_RENDER_CACHE_MB', '2048')) * 1024 * 1024
+        self.executor = PlanExecutor(self.engine, NodeCache(cache_folder, cache_max_bytes))
+        
+        # Custo estimado de codificar um frame 720p (usado só nas estimativas do plano)
+        self.seconds_per_frame = self.scheduler_settings['seconds_per_frame'] or 0.01
+        
+        # Jobs grandes são divididos em trechos codificados em paralelo
+        self.chunk_min_files = int(os.environ.get('IMOVIBE_CHUNK_MIN_FILES', '12'))
         
         # Configurações de templates
         self.templates = {
@@ -17,6 +70,8 @@ class AdvancedVideoGenerator:
                 'name': 'Terreno Urbano',
                 'duration_per_image': 4,
                 'transition_effect': 'fade',
+                'ken_burns': False,
+                'output_formats': ['16:9', '1:1', '9:16'],
                 'text_style': {
                     'fontcolor': 'white',
                     'fontsize': 28,
@@ -30,6 +85,8 @@ class AdvancedVideoGenerator:
                 'name': 'Casa Residencial',
                 'duration_per_image': 3,
                 'transition_effect': 'slideright',
+                'ken_burns': False,
+                'output_formats': ['16:9', '1:1', '9:16'],
                 'text_style': {
                     'fontcolor': 'white',
                     'fontsize': 26,
@@ -43,6 +100,8 @@ class AdvancedVideoGenerator:
                 'name': 'Apartamentos',
                 'duration_per_image': 3.5,
                 'transition_effect': 'wiperight',
+                'ken_burns': False,
+                'output_formats': ['16:9', '1:1', '9:16'],
                 'text_style': {
                     'fontcolor': 'white',
                     'fontsize': 24,
@@ -76,245 +135,997 @@ class AdvancedVideoGenerator:
             }
         }
     
-    def create_property_video(self, files_data, property_data, job_id):
+    def create_property_video(self, files_data, property_data, job_id, master=None):
         """
         Cria um vídeo promocional do imóvel usando templates e efeitos
+        (versão síncrona, bloqueia até o fim da renderização)
+        """
+        return self.engine.run_sync(self.create_property_video_async(files_data, property_data, job_id, master))
+    
+    def submit_property_video(self, files_data, property_data, job_id, master=None):
+        """
+        Agenda a renderização no motor assíncrono e retorna um Future
+        """
+        return self.engine.submit(self.create_property_video_async(files_data, property_data, job_id, master))
+    
+    async def create_property_video_async(self, files_data, property_data, job_id, master=None):
+        """
+        Cria um vídeo promocional do imóvel usando templates e efeitos.
+        Retorna {'video_path': vídeo do formato principal, 'video_paths': {formato: vídeo},
+        'file_size' e 'file_sizes': tamanho em bytes do principal e de cada formato,
+        'delivery': metas de tamanho/bitrate pedidas (ou None),
+        'previews': pôster e sprite de miniaturas com índice WebVTT
+        (preview_paths, só os gerados),
+        'master': master sem texto e sem música (None no modo em trechos)}.
+        
+        O pedido é compilado em um plano (DAG) de etapas e executado pelo
+        PlanExecutor. Se uma etapa falhar mesmo após novas tentativas, o job
+        termina com RenderError (em vez de seguir com o arquivo anterior).
+        
+        master: master de um job anterior (edição). Se ainda servir para o
+        pedido, só o texto, os formatos e a trilha são refeitos sobre ele.
         """
+        # Rascunho próprio de cada tentativa: uma tentativa antiga do mesmo job
+        # (ex.: worker que perdeu o lease) nunca apaga os arquivos da atual
+        scratch_dir = tempfile.mkdtemp(prefix=f'{job_id}_', dir=self.scratch_folder)
         try:
-            template_name = property_data.get('template', 'casa')
-            music_name = property_data.get('music', 'instrumental')
-            
-            template = self.templates.get(template_name, self.templates['casa'])
-            music_config = self.music_options.get(music_name, self.music_options['instrumental'])
-            
-            # Separar imagens e vídeos
-            images = [f for f in files_data if f['type'] == 'image']
-            videos = [f for f in files_data if f['type'] == 'video']
-            
-            # Criar vídeo a partir das imagens com template
-            image_video_path = None
-            if images:
-                image_video_path = self._create_templated_slideshow(images, template, job_id)
-            
-            # Processar vídeos existentes com template
-            processed_videos = []
-            for video in videos:
-                processed_path = self._process_video_with_template(video, template, job_id)
-                if processed_path:
-                    processed_videos.append(processed_path)
-            
-            # Combinar todos os vídeos
-            all_videos = []
-            if image_video_path:
-                all_videos.append(image_video_path)
-            all_videos.extend(processed_videos)
-            
-            if not all_videos:
-                raise Exception("Nenhum conteúdo de vídeo foi gerado")
-            
-            # Concatenar vídeos
-            concatenated_video = self._concatenate_videos_with_transitions(all_videos, template, job_id)
-            
-            # Adicionar texto/legendas com informações do imóvel
-            video_with_text = self._add_property_info_styled(concatenated_video, property_data, template, job_id)
-            
-            # Adicionar música de fundo
-            final_video = self._add_background_music(video_with_text, music_config, job_id)
-            
-            return final_video
-            
-        except Exception as e:
-            print(f"Erro ao gerar vídeo: {str(e)}")
-            return None
+            if self.can_reuse_master(master, property_data):
+                # Cada job tem seu próprio arquivo de master (hardlink quando possível)
+                source_path = master['path']
+                master = dict(master, path=self.master_path(job_id))
+                # Cópia (entre sistemas de arquivos) e hash leem o master inteiro:
+                # fora do event loop, para não travar os outros jobs
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, link_or_copy, source_path, master['path'])
+                master_digest = await loop.run_in_executor(None, file_sha256, master['path'])
+                plan = self.build_edit_plan(master, property_data, job_id, scratch_dir, master_digest)
+            else:
+                master = self._master_info(files_data, property_data, job_id)
+                plan = self.build_render_plan(files_data, property_data, job_id, scratch_dir)
+            results = await self.executor.execute(plan)
+            if master and not os.path.exists(master['path']):
+                # Vídeo restaurado do cache sem a etapa do master: a edição
+                # desse job faz a renderização completa
+                master = None
+            formats = self.resolve_output_formats(property_data)
+            video_paths = {fmt: results[f'package_{self.format_slug(fmt)}'][0] for fmt in formats}
+            file_sizes = {fmt: os.path.getsize(path) for fmt, path in video_paths.items()}
+            delivery = self.resolve_delivery(property_data)
+            if delivery:
+                delivery = dict(delivery, within_target=not delivery['target_size'] or
+                                max(file_sizes.values()) <= delivery['target_size'])
+            return {
+                'video_path': video_paths[formats[0]],  # Formato principal
+                'video_paths': video_paths,
+                'file_size': file_sizes[formats[0]],
+                'file_sizes': file_sizes,
+                'delivery': delivery,
+                'previews': {name: path for name, path in self.preview_paths(job_id).items()
+                             if os.path.exists(path)},
+                'master': master
+            }
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
     
-    def _create_templated_slideshow(self, images, template, job_id):
+    def describe_render_plan(self, files_data, property_data, job_id='dry-run'):
         """
-        Cria um slideshow com template específico
+        Dry-run: monta o plano e retorna sua descrição com o tempo estimado,
+        sem codificar nada
         """
+        scratch_dir = tempfile.mkdtemp(prefix='plan_', dir=self.scratch_folder)
         try:
-            duration = template['duration_per_image']
-            filters = template['filters']
-            
-            # Criar arquivo de lista de imagens com transições
-            image_list_file = f"{self.output_folder}/images_{job_id}.txt"
-            with open(image_list_file, 'w') as f:
-                for i, img in enumerate(images):
-                    f.write(f"file '{os.path.abspath(img['path'])}'\n")
-                    f.write(f"duration {duration}\n")
-                # Repetir a última imagem
-                if images:
-                    f.write(f"file '{os.path.abspath(images[-1]['path'])}'\n")
-            
-            output_path = f"{self.output_folder}/slideshow_{job_id}.mp4"
-            
-            # Comando FFmpeg com filtros do template
-            cmd = [
+            plan = self.build_render_plan(files_data, property_data, job_id, scratch_dir)
+            return plan.describe(self.engine.max_concurrency, self.executor.cache)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+    
+    def build_render_plan(self, files_data, property_data, job_id, scratch_dir):
+        """
+        Compila o pedido em um plano de etapas:
+        normalize_image -> slideshow, probe -> normalize_clip, concat,
+        overlay -> package, e audio em paralelo com o vídeo.
+        
+        Só os arquivos finais vão para output_folder: os segmentos intermediários
+        são MPEG-TS no diretório de rascunho do job. O concat (ou o slideshow,
+        quando só há imagens) grava o master do job, sem texto e sem música,
+        que o overlay lê; overlay -> package são ligados por pipe.
+        
+        Com vários formatos de saída (16:9, 1:1, 9:16) o vídeo é decodificado
+        uma única vez: o overlay divide os quadros (split) em um ramo de
+        recorte/moldura por formato, cada um com seu encoder, e cada formato
+        ganha sua etapa de package.
+        """
+        template_name = property_data.get('template', 'casa')
+        music_name = property_data.get('music')
+        
+        template = self.templates.get(template_name, self.templates['casa'])
+        # Sem música selecionada (ou opção desconhecida): vídeo fica sem trilha
+        music_config = self.music_options.get(music_name)
+        if music_config and self.music_cache.find_source(music_name) is None:
+            print(f"Música não encontrada em {self.music_cache.music_folder}: {music_name}")
+            music_config = None
+        
+        # Separar imagens e vídeos
+        images = [f for f in files_data if f['type'] == 'image']
+        videos = [f for f in files_data if f['type'] == 'video']
+        
+        if not images and not videos:
+            raise Exception("Nenhum conteúdo de vídeo foi gerado")
+        
+        formats = self.resolve_output_formats(property_data)
+        plan = RenderPlan(job_id)
+        text_filter = self._build_text_filter(property_data, template)
+        duration_per_image = template['duration_per_image']
+        
+        # Modo em trechos: o texto é aplicado na própria codificação de cada
+        # trecho (é estático, então não há emenda visível) e não existe um
+        # overlay serial sobre o vídeo inteiro
+        chunked = self._use_chunked_mode(images, videos, property_data)
+        segment_text = text_filter if chunked else None
+        segment_formats = formats if chunked else None
+        # Todo encode do x264 recebe a sua parte dos núcleos: sem -threads cada
+        # encoder usaria todos e os encoders simultâneos disputariam a CPU
+        x264_threads = self._x264_threads(len(formats) if chunked else 1)
+        
+        # Só com imagens (e sem trechos) o slideshow já é o master
+        master_path = self.master_path(job_id) if not videos and not chunked else None
+        segments = []  # (etapa, duração) dos segmentos, na ordem do vídeo
+        probes = []
+        
+        if images:
+            image_nodes = self._add_image_nodes(plan, images, template, scratch_dir)
+            chunks = self._split_chunks(image_nodes) if chunked else [image_nodes]
+            for index, chunk in enumerate(chunks):
+                node_id = f'slideshow_{index}' if chunked else 'slideshow'
+                # O último segmento do vídeo repete a última imagem para ela ficar na tela até o fim
+                is_last = not videos and index == len(chunks) - 1
+                segments.append((
+                    self._add_slideshow_node(plan, node_id, chunk, template, scratch_dir, is_last,
+                                             segment_text, x264_threads, segment_formats, master_path,
+                                             silent_audio=bool(videos)),
+                    len(chunk) * duration_per_image
+                ))
+        
+        for index, video in enumerate(videos):
+            probe, clip = self._add_clip_nodes(plan, index, video, template, scratch_dir,
+                                               segment_text, x264_threads, segment_formats)
+            probes.append(probe)
+            segments.append((clip, probe))
+        
+        slideshow_duration = len(images) * duration_per_image
+        
+        def total_duration(results):
+            return slideshow_duration + sum(min(results[probe]['duration'], 10) for probe in probes)
+        
+        audio = None
+        if music_config:
+            audio = self._add_audio_node(plan, music_name, music_config, probes, slideshow_duration,
+                                         total_duration, scratch_dir)
+        
+        if chunked:
+            # Cada trecho já saiu em todos os formatos: um concat + package por formato
+            for index, fmt in enumerate(formats):
+                slug = self.format_slug(fmt)
+                body = self._add_concat_node(plan, segments, scratch_dir, pipe_to=f'package_{slug}',
+                                             node_id=f'concat_{slug}', output_index=index)
+                self._add_package_node(plan, job_id, fmt, index == 0, body, audio, body_has_audio=bool(videos))
+            self._add_preview_node(plan, job_id, formats[0], total_duration, probes)
+            return plan
+        
+        # O corpo do vídeo (sem texto e sem música) fica salvo como master do
+        # job: edições posteriores só refazem overlay e áudio sobre ele
+        master = self._master_info(files_data, property_data, job_id)
+        if len(segments) == 1 and not videos:
+            body = segments[0][0]
+        else:
+            body = self._add_concat_node(plan, segments, scratch_dir, pipe_to=None, output_path=master['path'])
+        
+        # Os probes dos vídeos entram nas dependências porque total_duration os lê
+        self._add_finishing_nodes(plan, job_id, formats, text_filter, master, [body, *probes], audio, scratch_dir,
+                                  self.resolve_delivery(property_data), total_duration)
+        return plan
+    
+    def build_edit_plan(self, master, property_data, job_id, scratch_dir, master_digest):
+        """
+        Plano de uma edição: o master do job anterior já tem as imagens e os
+        vídeos processados, então só overlay (texto + formatos), áudio e
+        package rodam de novo (master_digest: SHA-256 do master, chave do cache)
+        """
+        template = self.templates.get(property_data.get('template', 'casa'), self.templates['casa'])
+        music_name = property_data.get('music')
+        music_config = self.music_options.get(music_name)
+        if music_config and self.music_cache.find_source(music_name) is None:
+            print(f"Música não encontrada em {self.music_cache.music_folder}: {music_name}")
+            music_config = None
+        
+        plan = RenderPlan(job_id)
+        master_path = master['path']
+        
+        async def probe(results):
+            return await self._probe_media(master_path)
+        
+        plan.add(RenderNode(
+            'probe_master', 'probe',
+            action=probe,
+            inputs=[master_path],
+            cache_params=master_digest,
+            estimated_cost=0.1
+        ))
+        
+        audio = None
+        if music_config:
+            audio = self._add_audio_node(plan, music_name, music_config, ['probe_master'], 0,
+                                         lambda results: results['probe_master']['duration'], scratch_dir)
+        
+        self._add_finishing_nodes(plan, job_id, self.resolve_output_formats(property_data),
+                                  self._build_text_filter(property_data, template), master, ['probe_master'], audio,
+                                  scratch_dir, self.resolve_delivery(property_data),
+                                  lambda results: results['probe_master']['duration'])
+        return plan
+    
+    def _add_finishing_nodes(self, plan, job_id, formats, text_filter, master, depends_on, audio, scratch_dir,
+                             delivery=None, duration=None):
+        """
+        Overlay (texto + um ramo por formato) sobre o master e package de cada formato.
+        
+        delivery: metas de tamanho/bitrate (resolve_delivery); o overlay é a
+        codificação final do vídeo, então o controle de taxa é aplicado nele,
+        com o bitrate calculado a partir da duração do vídeo
+        (duration: função que recebe os resultados das etapas anteriores;
+        as etapas que ela lê precisam estar em depends_on).
+        
+        O pôster e o sprite de miniaturas saem da mesma execução, de um ramo
+        (split) do formato principal, sem decodificar o vídeo de novo; o
+        índice do sprite é uma etapa à parte, depois dessa execução.
+        """
+        # Um único formato segue por pipe até o package; com vários, cada
+        # ramo do overlay grava seu MPEG-TS no rascunho
+        piped = len(formats) == 1
+        graph, labels = self._build_format_graph(formats, '0:v', text_filter=text_filter)
+        thread_options = ['-threads', str(self._x264_threads(len(formats)))]
+        primary_slug = self.format_slug(formats[0])
+        graph += f";[{labels[formats[0]]}]split[main_{primary_slug}][preview_{primary_slug}]"
+        labels[formats[0]] = f'main_{primary_slug}'
+        previews = self.preview_paths(job_id)
+        format_outputs = {
+            fmt: 'pipe:1' if piped else os.path.join(scratch_dir, f'overlay_{self.format_slug(fmt)}.ts')
+            for fmt in formats
+        }
+        
+        def command(results):
+            rate_options = self._rate_control_options(delivery, duration(results)) if delivery else []
+            preview_filters, output_options = self._preview_outputs(f'preview_{primary_slug}', formats[0],
+                                                                    duration(results), previews)
+            for fmt in formats:
+                output_options += [
+                    '-map', f'[{labels[fmt]}]', '-map', '0:a?',
+                    '-c:v', 'libx264',
+                    *rate_options,
+                    *thread_options,
+                    '-pix_fmt', 'yuv420p',
+                    '-vsync', 'vfr',  # Não duplicar os frames do slideshow
+                    '-c:a', 'copy',
+                    '-f', 'mpegts', format_outputs[fmt]
+                ]
+            return [
+                'ffmpeg', '-y',
+                '-f', 'mpegts', '-i', master['path'],
+                '-filter_complex', ';'.join([graph, *preview_filters]),
+                *output_options
+            ]
+        
+        overlay = plan.add(RenderNode(
+            'overlay', 'overlay',
+            command=command,
+            inputs=[master['path']],
+            outputs=[] if piped else list(format_outputs.values()),
+            depends_on=depends_on,
+            pipe_to=f'package_{self.format_slug(formats[0])}' if piped else None,
+            cache_params=f"{text_filter}|{formats}|{delivery}|{sorted(previews)}",
+            # Decodificação é compartilhada entre os formatos; só o encode multiplica
+            estimated_cost=0.3 + master['frames'] * self.seconds_per_frame * len(formats)
+        ), target=not piped)
+        
+        for index, fmt in enumerate(formats):
+            self._add_package_node(plan, job_id, fmt, index == 0, 'overlay', audio,
+                                   body_has_audio=master['has_audio'],
+                                   body_path=None if piped else format_outputs[fmt])
+        
+        # Pôster e sprite entram no cache com a última etapa do grupo do
+        # overlay: o package (pipe) ou o próprio overlay, que aí também é alvo
+        previews_owner = plan.nodes[f'package_{primary_slug}'] if piped else overlay
+        previews_owner.outputs += [path for name, path in previews.items() if name != 'sprite_vtt']
+        self._add_sprite_vtt_node(plan, formats[0], previews, duration, [previews_owner.node_id, *depends_on])
+    
+    def master_path(self, job_id):
+        return f"{self.output_folder}/master_{job_id}.ts"
+    
+    def preview_paths(self, job_id):
+        """
+        Pôster (JPEG e, se o ffmpeg tiver libwebp, WebP) e sprite de
+        miniaturas com seu índice WebVTT, ao lado do vídeo final
+        """
+        base = f"{self.output_folder}/final_{job_id}"
+        paths = {'poster': f"{base}_poster.jpg"}
+        if self.capabilities.get('encoders', {}).get('libwebp'):
+            paths['poster_webp'] = f"{base}_poster.webp"
+        paths['sprite'] = f"{base}_sprite.jpg"
+        paths['sprite_vtt'] = f"{base}_sprite.vtt"
+        return paths
+    
+    def _preview_layout(self, fmt, duration):
+        """
+        Grade do sprite: uma miniatura a cada `interval` segundos (no máximo
+        PREVIEW_MAX_THUMBS), PREVIEW_SPRITE_COLUMNS por linha
+        """
+        width, height = (int(value) for value in OUTPUT_FORMATS[fmt]['size'].split('x'))
+        interval = max(PREVIEW_MIN_INTERVAL, math.ceil(duration / PREVIEW_MAX_THUMBS))
+        count = max(1, math.ceil(duration / interval))
+        columns = min(PREVIEW_SPRITE_COLUMNS, count)
+        return {
+            'interval': interval,
+            'count': count,
+            'columns': columns,
+            'rows': math.ceil(count / columns),
+            'width': PREVIEW_THUMB_WIDTH,
+            'height': round(PREVIEW_THUMB_WIDTH * height / width / 2) * 2
+        }
+    
+    def _preview_outputs(self, input_label, fmt, duration, previews):
+        """
+        Ramos do filter_complex e saídas do ffmpeg que gravam o pôster
+        (primeiro quadro) e o sprite de miniaturas a partir de input_label.
+        Retorna (cadeias de filtros, opções de saída).
+        """
+        layout = self._preview_layout(fmt, duration)
+        posters = [name for name in ('poster', 'poster_webp') if name in previews]
+        chains = [
+            f"[{input_label}]split={len(posters) + 1}" + ''.join(f"[{name}]" for name in posters) + "[sprite_in]",
+            f"[sprite_in]fps=1/{layout['interval']},scale={layout['width']}:{layout['height']},"
+            f"tile={layout['columns']}x{layout['rows']}[sprite]"
+        ]
+        output_options = ['-map', '[poster]', '-frames:v', '1', '-q:v', '3', '-update', '1', previews['poster']]
+        if 'poster_webp' in previews:
+            output_options += ['-map', '[poster_webp]', '-frames:v', '1', '-c:v', 'libwebp', '-quality', '80',
+                               previews['poster_webp']]
+        output_options += ['-map', '[sprite]', '-frames:v', '1', '-q:v', '5', '-update', '1', previews['sprite']]
+        return chains, output_options
+    
+    def _write_sprite_vtt(self, path, sprite_name, layout, duration):
+        """Índice WebVTT do sprite: um cue por miniatura (sprite.jpg#xywh=...)"""
+        def timestamp(seconds):
+            milliseconds = int(round(seconds * 1000))
+            hours, milliseconds = divmod(milliseconds, 3600000)
+            minutes, milliseconds = divmod(milliseconds, 60000)
+            return f"{hours:02d}:{minutes:02d}:{milliseconds / 1000:06.3f}"
+        
+        lines = ['WEBVTT', '']
+        for index in range(layout['count']):
+            start = index * layout['interval']
+            end = min(start + layout['interval'], max(duration, start + 1))
+            x = (index % layout['columns']) * layout['width']
+            y = (index // layout['columns']) * layout['height']
+            lines += [
+                f"{timestamp(start)} --> {timestamp(end)}",
+                f"{sprite_name}#xywh={x},{y},{layout['width']},{layout['height']}",
+                ''
+            ]
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines))
+    
+    def _add_sprite_vtt_node(self, plan, fmt, previews, duration, depends_on):
+        """
+        Índice WebVTT do sprite, escrito só depois que a etapa que grava o
+        sprite (primeira de depends_on) terminou com sucesso: uma
+        renderização que falha não deixa um .vtt apontando para um sprite
+        que não existe
+        """
+        async def write_index(results):
+            layout = self._preview_layout(fmt, duration(results))
+            # Caminho relativo: o .vtt é servido ao lado do sprite (/api/download/<job>/sprite.jpg)
+            # e continua válido quando a saída é restaurada do cache para outro job
+            self._write_sprite_vtt(previews['sprite_vtt'], 'sprite.jpg', layout, duration(results))
+            return [previews['sprite_vtt']]
+        
+        plan.add(RenderNode(
+            'sprite_vtt', 'sprite_vtt',
+            action=write_index,
+            outputs=[previews['sprite_vtt']],
+            depends_on=depends_on,
+            cache_params=fmt
+        ), target=True)
+    
+    def _add_preview_node(self, plan, job_id, fmt, duration, probes):
+        """
+        Pôster e sprite no modo em trechos: lá não existe uma codificação
+        final do vídeo inteiro (os trechos são só concatenados), então o MP4
+        principal é lido uma vez, decodificando apenas os keyframes.
+        probes: etapas lidas por duration (rodam mesmo se o package vier do cache)
+        """
+        package = plan.nodes[f'package_{self.format_slug(fmt)}']
+        previews = self.preview_paths(job_id)
+        
+        def command(results):
+            filters, output_options = self._preview_outputs('0:v', fmt, duration(results), previews)
+            return [
+                'ffmpeg', '-y',
+                '-skip_frame', 'nokey',
+                '-i', package.outputs[0],
+                '-filter_complex', ';'.join(filters),
+                *output_options
+            ]
+        
+        plan.add(RenderNode(
+            'previews', 'previews',
+            command=command,
+            inputs=[package.outputs[0]],
+            outputs=[path for name, path in previews.items() if name != 'sprite_vtt'],
+            depends_on=[package.node_id, *probes],
+            cache_params=f"{fmt}|{sorted(previews)}",
+            estimated_cost=0.5
+        ), target=True)
+        self._add_sprite_vtt_node(plan, fmt, previews, duration, ['previews', *probes])
+    
+    def _master_info(self, files_data, property_data, job_id):
+        """
+        Descrição do master sem texto e sem música do job, ou None no modo em
+        trechos (lá o texto é gravado junto com cada trecho)
+        """
+        images = [f for f in files_data if f['type'] == 'image']
+        videos = [f for f in files_data if f['type'] == 'video']
+        if self._use_chunked_mode(images, videos, property_data):
+            return None
+        
+        template_name = property_data.get('template', 'casa')
+        if template_name not in self.templates:
+            template_name = 'casa'
+        template = self.templates[template_name]
+        # Frames a recodificar no overlay (slideshow estático tem 1 frame por imagem)
+        frames = len(images) if not template.get('ken_burns') else len(images) * template['duration_per_image'] * 30
+        frames += len(videos) * 10 * 30
+        return {
+            'path': self.master_path(job_id),
+            'template': template_name,
+            'has_audio': bool(videos),
+            'frames': frames
+        }
+    
+    def can_reuse_master(self, master, property_data):
+        """
+        O master serve para o pedido se ainda existir e se o template pedido
+        processa as imagens e vídeos do mesmo jeito (só o estilo do texto muda)
+        """
+        if not master or not os.path.exists(master['path']):
+            return False
+        previous = self.templates.get(master['template'])
+        requested = self.templates.get(property_data.get('template', 'casa'), self.templates['casa'])
+        if previous is None:
+            return False
+        return all(previous.get(key) == requested.get(key)
+                   for key in ('filters', 'duration_per_image', 'ken_burns'))
+    
+    def resolve_output_formats(self, property_data):
+        """
+        Formatos a gerar: os pedidos no campo 'formats' (ex.: "16:9,9:16")
+        que o template oferece, ou todos os do template se nada for pedido.
+        O primeiro é o formato principal (download padrão).
+        """
+        template = self.templates.get(property_data.get('template', 'casa'), self.templates['casa'])
+        available = template.get('output_formats', ['16:9'])
+        requested = []
+        for value in str(property_data.get('formats') or '').split(','):
+            fmt = self.normalize_format(value)
+            if fmt in available and fmt not in requested:
+                requested.append(fmt)
+        return requested or list(available)
+    
+    def resolve_delivery(self, property_data):
+        """
+        Metas do modo de entrega: 'target_size_mb' (tamanho máximo de cada
+        MP4) e/ou 'max_bitrate_kbps' (bitrate total máximo).
+        Retorna {'target_size': bytes ou None, 'max_bitrate': kbps ou None},
+        None se nenhuma meta foi pedida, ou lança ValueError se forem inválidas.
+        """
+        values = {}
+        for field in ('target_size_mb', 'max_bitrate_kbps'):
+            value = str(property_data.get(field) or '').strip().replace(',', '.')
+            if not value:
+                values[field] = None
+                continue
+            try:
+                values[field] = float(value)
+            except ValueError:
+                raise ValueError(f'Valor inválido para {field}: {value}')
+            if not math.isfinite(values[field]) or values[field] <= 0:
+                raise ValueError(f'Valor inválido para {field}: {value}')
+        
+        if values['target_size_mb'] is None and values['max_bitrate_kbps'] is None:
+            return None
+        return {
+            'target_size': int(values['target_size_mb'] * 1024 * 1024) if values['target_size_mb'] else None,
+            'max_bitrate': int(values['max_bitrate_kbps']) if values['max_bitrate_kbps'] else None
+        }
+    
+    def _rate_control_options(self, delivery, duration):
+        """
+        Opções do x264 para as metas do modo de entrega (VBR restrito, em
+        uma passada: o overlay e o package são ligados por pipe).
+        
+        Com tamanho-alvo, o bitrate médio do vídeo é o que cabe no arquivo
+        depois de descontar o áudio, e o VBV (maxrate/bufsize) impede que o
+        encoder passe da meta. Só com bitrate máximo, a qualidade continua
+        definida pelo CRF e o VBV apenas limita os picos.
+        """
+        limits = []
+        if delivery['max_bitrate']:
+            limits.append(delivery['max_bitrate'] - DELIVERY_AUDIO_KBPS)
+        if delivery['target_size']:
+            total_kbps = delivery['target_size'] * 8 * DELIVERY_SIZE_MARGIN / max(duration, 1) / 1000
+            limits.append(total_kbps - DELIVERY_AUDIO_KBPS)
+        video_kbps = max(DELIVERY_MIN_VIDEO_KBPS, int(min(limits)))
+        
+        if delivery['target_size']:
+            # bufsize de 1 s: a média do arquivo fica no máximo 1 s acima da meta
+            return ['-b:v', f'{video_kbps}k', '-maxrate', f'{video_kbps}k', '-bufsize', f'{video_kbps}k']
+        return ['-crf', '23', '-maxrate', f'{video_kbps}k', '-bufsize', f'{video_kbps * 2}k']
+    
+    def normalize_format(self, value):
+        """Aceita '9:16' ou '9x16'; retorna o formato canônico ou None se desconhecido"""
+        fmt = str(value).strip().lower().replace('x', ':')
+        return fmt if fmt in OUTPUT_FORMATS else None
+    
+    def format_slug(self, fmt):
+        """Versão do formato segura para nomes de arquivo e URLs (9:16 -> 9x16)"""
+        return fmt.replace(':', 'x')
+    
+    def _build_format_graph(self, formats, input_label, pre_filters=None, text_filter=None):
+        """
+        Monta o filter_complex que aplica os filtros comuns uma única vez e
+        divide (split) os quadros em um ramo por formato, com o texto
+        aplicado depois do recorte para ficar dentro de cada enquadramento.
+        Retorna (filtergraph, rótulo de saída por formato).
+        """
+        slugs = [self.format_slug(fmt) for fmt in formats]
+        head = f"[{input_label}]{pre_filters or 'null'}"
+        if len(formats) > 1:
+            chains = [head + f",split={len(formats)}" + ''.join(f"[in_{slug}]" for slug in slugs)]
+        else:
+            chains = [head + f"[in_{slugs[0]}]"]
+        
+        labels = {}
+        for fmt, slug in zip(formats, slugs):
+            text = f",{text_filter}" if text_filter else ''
+            source, output = f"in_{slug}", f"out_{slug}"
+            if fmt == '1:1':
+                # Recorte central do quadro 16:9
+                chains.append(f"[{source}]crop=ih:ih{text}[{output}]")
+            elif fmt == '9:16':
+                # Quadro inteiro centralizado sobre um fundo desfocado (reduzido antes
+                # do blur para ficar barato)
+                chains.append(f"[{source}]split[bg_{slug}][fg_{slug}]")
+                chains.append(f"[bg_{slug}]crop=ih*9/16:ih,scale=72:128,boxblur=4,scale=720:1280,setsar=1[bgs_{slug}]")
+                chains.append(f"[fg_{slug}]scale=720:-2,setsar=1[fgs_{slug}]")
+                chains.append(f"[bgs_{slug}][fgs_{slug}]overlay=(W-w)/2:(H-h)/2{text}[{output}]")
+            else:
+                chains.append(f"[{source}]{text_filter or 'null'}[{output}]")
+            labels[fmt] = output
+        return ';'.join(chains), labels
+    
+    def _use_chunked_mode(self, images, videos, property_data=None):
+        """
+        Divide a codificação em trechos quando o job é grande e há mais de
+        um encoder disponível. Com meta de tamanho/bitrate (modo de entrega)
+        o vídeo é codificado de uma vez, para o controle de taxa valer para
+        o arquivo inteiro.
+        """
+        if property_data and self.resolve_delivery(property_data):
+            return False
+        return len(images) + len(videos) >= self.chunk_min_files and self.engine.max_concurrency > 1
+    
+    def _split_chunks(self, image_nodes):
+        """
+        Divide os slides em trechos contíguos, um por encoder disponível
+        """
+        per_chunk = max(2, math.ceil(len(image_nodes) / self.engine.max_concurrency))
+        return [image_nodes[start:start + per_chunk] for start in range(0, len(image_nodes), per_chunk)]
+    
+    def _x264_threads(self, encoders_per_run=1):
+        """
+        Threads do x264 por encoder: cada vaga do motor fica com a sua parte
+        dos núcleos, dividida entre os encoders da mesma execução (um por formato)
+        """
+        return max(1, self.capabilities['cpu_count'] // (self.engine.max_concurrency * encoders_per_run))
+    
+    def _add_image_nodes(self, plan, images, template, scratch_dir):
+        """
+        Aplica os filtros do template em cada imagem uma única vez
+        (saída reaproveitável pelo cache entre jobs com a mesma foto)
+        """
+        filters = template['filters']
+        node_ids = []
+        for index, image in enumerate(images):
+            output_path = os.path.join(scratch_dir, f"image_{index}.png")
+            node = plan.add(RenderNode(
+                f'normalize_image_{index}', 'normalize_image',
+                command=['ffmpeg', '-y', '-i', image['path'], '-vf', filters, '-frames:v', '1', output_path],
+                inputs=[image['path']],
+                outputs=[output_path],
+                cache_params=f"{media_sha256(image)}|{filters}",
+                estimated_cost=0.2
+            ))
+            node_ids.append(node.node_id)
+        return node_ids
+    
+    def _add_slideshow_node(self, plan, node_id, image_nodes, template, scratch_dir, is_last,
+                            text_filter=None, x264_threads=None, formats=None, output_path=None,
+                            silent_audio=False):
+        """
+        Slideshow a partir das imagens já normalizadas.
+        
+        Como o conteúdo é estático, cada imagem é codificada uma única vez
+        (frame rate variável) com o tuning de imagem parada do x264 e um
+        keyframe no início de cada slide. O efeito Ken Burns (movimento)
+        só é aplicado quando o template pede, e aí sim gera 30 fps reais.
+        
+        silent_audio dá ao segmento (GOP fechado) uma trilha silenciosa, para
+        ser concatenado com os vídeos, que têm áudio; só com imagens o vídeo
+        sai sem trilha (ou só com a música, no package).
+        text_filter aplica o texto do imóvel na mesma codificação (modo em trechos).
+        formats gera um segmento por formato de saída a partir da mesma decodificação
+        (modo em trechos). output_path grava o segmento fora do rascunho (master do job).
+        """
+        duration = template['duration_per_image']
+        ken_burns = template.get('ken_burns', False)
+        image_paths = [plan.nodes[image_node].outputs[0] for image_node in image_nodes]
+        
+        # Criar arquivo de lista de imagens com transições
+        image_list_file = os.path.join(scratch_dir, f'{node_id}.txt')
+        with open(image_list_file, 'w') as f:
+            for image_path in image_paths:
+                f.write(f"file '{os.path.abspath(image_path)}'\n")
+                f.write(f"duration {duration}\n")
+            # Repetir a última imagem (o zoompan já gera a duração de cada slide)
+            if is_last and not ken_burns:
+                f.write(f"file '{os.path.abspath(image_paths[-1])}'\n")
+        
+        filters = []
+        if ken_burns:
+            frames_per_image = int(duration * 30)
+            filters.append(
+                f"zoompan=z='min(zoom+{0.15 / frames_per_image:.6f},1.15)'"
+                ":x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+                f":d={frames_per_image}:s=1280x720:fps=30"
+            )
+            rate_options = ['-g', str(frames_per_image)]
+            frames = len(image_paths) * frames_per_image
+        else:
+            # Um frame por imagem; -r 30 só define a base de tempo
+            rate_options = ['-tune', 'stillimage', '-vsync', 'vfr']
+            frames = len(image_paths)
+        thread_options = ['-threads', str(x264_threads or self._x264_threads(len(formats or [None])))]
+        video_options = [
+            '-c:v', 'libx264',
+            *rate_options,
+            *thread_options,
+            '-flags', '+cgop',
+            # Um keyframe por slide; a cópia final da última imagem não ganha um
+            '-force_key_frames', f'expr:lt(n_forced,{len(image_paths)})*gte(t,n_forced*{duration})',
+            '-r', '30',
+            '-pix_fmt', 'yuv420p'
+        ]
+        audio_input = []
+        audio_options = []
+        if silent_audio:
+            audio_input = ['-f', 'lavfi', '-t', str(len(image_paths) * duration), '-i', 'anullsrc=r=48000:cl=stereo']
+            audio_options = ['-c:a', 'aac', '-b:a', '128k']
+        outputs = []
+        
+        if formats:
+            graph, labels = self._build_format_graph(formats, '0:v', ','.join(filters) or None, text_filter)
+            filter_options = ['-filter_complex', graph]
+            output_options = []
+            audio_map = ['-map', '1:a'] if silent_audio else []
+            for fmt in formats:
+                output = os.path.join(scratch_dir, f'{node_id}_{self.format_slug(fmt)}.ts')
+                outputs.append(output)
+                output_options += ['-map', f'[{labels[fmt]}]', *audio_map, *video_options, *audio_options,
+                                   '-f', 'mpegts', output]
+        else:
+            if text_filter:
+                filters.append(text_filter)
+            filter_options = ['-vf', ','.join(filters)] if filters else []
+            output = output_path or os.path.join(scratch_dir, f'{node_id}.ts')
+            outputs.append(output)
+            output_options = [*video_options, *audio_options, '-f', 'mpegts', output]
+        
+        node = plan.add(RenderNode(
+            node_id, 'slideshow',
+            command=[
                 'ffmpeg', '-y',
                 '-f', 'concat',
                 '-safe', '0',
                 '-i', image_list_file,
-                '-vf', filters,
-                '-c:v', 'libx264',
-                '-r', '30',
-                '-pix_fmt', 'yuv420p',
-                output_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                os.remove(image_list_file)
-                return output_path
-            else:
-                print(f"Erro FFmpeg slideshow: {result.stderr}")
-                return None
-                
-        except Exception as e:
-            print(f"Erro ao criar slideshow: {str(e)}")
-            return None
+                *audio_input,
+                *filter_options,
+                *output_options
+            ],
+            inputs=image_paths,
+            outputs=outputs,
+            depends_on=image_nodes,
+            cache_params=f"{duration}|{ken_burns}|{is_last}|{text_filter}|{formats}|{silent_audio}",
+            estimated_cost=0.3 + frames * self.seconds_per_frame * len(formats or [None])
+        ))
+        return node.node_id
     
-    def _process_video_with_template(self, video_data, template, job_id):
+    def _add_clip_nodes(self, plan, index, video_data, template, scratch_dir, text_filter=None, x264_threads=None,
+                        formats=None):
         """
-        Processa um vídeo individual aplicando filtros do template
+        Probe + normalização de um vídeo enviado (filtros do template,
+        30 fps, no máximo 10 segundos, sempre com trilha de áudio).
+        text_filter e formats: texto e um segmento por formato de saída na
+        mesma codificação (modo em trechos).
         """
-        try:
-            input_path = video_data['path']
-            output_path = f"{self.output_folder}/processed_{video_data['id']}_{job_id}.mp4"
-            filters = template['filters']
+        input_path = video_data['path']
+        source_hash = media_sha256(video_data)
+        
+        async def probe(results):
+            return await self._probe_media(input_path)
+        
+        probe_node = plan.add(RenderNode(
+            f'probe_clip_{index}', 'probe',
+            action=probe,
+            inputs=[input_path],
+            cache_params=source_hash,
+            estimated_cost=0.1
+        ))
+        
+        filters = template['filters']
+        if formats:
+            output_paths = [
+                os.path.join(scratch_dir, f"processed_{video_data['id']}_{self.format_slug(fmt)}.ts")
+                for fmt in formats
+            ]
+            graph, labels = self._build_format_graph(formats, '0:v:0', filters, text_filter)
+            filter_options = ['-filter_complex', graph]
+            video_maps = [['-map', f'[{labels[fmt]}]'] for fmt in formats]
+        else:
+            output_paths = [os.path.join(scratch_dir, f"processed_{video_data['id']}.ts")]
+            if text_filter:
+                filters += f",{text_filter}"
+            filter_options = ['-vf', filters]
+            video_maps = [['-map', '0:v:0']]
+        thread_options = ['-threads', str(x264_threads or self._x264_threads(len(formats or [None])))]
+        
+        def command(results):
+            media_info = results[probe_node.node_id]
+            duration = min(media_info['duration'], 10)  # Limitar a 10 segundos
             
-            cmd = [
+            # Todos os segmentos precisam ter áudio para a concatenação
+            audio_input = []
+            if not media_info['has_audio']:
+                audio_input = ['-f', 'lavfi', '-i', 'anullsrc=r=48000:cl=stereo']
+            
+            output_options = []
+            for video_map, output_path in zip(video_maps, output_paths):
+                output_options += [
+                    *video_map,
+                    '-map', '0:a:0' if media_info['has_audio'] else '1:a:0',
+                    '-c:v', 'libx264',
+                    *thread_options,
+                    '-flags', '+cgop',
+                    '-c:a', 'aac',
+                    '-b:a', '128k',
+                    '-ar', '48000',
+                    '-ac', '2',
+                    '-r', '30',
+                    '-pix_fmt', 'yuv420p',
+                    '-t', str(duration),
+                    '-f', 'mpegts',
+                    output_path
+                ]
+            return [
                 'ffmpeg', '-y',
                 '-i', input_path,
-                '-vf', filters,
-                '-c:v', 'libx264',
-                '-c:a', 'aac',
-                '-r', '30',
-                '-t', '10',  # Limitar a 10 segundos
-                output_path
+                *audio_input,
+                *filter_options,
+                *output_options
             ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                return output_path
-            else:
-                print(f"Erro FFmpeg processo: {result.stderr}")
-                return None
-                
-        except Exception as e:
-            print(f"Erro ao processar vídeo: {str(e)}")
-            return None
+        
+        clip_node = plan.add(RenderNode(
+            f'normalize_clip_{index}', 'normalize_clip',
+            command=command,
+            inputs=[input_path],
+            outputs=output_paths,
+            depends_on=[probe_node.node_id],
+            cache_params=f"{filters}|{text_filter}|{formats}",
+            estimated_cost=0.3 + 10 * 30 * self.seconds_per_frame * len(output_paths)
+        ))
+        return probe_node.node_id, clip_node.node_id
     
-    def _concatenate_videos_with_transitions(self, video_paths, template, job_id):
+    def _add_concat_node(self, plan, segments, scratch_dir, pipe_to, node_id='concat', output_index=0,
+                         output_path=None):
         """
-        Concatena vídeos com efeitos de transição
+        Junta os segmentos MPEG-TS sem recodificar (demuxer concat, com a
+        duração de cada segmento explícita para os timestamps ficarem
+        contínuos) e envia o resultado por pipe para a próxima etapa
+        (ou grava em output_path, quando pipe_to é None).
+        
+        segments: lista de (etapa, duração em segundos ou etapa de probe)
+        output_index: qual saída de cada segmento usar (um formato por saída)
         """
-        try:
-            if len(video_paths) == 1:
-                return video_paths[0]
-            
-            # Para simplificar, usar concatenação simples
-            # Em versão futura, implementar transições complexas
-            concat_file = f"{self.output_folder}/concat_{job_id}.txt"
-            with open(concat_file, 'w') as f:
-                for video_path in video_paths:
-                    f.write(f"file '{os.path.abspath(video_path)}'\n")
-            
-            output_path = f"{self.output_folder}/concatenated_{job_id}.mp4"
-            
-            cmd = [
+        list_file = os.path.join(scratch_dir, f'{node_id}.txt')
+        segment_paths = [os.path.abspath(plan.nodes[segment].outputs[output_index]) for segment, _ in segments]
+        output = output_path if pipe_to is None else 'pipe:1'
+        
+        def command(results):
+            with open(list_file, 'w') as f:
+                for path, (_, duration) in zip(segment_paths, segments):
+                    if isinstance(duration, str):
+                        duration = min(results[duration]['duration'], 10)
+                    f.write(f"file '{path}'\n")
+                    f.write(f"duration {duration:.3f}\n")
+            return [
                 'ffmpeg', '-y',
                 '-f', 'concat',
                 '-safe', '0',
-                '-i', concat_file,
+                '-i', list_file,
+                '-map', '0',
                 '-c', 'copy',
-                output_path
+                '-f', 'mpegts', output
             ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                os.remove(concat_file)
-                return output_path
-            else:
-                print(f"Erro FFmpeg concatenação: {result.stderr}")
-                return video_paths[0]
-                
-        except Exception as e:
-            print(f"Erro ao concatenar vídeos: {str(e)}")
-            return video_paths[0] if video_paths else None
+        
+        node = plan.add(RenderNode(
+            node_id, 'concat',
+            command=command,
+            inputs=segment_paths,
+            outputs=[output_path] if pipe_to is None else [],
+            depends_on=[segment for segment, _ in segments] + [
+                duration for _, duration in segments if isinstance(duration, str)
+            ],
+            pipe_to=pipe_to,
+            cache_params=str(output_index),
+            estimated_cost=0.3,
+            encoder=False
+        ))
+        return node.node_id
     
-    def _add_property_info_styled(self, video_path, property_data, template, job_id):
+    def _add_audio_node(self, plan, music_name, music_config, probes, slideshow_duration, total_duration,
+                        scratch_dir):
         """
-        Adiciona informações do imóvel com estilo do template
+        Prepara a trilha de música do job: a faixa já vem normalizada e em AAC
+        do cache; aqui só fazemos corte, volume e fades (roda em paralelo
+        com o vídeo)
         """
-        try:
-            output_path = f"{self.output_folder}/with_text_{job_id}.mp4"
-            text_style = template['text_style']
-            
-            # Criar texto com informações do imóvel
-            info_text = f"{property_data['name']}"
-            if property_data['area']:
-                info_text += f" - {property_data['area']}m²"
-            if property_data['price']:
-                info_text += f" - R$ {property_data['price']}"
-            if property_data['location']:
-                info_text += f"\\n{property_data['location']}"
-            
-            # Construir filtro de texto com estilo
-            text_filter = f"drawtext=text='{info_text}'"
-            for key, value in text_style.items():
-                text_filter += f":{key}={value}"
-            text_filter += ":x=(w-text_w)/2:y=h-text_h-20"
-            
-            cmd = [
+        output_path = os.path.join(scratch_dir, 'music.m4a')
+        source = self.music_cache.find_source(music_name)
+        
+        async def command(results):
+            track_path = await self.music_cache.get_track(music_name)
+            if track_path is None:
+                raise Exception(f"Falha ao preparar a música {music_name}")
+            duration = total_duration(results)
+            fade_out_start = max(0, duration - music_config['fade_out'])
+            return [
                 'ffmpeg', '-y',
-                '-i', video_path,
-                '-vf', text_filter,
-                '-c:a', 'copy',
+                '-stream_loop', '-1',  # Repetir a faixa se o vídeo for mais longo
+                '-i', track_path,
+                '-af', (
+                    f"atrim=0:{duration:.3f},asetpts=PTS-STARTPTS,"
+                    f"volume={music_config['volume']},"
+                    f"afade=t=in:st=0:d={music_config['fade_in']},"
+                    f"afade=t=out:st={fade_out_start:.3f}:d={music_config['fade_out']}"
+                ),
+                '-c:a', 'aac',
+                '-b:a', '160k',
                 output_path
             ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                return output_path
-            else:
-                print(f"Erro FFmpeg texto: {result.stderr}")
-                return video_path
-                
-        except Exception as e:
-            print(f"Erro ao adicionar texto: {str(e)}")
-            return video_path
+        
+        node = plan.add(RenderNode(
+            'audio', 'audio',
+            command=command,
+            inputs=[source],
+            outputs=[output_path],
+            depends_on=probes,
+            cache_params=f"{self.music_cache.cache_path(music_name, source)}|{music_config}|{slideshow_duration}",
+            estimated_cost=0.5
+        ))
+        return node.node_id
     
-    def _add_background_music(self, video_path, music_config, job_id):
+    def _add_package_node(self, plan, job_id, fmt, primary, body, audio, body_has_audio, body_path=None):
         """
-        Adiciona música de fundo com configurações específicas
+        Grava o MP4 final de um formato: vídeo copiado da etapa anterior (por
+        pipe, ou de body_path no rascunho) + trilha de áudio. O formato
+        principal fica em final_<job>.mp4 e os demais em final_<job>_<formato>.mp4.
         """
-        try:
-            # Por enquanto, retornar o vídeo sem música
-            # Em implementação futura, adicionar arquivos de música reais
-            output_path = f"{self.output_folder}/final_{job_id}.mp4"
-            
-            # Simular adição de música copiando o arquivo
-            cmd = [
+        slug = self.format_slug(fmt)
+        suffix = '' if primary else f'_{slug}'
+        output_path = f"{self.output_folder}/final_{job_id}{suffix}.mp4"
+        body_input = ['-i', body_path] if body_path else ['-i', 'pipe:0']
+        depends_on = [body]
+        audio_input = []
+        audio_options = []
+        
+        if audio:
+            depends_on.append(audio)
+            audio_input = ['-i', plan.nodes[audio].outputs[0]]
+            if body_has_audio:
+                # Mantém o áudio original dos vídeos por baixo da música
+                audio_options = [
+                    '-filter_complex', '[0:a][1:a]amix=inputs=2:duration=first:dropout_transition=0[aout]',
+                    '-map', '[aout]', '-c:a', 'aac', '-b:a', '160k'
+                ]
+            else:
+                audio_options = ['-map', '1:a', '-c:a', 'copy']
+        elif body_has_audio:
+            audio_options = ['-map', '0:a', '-c:a', 'copy']
+        
+        plan.add(RenderNode(
+            f'package_{slug}', 'package',
+            command=[
                 'ffmpeg', '-y',
-                '-i', video_path,
-                '-c', 'copy',
+                '-f', 'mpegts', *body_input,
+                *audio_input,
+                '-map', '0:v',
+                '-c:v', 'copy',
+                *audio_options,
+                '-movflags', '+faststart',
                 output_path
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                return output_path
-            else:
-                print(f"Erro FFmpeg música: {result.stderr}")
-                return video_path
-                
-        except Exception as e:
-            print(f"Erro ao adicionar música: {str(e)}")
-            return video_path
+            ],
+            outputs=[output_path],
+            depends_on=depends_on,
+            cache_params=f"{body_has_audio}|{suffix}",
+            estimated_cost=0.3,
+            encoder=False  # Vídeo copiado; no máximo o áudio é recodificado
+        ), target=True)
+    
+    def _build_text_filter(self, property_data, template):
+        """
+        Monta o filtro de texto com as informações do imóvel no estilo do template
+        """
+        # text_style: estilo de texto de outro template sobre as mesmas imagens
+        text_style = self.templates.get(property_data.get('text_style'), template)['text_style']
+        
+        # Criar texto com informações do imóvel
+        info_text = f"{property_data['name']}"
+        if property_data['area']:
+            info_text += f" - {property_data['area']}m²"
+        if property_data['price']:
+            info_text += f" - R$ {property_data['price']}"
+        if property_data['location']:
+            info_text += f"\\n{property_data['location']}"
+        
+        # Construir filtro de texto com estilo
+        text_filter = f"drawtext=text='{info_text}'"
+        for key, value in text_style.items():
+            text_filter += f":{key}={value}"
+        text_filter += ":x=(w-text_w)/2:y=h-text_h-20"
+        return text_filter
+    
+    async def _probe_media(self, path):
+        """
+        Retorna duração e presença de áudio de um arquivo via ffprobe
+        """
+        cmd = [
+            'ffprobe', '-v', 'error',
+            '-show_entries', 'format=duration:stream=codec_type',
+            '-of', 'json',
+            path
+        ]
+        result = await self.engine.run(cmd, capture_stdout=True, limited=False)
+        if result.returncode != 0:
+            raise Exception(f"ffprobe falhou para {path}: {result.stderr}")
+        
+        info = json.loads(result.stdout)
+        return {
+            'duration': float(info['format']['duration']),
+            'has_audio': any(stream['codec_type'] == 'audio' for stream in info.get('streams', []))
+        }
+    
+    async def warm_up_music_cache(self):
+        """
+        Normaliza e codifica antecipadamente todas as faixas disponíveis
+        """
+        await self.music_cache.prepare_all(self.music_options.keys())
     
     def get_template_info(self):
         """
@@ -327,4 +1138,40 @@ class AdvancedVideoGenerator:
         Retorna informações sobre as opções de música
         """
         return {name: music['name'] for name, music in self.music_options.items()}
+    
+    def get_format_info(self):
+        """
+        Retorna informações sobre os formatos de saída disponíveis
+        """
+        return {fmt: info['name'] for fmt, info in OUTPUT_FORMATS.items()}
+
+
 
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Mostra o plano de renderização (dry-run), sem codificar')
+    parser.add_argument('files', nargs='+', help='Imagens e vídeos, na ordem do vídeo')
+    parser.add_argument('--template', default='casa')
+    parser.add_argument('--music', default='')
+    parser.add_argument('--name', default='Imóvel')
+    parser.add_argument('--area', default='')
+    parser.add_argument('--price', default='')
+    parser.add_argument('--location', default='')
+    parser.add_argument('--formats', default='', help='Ex.: 16:9,1:1,9:16 (padrão: todos do template)')
+    parser.add_argument('--text-style', default='', help='Template cujo estilo de texto será usado')
+    parser.add_argument('--target-size-mb', default='', help='Tamanho máximo de cada MP4 (modo de entrega)')
+    parser.add_argument('--max-bitrate-kbps', default='', help='Bitrate total máximo (modo de entrega)')
+    args = parser.parse_args()
+    
+    files_data = [
+        {
+            'id': str(index),
+            'path': path,
+            'type': 'video' if path.rsplit('.', 1)[-1].lower() in ('mp4', 'avi', 'mov', 'webm') else 'image'
+        }
+        for index, path in enumerate(args.files)
+    ]
+    property_data = {field: getattr(args, field) for field in ('name', 'area', 'price', 'location', 'template', 'music', 'formats', 'text_style',
+                                                       'target_size_mb', 'max_bitrate_kbps')}
+    print(AdvancedVideoGenerator().describe_render_plan(files_data, property_data))
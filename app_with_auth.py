@@ -1,10 +1,19 @@
 from flask import Flask, request, jsonify, send_file, session
 from flask_cors import CORS
 import os
+import math
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 import uuid
-import threading
+import hashlib
 from advanced_video_generator import AdvancedVideoGenerator
+from blob_store import BlobStore
+from job_queue import RenderQueue
+from job_index import JobIndex
+from media_validation import MediaValidator
+from rate_limit import create_rate_limiter
+from render_dedup import SingleFlight, compute_render_key
+from user_store import users_cache, load_users, save_users, get_user_limits, check_user_usage, increment_user_usage
 from datetime import datetime, timedelta
 import json
 
@@ -14,20 +23,21 @@ CORS(app, supports_credentials=True)  # Permitir cookies para sessões
 
 # Configurações
 UPLOAD_FOLDER = 'uploads'
+INCOMING_FOLDER = os.path.join(UPLOAD_FOLDER, 'incoming')  # Arquivos ainda não validados
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'avi', 'mov', 'webm'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
+# Campos que podem ser alterados em /api/jobs/<job_id>/edit
+EDITABLE_FIELDS = ('name', 'area', 'price', 'location', 'template', 'music', 'formats', 'text_style',
+                   'target_size_mb', 'max_bitrate_kbps')
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
 # Criar pastas se não existirem
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(INCOMING_FOLDER, exist_ok=True)
 os.makedirs('generated_videos', exist_ok=True)
-os.makedirs('user_data', exist_ok=True)
-
-# Armazenar dados em arquivos JSON (em produção, usar banco de dados)
-USERS_FILE = 'user_data/users.json'
-USAGE_FILE = 'user_data/usage.json'
 
 # Armazenar status dos jobs em memória
 job_status = {}
@@ -35,79 +45,179 @@ job_status = {}
 # Inicializar gerador de vídeo avançado
 video_generator = AdvancedVideoGenerator()
 
-def load_users():
-    """Carrega dados dos usuários"""
-    try:
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-
-def save_users(users):
-    """Salva dados dos usuários"""
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
-
-def load_usage():
-    """Carrega dados de uso"""
+# Resposta de /api/templates: não muda enquanto o processo roda, então o
+# corpo e o ETag são calculados uma única vez
+TEMPLATES_BODY = json.dumps({
+    'templates': video_generator.get_template_info(),
+    'music': video_generator.get_music_info(),
+    'formats': video_generator.get_format_info()
+})
+TEMPLATES_ETAG = hashlib.sha256(TEMPLATES_BODY.encode()).hexdigest()
+
+# Arquivos enviados, um por conteúdo (compartilhados entre jobs e usuários)
+blob_store = BlobStore(os.path.join(UPLOAD_FOLDER, 'blobs'))
+blob_store.sweep()  # Arquivos órfãos de uma queda anterior
+
+# Validação do conteúdo dos arquivos no upload (antes de ocupar um worker)
+upload_validator = MediaValidator(video_generator.engine)
+
+# Modo de renderização: 'inline' (neste processo) ou 'queue' (workers separados)
+RENDER_MODE = os.environ.get('IMOVIBE_RENDER_MODE', 'inline')
+render_queue = RenderQueue() if RENDER_MODE == 'queue' else None
+
+# Limites de requisições e de renderizações simultâneas (SQLite, compartilhado
+# entre os workers do gunicorn e os workers de renderização)
+rate_limiter = create_rate_limiter()
+
+# Atrás do roteador, o IP do cliente vem do X-Forwarded-For. Só os últimos
+# IMOVIBE_TRUSTED_PROXIES saltos são confiáveis (0 quando o app recebe as
+# conexões diretamente), então o cabeçalho não pode ser forjado pelo cliente.
+TRUSTED_PROXIES = int(os.environ.get('IMOVIBE_TRUSTED_PROXIES', '1'))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
+# Renderizações idênticas em andamento são compartilhadas (single-flight)
+single_flight = SingleFlight()
+
+# Pedido original (arquivos e dados do imóvel) dos jobs renderizados neste processo
+job_requests = {}
+
+# Histórico de jobs por usuário (listagem em /api/jobs)
+job_index = JobIndex()
+JOB_STATUSES = ('processing', 'completed', 'failed')
+
+def reserve_render_slot(user_id, email, job_id):
+    """
+    Reserva (de forma atômica) uma vaga de renderização simultânea do plano.
+    Vídeos em processamento também contam no limite mensal, já que o uso só
+    é incrementado quando o vídeo fica pronto.
+    Retorna None se reservou, ou (mensagem de erro, status HTTP).
+    """
+    limits = get_user_limits(email)
+    slot_limit = limits['concurrent_renders']
+    quota_bound = False
+    if limits['videos_per_month'] > 0:
+        remaining = limits['videos_per_month'] - check_user_usage(user_id)['videos_generated']
+        if remaining <= slot_limit:
+            slot_limit = max(remaining, 0)
+            quota_bound = True
+    
+    if rate_limiter.acquire_slot(f"user:{user_id}", job_id, slot_limit):
+        return None
+    if quota_bound:
+        return 'Limite de vídeos atingido (incluindo vídeos em processamento). Faça upgrade para o plano pago.', 403
+    return (f"Limite de {limits['concurrent_renders']} vídeo(s) em processamento ao mesmo tempo atingido. "
+            "Aguarde um vídeo terminar."), 429
+
+def get_job_status(job_id):
+    """Busca o status do job em memória ou na fila de renderização"""
+    job_id = single_flight.resolve(job_id)
+    if job_id is None:
+        return None
+    if job_id in job_status:
+        return job_status[job_id]
+    if render_queue:
+        return render_queue.get_status(job_id)
+    return None
+
+def get_job_request(job_id):
+    """Busca os arquivos e dados do imóvel usados para renderizar o job"""
+    primary = single_flight.resolve(job_id)
+    if primary is None:
+        return None
+    if primary in job_requests:
+        return job_requests[primary]
+    if render_queue:
+        return render_queue.get_payload(job_id)
+    return None
+
+def find_unknown_formats(formats):
+    """Formatos de saída pedidos (ex.: "16:9,9x16") que o gerador não conhece"""
+    return [fmt for fmt in formats.split(',') if fmt.strip() and video_generator.normalize_format(fmt) is None]
+
+def remove_uploaded_files(files_data):
+    """Remove arquivos enviados que não serão usados"""
+    for file_data in files_data:
+        try:
+            os.remove(file_data['path'])
+        except OSError:
+            pass
+
+def store_uploaded_files(job_id, files_data):
+    """
+    Move os arquivos validados para o armazenamento de blobs, referenciados
+    pelo job. Conteúdo repetido (de qualquer usuário) não ocupa disco de novo.
+    """
     try:
-        with open(USAGE_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-
-def save_usage(usage):
-    """Salva dados de uso"""
-    with open(USAGE_FILE, 'w') as f:
-        json.dump(usage, f, indent=2)
-
-def get_user_limits(user_id):
-    """Retorna os limites do usuário"""
-    users = load_users()
-    user = users.get(user_id, {})
-    
-    if user.get('plan') == 'paid':
-        return {'videos_per_month': -1, 'plan': 'paid'}  # Ilimitado
-    else:
-        return {'videos_per_month': 3, 'plan': 'free'}  # Teste gratuito
-
-def check_user_usage(user_id):
-    """Verifica o uso atual do usuário"""
-    usage = load_usage()
-    user_usage = usage.get(user_id, {'videos_generated': 0, 'last_reset': datetime.now().isoformat()})
-    
-    # Verificar se precisa resetar (novo mês)
-    last_reset = datetime.fromisoformat(user_usage['last_reset'])
-    if datetime.now() - last_reset > timedelta(days=30):
-        user_usage = {'videos_generated': 0, 'last_reset': datetime.now().isoformat()}
-        usage[user_id] = user_usage
-        save_usage(usage)
-    
-    return user_usage
-
-def increment_user_usage(user_id):
-    """Incrementa o uso do usuário"""
-    usage = load_usage()
-    user_usage = usage.get(user_id, {'videos_generated': 0, 'last_reset': datetime.now().isoformat()})
-    user_usage['videos_generated'] += 1
-    usage[user_id] = user_usage
-    save_usage(usage)
+        for file_data in files_data:
+            extension = file_data['filename'].rsplit('.', 1)[1]
+            digest, path = blob_store.store(file_data['path'], extension, job_id)
+            file_data.update({'sha256': digest, 'path': path, 'filename': os.path.basename(path)})
+    except Exception:
+        blob_store.release(job_id)
+        remove_uploaded_files([file_data for file_data in files_data if 'sha256' not in file_data])
+        raise
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_video_async(job_id, files_data, property_data, user_id):
+def start_video_job(job_id, files_data, property_data, user_id, master=None):
     """
-    Processa o vídeo em background
+    Inicia a renderização do job (ou anexa a uma idêntica em andamento).
+    Retorna o job primário se o job virou apelido, ou None.
+    """
+    # O job segura os blobs dos arquivos até ser apagado (edições reaproveitam os do original)
+    blob_store.add_refs(job_id, [file_data['sha256'] for file_data in files_data if 'sha256' in file_data])
+    
+    render_key = compute_render_key(files_data, property_data, owner=user_id)
+    if render_queue:
+        attached_to = render_queue.enqueue(job_id, {
+            'files_data': files_data,
+            'property_data': property_data,
+            'user_id': user_id,
+            'master': master
+        }, dedup_key=render_key)
+        job_index.add(job_id, user_id, property_data, primary_id=attached_to)
+        return attached_to
+    
+    attached_to = single_flight.attach(render_key, job_id)
+    job_index.add(job_id, user_id, property_data, primary_id=attached_to)
+    if attached_to is None:
+        job_requests[job_id] = {'files_data': files_data, 'property_data': property_data, 'user_id': user_id}
+        process_video_async(job_id, files_data, property_data, user_id, master)
+    return attached_to
+
+def process_video_async(job_id, files_data, property_data, user_id, master=None):
+    """
+    Agenda o processamento do vídeo no motor assíncrono do gerador
     """
     try:
         job_status[job_id] = {'status': 'processing', 'progress': 10, 'message': 'Iniciando processamento...'}
         
         job_status[job_id] = {'status': 'processing', 'progress': 30, 'message': 'Processando mídia...'}
         
-        # Gerar vídeo
-        video_path = video_generator.create_property_video(files_data, property_data, job_id)
+        # Gerar vídeo (sem ocupar uma thread por job)
+        future = video_generator.submit_property_video(files_data, property_data, job_id, master)
+        future.add_done_callback(lambda f: finish_video_job(job_id, f, user_id))
+        
+    except Exception as e:
+        rate_limiter.release_slot(job_id)
+        job_status[job_id] = {
+            'status': 'failed', 
+            'progress': 0, 
+            'message': f'Erro: {str(e)}'
+        }
+
+def finish_video_job(job_id, future, user_id):
+    """
+    Atualiza o status do job quando a renderização termina
+    (executado na thread do motor de vídeo)
+    """
+    rate_limiter.release_slot(job_id)
+    try:
+        result = future.result()
+        video_path = result['video_path'] if result else None
         
         if video_path and os.path.exists(video_path):
             # Incrementar uso do usuário
@@ -118,6 +228,12 @@ def process_video_async(job_id, files_data, property_data, user_id):
                 'progress': 100, 
                 'message': 'Vídeo gerado com sucesso!',
                 'video_path': video_path,
+                'video_paths': result['video_paths'],
+                'file_size': result['file_size'],
+                'file_sizes': result['file_sizes'],
+                'delivery': result['delivery'],
+                'previews': result['previews'],
+                'master': result['master'],
                 'user_id': user_id
             }
         else:
@@ -133,6 +249,36 @@ def process_video_async(job_id, files_data, property_data, user_id):
             'progress': 0, 
             'message': f'Erro: {str(e)}'
         }
+    
+    # A chave só é liberada com o status final gravado: um job idêntico que
+    # se anexar até aqui herda o resultado pronto, nunca um "processing"
+    # de um primário que já não está renderizando
+    single_flight.finish(job_id)
+    
+    job_index.update_status(job_id, job_status[job_id]['status'])
+
+# Respostas baratas e cacheáveis (health check, templates com ETag, pôster
+# e sprite imutáveis) não passam pelo token bucket: cada verificação é uma
+# escrita no banco compartilhado dos limites
+RATE_LIMIT_EXEMPT = {'health', 'get_templates', 'download_preview', 'job_thumbnail'}
+
+@app.before_request
+def apply_rate_limits():
+    """
+    Token bucket por endpoint para o IP e para o usuário logado
+    """
+    if request.endpoint is None or request.method == 'OPTIONS' or request.endpoint in RATE_LIMIT_EXEMPT:
+        return None
+    identities = [f"ip:{request.remote_addr}"]
+    if 'user_id' in session:
+        identities.append(f"user:{session['user_id']}")
+    retry_after = rate_limiter.hit(request.endpoint, identities)
+    if retry_after:
+        response = jsonify({'error': 'Muitas requisições. Tente novamente em instantes.'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        return response
+    return None
 
 @app.route('/')
 def hello_world():
@@ -192,13 +338,11 @@ def login():
         if not email:
             return jsonify({'error': 'Email é obrigatório'}), 400
         
-        users = load_users()
+        user = users_cache.get(email)
         
-        if email not in users:
+        if user is None:
             return jsonify({'error': 'Usuário não encontrado'}), 404
         
-        user = users[email]
-        
         # Criar sessão
         session['user_id'] = user['id']
         session['email'] = email
@@ -228,13 +372,11 @@ def get_current_user():
     if 'user_id' not in session:
         return jsonify({'error': 'Usuário não autenticado'}), 401
     
-    users = load_users()
-    email = session['email']
+    user = users_cache.get(session['email'])
     
-    if email not in users:
+    if user is None:
         return jsonify({'error': 'Usuário não encontrado'}), 404
     
-    user = users[email]
     return jsonify({
         'user': {
             'id': user['id'],
@@ -253,7 +395,7 @@ def get_dashboard():
     user_id = session['user_id']
     
     # Obter limites e uso
-    limits = get_user_limits(user_id)
+    limits = get_user_limits(session['email'])
     usage = check_user_usage(user_id)
     
     # Calcular estatísticas
@@ -264,6 +406,7 @@ def get_dashboard():
         'usage': {
             'videos_generated': videos_generated,
             'videos_remaining': videos_remaining,
+            'videos_in_progress': rate_limiter.in_flight(f"user:{user_id}"),
             'plan': limits['plan'],
             'last_reset': usage['last_reset']
         },
@@ -280,7 +423,7 @@ def upload_files():
         user_id = session['user_id']
         
         # Verificar limites
-        limits = get_user_limits(user_id)
+        limits = get_user_limits(session['email'])
         usage = check_user_usage(user_id)
         
         if limits['videos_per_month'] > 0 and usage['videos_generated'] >= limits['videos_per_month']:
@@ -297,10 +440,26 @@ def upload_files():
             'price': request.form.get('price', ''),
             'location': request.form.get('location', ''),
             'template': request.form.get('template', ''),
-            'music': request.form.get('music', '')
+            'music': request.form.get('music', ''),
+            'formats': request.form.get('formats', ''),
+            'text_style': request.form.get('text_style', ''),
+            # Modo de entrega: tamanho máximo do MP4 (MB) e/ou bitrate máximo (kbps)
+            'target_size_mb': request.form.get('target_size_mb', ''),
+            'max_bitrate_kbps': request.form.get('max_bitrate_kbps', '')
         }
         
+        # Formatos de saída opcionais, ex.: "16:9,9:16" (padrão: todos do template)
+        unknown_formats = find_unknown_formats(property_data['formats'])
+        if unknown_formats:
+            return jsonify({'error': f'Formato de saída desconhecido: {", ".join(unknown_formats)}'}), 400
+        
+        try:
+            video_generator.resolve_delivery(property_data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         uploaded_files = []
+        rejected_files = []
         
         for file in files:
             if file.filename == '':
@@ -313,7 +472,7 @@ def upload_files():
                 file_extension = filename.rsplit('.', 1)[1].lower()
                 unique_filename = f"{file_id}.{file_extension}"
                 
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+                file_path = os.path.join(INCOMING_FOLDER, unique_filename)
                 file.save(file_path)
                 
                 uploaded_files.append({
@@ -324,12 +483,47 @@ def upload_files():
                     'type': 'image' if file_extension in ['png', 'jpg', 'jpeg', 'gif'] else 'video'
                 })
             else:
-                return jsonify({'error': f'Tipo de arquivo não permitido: {file.filename}'}), 400
+                # Recusa na hora: o resto não chega a ser validado pelo conteúdo
+                remove_uploaded_files(uploaded_files)
+                rejected_files = [{'file': file.filename, 'reason': 'Tipo de arquivo não permitido'}]
+                return jsonify({'error': 'Arquivos inválidos', 'rejected_files': rejected_files}), 400
+        
+        # Conteúdo, decodificação rápida, dimensões e duração de cada arquivo
+        validations = upload_validator.validate_files([
+            (file_data['path'], file_data['filename'].rsplit('.', 1)[1]) for file_data in uploaded_files
+        ])
+        for file_data, (_, reason) in zip(uploaded_files, validations):
+            if reason:
+                rejected_files.append({'file': file_data['original_name'], 'reason': reason})
+        
+        if rejected_files:
+            remove_uploaded_files(uploaded_files)
+            return jsonify({'error': 'Arquivos inválidos', 'rejected_files': rejected_files}), 400
+        
+        if not uploaded_files:
+            return jsonify({'error': 'Nenhum arquivo enviado'}), 400
         
         # Iniciar processamento do vídeo em background
         job_id = str(uuid.uuid4())
-        thread = threading.Thread(target=process_video_async, args=(job_id, uploaded_files, property_data, user_id))
-        thread.start()
+        refusal = reserve_render_slot(user_id, session['email'], job_id)
+        if refusal:
+            remove_uploaded_files(uploaded_files)
+            message, status_code = refusal
+            return jsonify({'error': message}), status_code
+        
+        try:
+            store_uploaded_files(job_id, uploaded_files)
+            attached_to = start_video_job(job_id, uploaded_files, property_data, user_id)
+        except Exception:
+            # Sem isso a vaga ficaria presa até expirar (e os arquivos, sem dono)
+            rate_limiter.release_slot(job_id)
+            blob_store.release(job_id)
+            remove_uploaded_files([file_data for file_data in uploaded_files if 'sha256' not in file_data])
+            raise
+        
+        if attached_to:
+            # Não renderiza: a vaga fica com o job primário
+            rate_limiter.release_slot(job_id)
         
         return jsonify({
             'message': 'Upload realizado com sucesso, processamento iniciado',
@@ -347,16 +541,29 @@ def video_status(job_id):
     """
     Endpoint para verificar status do processamento do vídeo
     """
-    if job_id not in job_status:
+    status_data = get_job_status(job_id)
+    if status_data is None:
         return jsonify({'error': 'Job não encontrado'}), 404
     
-    status_data = job_status[job_id].copy()
+    status_data = status_data.copy()
     
     # Adicionar URL de download se vídeo estiver pronto
     if status_data['status'] == 'completed' and 'video_path' in status_data:
         status_data['download_url'] = f'/api/download/{job_id}'
-        # Remover path interno
+        status_data['download_urls'] = {
+            fmt: f'/api/download/{job_id}?format={video_generator.format_slug(fmt)}'
+            for fmt in status_data.get('video_paths', {})
+        }
+        status_data['preview_urls'] = {
+            name: f'/api/download/{job_id}/{PREVIEW_ROUTES[name]}'
+            for name in status_data.get('previews', {})
+        }
+        # Remover paths internos
         del status_data['video_path']
+        status_data.pop('video_paths', None)
+    status_data.pop('previews', None)
+    status_data.pop('master', None)
+    status_data.pop('user_id', None)
     
     status_data['job_id'] = job_id
     return jsonify(status_data)
@@ -365,31 +572,310 @@ def video_status(job_id):
 def download_video(job_id):
     """
     Endpoint para download do vídeo gerado
+    (?format=16x9, 1x1 ou 9x16; sem format, o formato principal do job)
     """
-    if job_id not in job_status:
+    status_data = get_job_status(job_id)
+    if status_data is None:
         return jsonify({'error': 'Job não encontrado'}), 404
     
-    status_data = job_status[job_id]
-    
     if status_data['status'] != 'completed' or 'video_path' not in status_data:
         return jsonify({'error': 'Vídeo não está pronto'}), 400
     
     video_path = status_data['video_path']
+    download_name = f'imovibe_video_{job_id}.mp4'
+    
+    requested_format = request.args.get('format')
+    if requested_format:
+        fmt = video_generator.normalize_format(requested_format)
+        if fmt is None:
+            return jsonify({'error': f'Formato de saída desconhecido: {requested_format}'}), 400
+        video_path = status_data.get('video_paths', {}).get(fmt)
+        if video_path is None:
+            return jsonify({'error': f'Formato {fmt} não foi gerado para este job'}), 404
+        download_name = f'imovibe_video_{job_id}_{video_generator.format_slug(fmt)}.mp4'
     
     if not os.path.exists(video_path):
         return jsonify({'error': 'Arquivo de vídeo não encontrado'}), 404
     
-    return send_file(video_path, as_attachment=True, download_name=f'imovibe_video_{job_id}.mp4')
+    # Caminho relativo ao diretório atual (o send_file o resolveria a partir da pasta do app)
+    return send_file(os.path.abspath(video_path), as_attachment=True, download_name=download_name)
+
+# Pôster e sprite de miniaturas: nome do arquivo na URL e tipo de cada um
+PREVIEW_ROUTES = {
+    'poster': 'poster.jpg',
+    'poster_webp': 'poster.webp',
+    'sprite': 'sprite.jpg',
+    'sprite_vtt': 'sprite.vtt'
+}
+PREVIEW_MIMETYPES = {
+    'poster': 'image/jpeg',
+    'poster_webp': 'image/webp',
+    'sprite': 'image/jpeg',
+    'sprite_vtt': 'text/vtt'
+}
+# O conteúdo de um job pronto nunca muda (edições criam outro job)
+PREVIEW_MAX_AGE = 365 * 24 * 60 * 60
+
+@app.route('/api/download/<job_id>/<filename>')
+def download_preview(job_id, filename):
+    """
+    Pôster (poster.jpg, poster.webp) e sprite de miniaturas para scrubbing
+    (sprite.jpg + índice sprite.vtt), gerados junto com o vídeo. Seguem o
+    acesso do próprio vídeo (/api/download/<job_id>): o id do job basta,
+    sem sessão; a miniatura do histórico (/api/jobs/<job_id>/thumbnail)
+    é este mesmo pôster.
+    """
+    names = {route: name for name, route in PREVIEW_ROUTES.items()}
+    if filename not in names:
+        return jsonify({'error': 'Arquivo desconhecido'}), 404
+    
+    status_data = get_job_status(job_id)
+    if status_data is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    
+    if status_data['status'] != 'completed' or 'video_path' not in status_data:
+        return jsonify({'error': 'Vídeo não está pronto'}), 400
+    
+    name = names[filename]
+    preview_path = status_data.get('previews', {}).get(name)
+    if preview_path is None or not os.path.exists(preview_path):
+        return jsonify({'error': 'Arquivo não encontrado'}), 404
+    
+    response = send_file(os.path.abspath(preview_path), mimetype=PREVIEW_MIMETYPES[name], max_age=PREVIEW_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={PREVIEW_MAX_AGE}, immutable'
+    return response
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """
+    Libera o job. O vídeo só é apagado quando nenhum outro job
+    (renderização deduplicada) ainda referencia o mesmo resultado.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Usuário não autenticado'}), 401
+    
+    status_data = get_job_status(job_id)
+    # Job de outro usuário responde como inexistente
+    if status_data is None or job_index.owner(job_id) != session['user_id']:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    
+    if status_data['status'] == 'processing':
+        return jsonify({'error': 'Job ainda em processamento'}), 409
+    
+    if render_queue:
+        result = render_queue.release(job_id)
+    else:
+        primary, last_reference = single_flight.release(job_id)
+        result = job_status.pop(primary) if last_reference else None
+        if last_reference:
+            job_requests.pop(primary, None)
+    
+    if result:
+        video_paths = set(result.get('video_paths', {}).values())
+        if result.get('video_path'):
+            video_paths.add(result['video_path'])
+        if result.get('master'):
+            video_paths.add(result['master']['path'])
+        video_paths.update(result.get('previews', {}).values())
+        for video_path in video_paths:
+            if os.path.exists(video_path):
+                os.remove(video_path)
+    
+    # Blobs que nenhum outro job referencia são apagados
+    blob_store.release(job_id)
+    job_index.remove(job_id)
+    return jsonify({'message': 'Job removido', 'job_id': job_id})
+
+def parse_date_arg(name):
+    """
+    Lê um filtro de data da query string (ISO, ex.: 2024-05-01) como timestamp.
+    Datas sem horário em 'to' incluem o dia inteiro.
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Data inválida em {name}: {value}')
+    if name == 'to' and len(value) == 10:
+        date += timedelta(days=1)
+    return date.timestamp()
+
+def serialize_job(job):
+    """Item do histórico de jobs com as URLs de miniatura e download"""
+    job_id = job['job_id']
+    item = {
+        'job_id': job_id,
+        'status': job['status'],
+        'created_at': datetime.fromtimestamp(job['created_at']).isoformat(),
+        'property_data': job['property_data'],
+        'status_url': f'/api/video-status/{job_id}'
+    }
+    if job['status'] == 'completed':
+        item['thumbnail_url'] = f'/api/jobs/{job_id}/thumbnail'
+        item['download_url'] = f'/api/download/{job_id}'
+        item['download_urls'] = {
+            fmt: f'/api/download/{job_id}?format={video_generator.format_slug(fmt)}'
+            for fmt in video_generator.resolve_output_formats(job['property_data'])
+        }
+    return item
+
+@app.route('/api/jobs')
+def list_jobs():
+    """
+    Histórico de vídeos do usuário, do mais recente para o mais antigo.
+    
+    Filtros: status, from e to (datas ISO). Paginação: limit e cursor
+    (o next_cursor da página anterior). Responde 304 quando o If-None-Match
+    bate com o ETag da página.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Usuário não autenticado'}), 401
+    
+    user_id = session['user_id']
+    status = request.args.get('status')
+    if status and status not in JOB_STATUSES:
+        return jsonify({'error': f'Status inválido: {status}'}), 400
+    
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        jobs, next_cursor = job_index.list_jobs(
+            user_id, status, parse_date_arg('from'), parse_date_arg('to'), request.args.get('cursor'), limit
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # O índice pode ficar para trás (ex.: job que falhou por lease expirado na fila)
+    for job in jobs:
+        if job['status'] == 'processing':
+            current = get_job_status(job['job_id'])
+            if current and current['status'] != 'processing':
+                job['status'] = current['status']
+                job_index.update_status(job['primary_id'], current['status'])
+    
+    etag = hashlib.sha256(json.dumps([
+        user_id, request.query_string.decode(), next_cursor,
+        [(job['job_id'], job['status'], job['updated_at']) for job in jobs]
+    ]).encode()).hexdigest()
+    
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify({'jobs': [serialize_job(job) for job in jobs], 'next_cursor': next_cursor})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/jobs/<job_id>/thumbnail')
+def job_thumbnail(job_id):
+    """
+    Miniatura do vídeo pronto no histórico: o pôster JPEG gerado junto com
+    o vídeo, com o mesmo acesso e cache de /api/download/<job_id>/poster.jpg
+    """
+    return download_preview(job_id, PREVIEW_ROUTES['poster'])
+
+@app.route('/api/jobs/<job_id>/edit', methods=['POST'])
+def edit_job(job_id):
+    """
+    Gera uma nova versão de um vídeo pronto com outros dados do imóvel,
+    estilo de texto (text_style), música ou formatos. O master sem texto e
+    sem música do job original é reaproveitado, então só o texto e a trilha
+    são refeitos. Retorna o id do novo job.
+    """
+    # Verificar autenticação
+    if 'user_id' not in session:
+        return jsonify({'error': 'Usuário não autenticado'}), 401
+    
+    user_id = session['user_id']
+    
+    status_data = get_job_status(job_id)
+    render_request = get_job_request(job_id)
+    if status_data is None or render_request is None or render_request.get('user_id') != user_id:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    
+    if status_data['status'] != 'completed':
+        return jsonify({'error': 'Só é possível editar vídeos já gerados'}), 409
+    
+    changes = request.get_json(silent=True) or request.form
+    property_data = dict(render_request['property_data'])
+    for field in EDITABLE_FIELDS:
+        if field in changes:
+            property_data[field] = str(changes[field])
+    
+    unknown_formats = find_unknown_formats(property_data.get('formats', ''))
+    if unknown_formats:
+        return jsonify({'error': f'Formato de saída desconhecido: {", ".join(unknown_formats)}'}), 400
+    
+    try:
+        video_generator.resolve_delivery(property_data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # A edição gera um novo vídeo e conta nos limites do plano
+    new_job_id = str(uuid.uuid4())
+    refusal = reserve_render_slot(user_id, session['email'], new_job_id)
+    if refusal:
+        message, status_code = refusal
+        return jsonify({'error': message}), status_code
+    
+    try:
+        attached_to = start_video_job(new_job_id, render_request['files_data'], property_data, user_id,
+                                      status_data.get('master'))
+    except Exception:
+        rate_limiter.release_slot(new_job_id)
+        blob_store.release(new_job_id)
+        raise
+    if attached_to:
+        rate_limiter.release_slot(new_job_id)
+    
+    return jsonify({
+        'message': 'Edição iniciada',
+        'job_id': new_job_id,
+        'edited_from': job_id,
+        'property_data': property_data,
+        'status': 'processing'
+    })
+
+@app.route('/api/health')
+def health():
+    """
+    Saúde do nó: capacidades do ffmpeg detectadas na inicialização, velocidade
+    de referência do self-test e padrões do agendador. 503 se o ffmpeg não
+    consegue renderizar.
+    """
+    capabilities = video_generator.capabilities
+    return jsonify({
+        'status': 'ok' if capabilities['ok'] else 'degraded',
+        'render_mode': RENDER_MODE,
+        'ffmpeg': capabilities['ffmpeg'],
+        'ffprobe': capabilities['ffprobe'],
+        'encoders': capabilities['encoders'],
+        'filters': capabilities['filters'],
+        'font_backend': capabilities['font_backend'],
+        'cpu_count': capabilities['cpu_count'],
+        'self_test': capabilities['self_test'],
+        'probed_at': capabilities['probed_at'],
+        'problems': capabilities['problems'],
+        'scheduler': {
+            'max_encoders': video_generator.engine.max_concurrency,
+            'x264_threads': video_generator.scheduler_settings['x264_threads'],
+            'seconds_per_frame': video_generator.seconds_per_frame
+        }
+    }), 200 if capabilities['ok'] else 503
 
 @app.route('/api/templates')
 def get_templates():
     """
     Endpoint para obter informações sobre templates disponíveis
     """
-    return jsonify({
-        'templates': video_generator.get_template_info(),
-        'music': video_generator.get_music_info()
-    })
+    if request.if_none_match.contains(TEMPLATES_ETAG):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(TEMPLATES_BODY, mimetype='application/json')
+    response.set_etag(TEMPLATES_ETAG)
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+import os
+
+MUSIC_EXTENSIONS = ('mp3', 'm4a', 'aac', 'wav', 'ogg', 'flac')
+
+# Normalização de loudness (EBU R128) aplicada uma única vez por faixa
+LOUDNORM_FILTER = 'loudnorm=I=-16:TP=-1.5:LRA=11'
+AUDIO_CODEC_OPTIONS = ['-c:a', 'aac', '-b:a', '160k', '-ar', '48000', '-ac', '2']
+
+
+class MusicCache:
+    """
+    Cache de faixas de música já normalizadas e codificadas em AAC.
+
+    As faixas originais ficam em assets/music/<nome>.<ext>; a versão
+    preparada é gerada na primeira vez (ou no aquecimento do worker) e
+    reutilizada por todos os jobs enquanto o arquivo original não mudar.
+    """
+
+    def __init__(self, engine, music_folder='assets/music'):
+        self.engine = engine
+        self.music_folder = music_folder
+        self.cache_folder = os.path.join(music_folder, '.cache')
+        os.makedirs(self.cache_folder, exist_ok=True)
+        self._locks = {}
+
+    def find_source(self, name):
+        """Retorna o arquivo original da faixa, ou None se não existir"""
+        for extension in MUSIC_EXTENSIONS:
+            path = os.path.join(self.music_folder, f"{name}.{extension}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    def cache_path(self, name, source):
+        """Caminho da versão preparada (muda se o original ou os parâmetros mudarem)"""
+        stat = os.stat(source)
+        fingerprint = f"{source}:{stat.st_size}:{stat.st_mtime_ns}:{LOUDNORM_FILTER}:{AUDIO_CODEC_OPTIONS}"
+        digest = hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_folder, f"{name}_{digest}.m4a")
+
+    async def get_track(self, name):
+        """
+        Retorna o caminho da faixa normalizada (gerando se necessário),
+        ou None se a faixa não existir
+        """
+        source = self.find_source(name)
+        if source is None:
+            return None
+
+        cache_path = self.cache_path(name, source)
+        if os.path.exists(cache_path):
+            return cache_path
+
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if os.path.exists(cache_path):
+                return cache_path
+
+            # Nome temporário por processo: vários workers podem aquecer ao mesmo tempo
+            temp_path = f"{cache_path}.{os.getpid()}.tmp.m4a"
+            cmd = [
+                'ffmpeg', '-y',
+                '-i', source,
+                '-vn',
+                '-af', LOUDNORM_FILTER,
+                *AUDIO_CODEC_OPTIONS,
+                temp_path
+            ]
+            result = await self.engine.run(cmd)
+            if result.returncode != 0:
+                print(f"Erro FFmpeg normalização de música: {result.stderr}")
+                return None
+            os.replace(temp_path, cache_path)
+            return cache_path
+
+    async def prepare_all(self, names):
+        """Aquece o cache para todas as faixas informadas"""
+        await asyncio.gather(*[self.get_track(name) for name in names])
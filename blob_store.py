@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import time
+
+from render_dedup import file_sha256
+
+DEFAULT_ROOT = os.environ.get('BLOB_STORE_ROOT', 'uploads/blobs')
+DEFAULT_DB_PATH = os.environ.get('BLOB_STORE_DB', 'job_data/blobs.db')
+
+
+class BlobStore:
+    """
+    Armazenamento dos arquivos enviados endereçado por conteúdo.
+
+    Cada arquivo é guardado uma única vez em <raiz>/ab/cd/<sha256>.<ext>,
+    não importa quantos usuários ou jobs enviem o mesmo conteúdo. Os jobs
+    apenas referenciam os blobs (tabela blob_refs); quando a última
+    referência é liberada, o arquivo é apagado.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, db_path=DEFAULT_DB_PATH):
+        self.root = root
+        self.db_path = db_path
+        os.makedirs(root, exist_ok=True)
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS blob_refs (
+                    digest TEXT NOT NULL,
+                    ref TEXT NOT NULL,
+                    PRIMARY KEY (digest, ref)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_blob_refs_ref ON blob_refs (ref)')
+        finally:
+            conn.close()
+
+    def _transaction(self, operation):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = operation(conn)
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def blob_path(self, digest, extension):
+        """Caminho do blob (diretórios em dois níveis para não lotar uma pasta só)"""
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.{extension}")
+
+    def store(self, temp_path, extension, ref):
+        """
+        Move um arquivo recebido para o armazenamento e registra a referência
+        ref (id do job). Se o conteúdo já existir, o arquivo recebido é
+        descartado. Retorna (sha256, caminho do blob).
+
+        As linhas são gravadas (COMMIT) antes de mexer nos arquivos: uma
+        queda no meio deixa no máximo um blob sem arquivo, que o próximo
+        envio do mesmo conteúdo recria, ou um arquivo sem linha, que o
+        sweep apaga.
+        """
+        digest = file_sha256(temp_path)
+        size = os.path.getsize(temp_path)
+
+        def operation(conn):
+            # Na mesma transação que a referência: um release concorrente
+            # não pode apagar a linha entre a verificação e o registro
+            row = conn.execute('SELECT path FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            if row is not None:
+                path = row['path']
+            else:
+                path = self.blob_path(digest, extension)
+                conn.execute('INSERT INTO blobs (digest, path, size, created_at) VALUES (?, ?, ?, ?)',
+                             (digest, path, size, time.time()))
+            conn.execute('INSERT OR IGNORE INTO blob_refs (digest, ref) VALUES (?, ?)', (digest, ref))
+            return path
+        path = self._transaction(operation)
+
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            # Mesmo conteúdo: se dois envios chegarem aqui juntos, o rename é idempotente
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return digest, path
+
+    def add_refs(self, ref, digests):
+        """
+        Registra a referência ref a blobs já armazenados (ex.: uma edição
+        reaproveitando os arquivos do job original). Retorna quantos blobs
+        ainda existiam.
+        """
+        def operation(conn):
+            added = 0
+            for digest in set(digests):
+                if conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone():
+                    conn.execute('INSERT OR IGNORE INTO blob_refs (digest, ref) VALUES (?, ?)', (digest, ref))
+                    added += 1
+            return added
+        return self._transaction(operation)
+
+    def release(self, ref):
+        """
+        Remove as referências de ref e apaga os blobs que ficaram sem
+        nenhuma. Retorna quantos blobs foram apagados.
+        """
+        def operation(conn):
+            digests = [row['digest'] for row in
+                       conn.execute('SELECT digest FROM blob_refs WHERE ref = ?', (ref,)).fetchall()]
+            conn.execute('DELETE FROM blob_refs WHERE ref = ?', (ref,))
+            orphans = []
+            for digest in digests:
+                if conn.execute('SELECT 1 FROM blob_refs WHERE digest = ? LIMIT 1', (digest,)).fetchone():
+                    continue
+                row = conn.execute('SELECT path FROM blobs WHERE digest = ?', (digest,)).fetchone()
+                conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+                if row is not None:
+                    orphans.append((digest, row['path']))
+            return orphans
+        orphans = self._transaction(operation)
+        return self._remove_files(orphans)
+
+    def _remove_files(self, blobs):
+        """
+        Apaga os arquivos de blobs cujas linhas já foram removidas. Roda sob
+        o lock de escrita do banco: se um store concorrente recriou a linha
+        do mesmo conteúdo nesse meio tempo, o arquivo fica.
+        """
+        def operation(conn):
+            removed = 0
+            for digest, path in blobs:
+                if conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone():
+                    continue
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+            return removed
+        return self._transaction(operation) if blobs else 0
+
+    def sweep(self):
+        """
+        Limpeza depois de uma queda: apaga blobs sem referências e arquivos
+        sem linha no banco (release interrompido antes de apagar o arquivo).
+        Retorna quantos arquivos foram apagados.
+        """
+        def operation(conn):
+            unreferenced = conn.execute(
+                'SELECT digest, path FROM blobs WHERE digest NOT IN (SELECT digest FROM blob_refs)'
+            ).fetchall()
+            conn.execute('DELETE FROM blobs WHERE digest NOT IN (SELECT digest FROM blob_refs)')
+            return [(row['digest'], row['path']) for row in unreferenced]
+        removed = self._remove_files(self._transaction(operation))
+
+        def remove_untracked(conn):
+            known = {row['path'] for row in conn.execute('SELECT path FROM blobs')}
+            count = 0
+            for directory, _, names in os.walk(self.root):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    if path not in known:
+                        os.remove(path)
+                        count += 1
+            return count
+        return removed + self._transaction(remove_untracked)
@@ -0,0 +1,267 @@
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows (desenvolvimento): sem lock entre processos
+    fcntl = None
+
+DEFAULT_CACHE_PATH = os.environ.get('IMOVIBE_CAPABILITIES_CACHE', 'job_data/ffmpeg_capabilities.json')
+
+# Muda quando o formato do cache ou o self-test mudam (invalida caches antigos)
+CAPABILITIES_VERSION = 2
+
+REQUIRED_ENCODERS = ('libx264', 'aac')
+OPTIONAL_ENCODERS = ('libwebp',)
+REQUIRED_FILTERS = ('drawtext', 'zoompan', 'boxblur', 'overlay', 'split', 'loudnorm', 'amix', 'afade')
+OPTIONAL_FILTERS = ('xfade',)
+
+# Self-test: 2 s de 720p codificados com uma thread dão a velocidade por núcleo
+SELF_TEST_SECONDS = 2
+SELF_TEST_FPS = 30
+# Cada encoder recebe threads suficientes para codificar 720p a esse ritmo
+TARGET_ENCODER_FPS = 60
+
+
+def cpu_count():
+    """Núcleos disponíveis para este processo (respeita cgroups/affinity)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _binary_fingerprint(name):
+    path = shutil.which(name)
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+
+def _fingerprint():
+    return {
+        'version': CAPABILITIES_VERSION,
+        'ffmpeg': _binary_fingerprint('ffmpeg'),
+        'ffprobe': _binary_fingerprint('ffprobe'),
+        'cpu_count': cpu_count()
+    }
+
+
+def _run(cmd, timeout=30):
+    return subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=timeout)
+
+
+def _version(name):
+    result = _run([name, '-hide_banner', '-version'])
+    first_line = result.stdout.splitlines()[0] if result.stdout else ''
+    # "ffmpeg version 6.1.1-3ubuntu5 Copyright ..." -> "6.1.1-3ubuntu5"
+    parts = first_line.split()
+    version = parts[2] if len(parts) > 2 and parts[1] == 'version' else first_line
+    return version, result.stdout
+
+
+def _list_names(option):
+    """Nomes da listagem de -encoders/-filters (segunda coluna, depois das flags)"""
+    result = _run(['ffmpeg', '-hide_banner', option])
+    names = set()
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        # Ignora o cabeçalho ("Filters:") e a legenda das flags ("T.. = Timeline support")
+        if len(parts) >= 2 and parts[1] != '=':
+            names.add(parts[1])
+    return names
+
+
+def _font_backend(build_info):
+    """
+    Como o drawtext encontra a fonte: fontconfig (sem fontfile, como nos
+    templates), só freetype (precisa de fontfile) ou nenhum
+    """
+    if '--enable-libfontconfig' in build_info:
+        return 'fontconfig'
+    if '--enable-libfreetype' in build_info:
+        return 'freetype'
+    return None
+
+
+def _self_test(with_text):
+    """
+    Codifica um trecho sintético de 720p com o libx264 (uma thread) e mede a
+    velocidade. Com with_text o drawtext também é testado (fontes).
+    """
+    frames = SELF_TEST_SECONDS * SELF_TEST_FPS
+    filters = ["drawtext=text='ImoVibe':fontsize=32:fontcolor=white:x=20:y=20"] if with_text else []
+    with tempfile.TemporaryDirectory(prefix='imovibe_selftest_') as directory:
+        output_path = os.path.join(directory, 'selftest.mp4')
+        cmd = [
+            'ffmpeg', '-hide_banner', '-y',
+            '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate={SELF_TEST_FPS}',
+            '-t', str(SELF_TEST_SECONDS),
+            *(['-vf', ','.join(filters)] if filters else []),
+            '-c:v', 'libx264', '-threads', '1',
+            '-pix_fmt', 'yuv420p',
+            output_path
+        ]
+        started = time.perf_counter()
+        try:
+            result = _run(cmd, timeout=120)
+        except subprocess.TimeoutExpired:
+            return {'ok': False, 'error': 'Tempo esgotado no self-test'}
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0 or not os.path.exists(output_path):
+            return {'ok': False, 'error': result.stderr.strip().splitlines()[-1] if result.stderr else 'Falhou'}
+    return {
+        'ok': True,
+        'frames': frames,
+        'seconds': round(elapsed, 3),
+        'fps_per_thread': round(frames / elapsed, 2)
+    }
+
+
+def probe_capabilities(self_test=True):
+    """
+    Detecta versões do ffmpeg/ffprobe, encoders, filtros, backend de fontes
+    do drawtext e núcleos, e roda o self-test de codificação.
+    'problems' lista o que impede (ou degrada) a renderização.
+    """
+    capabilities = {
+        'fingerprint': _fingerprint(),
+        'probed_at': time.time(),
+        'cpu_count': cpu_count(),
+        'ffmpeg': None,
+        'ffprobe': None,
+        'encoders': {},
+        'filters': {},
+        'font_backend': None,
+        'self_test': None,
+        'problems': []
+    }
+    problems = capabilities['problems']
+
+    for name in ('ffmpeg', 'ffprobe'):
+        if capabilities['fingerprint'][name] is None:
+            problems.append(f'{name} não encontrado no PATH')
+    if problems:
+        capabilities['ok'] = False
+        return capabilities
+
+    try:
+        capabilities['ffmpeg'], build_info = _version('ffmpeg')
+        capabilities['ffprobe'], _ = _version('ffprobe')
+        encoders = _list_names('-encoders')
+        filters = _list_names('-filters')
+    except (OSError, subprocess.SubprocessError) as e:
+        problems.append(f'Erro ao consultar o ffmpeg: {str(e)}')
+        capabilities['ok'] = False
+        return capabilities
+
+    capabilities['encoders'] = {name: name in encoders for name in REQUIRED_ENCODERS + OPTIONAL_ENCODERS}
+    capabilities['filters'] = {name: name in filters for name in REQUIRED_FILTERS + OPTIONAL_FILTERS}
+    capabilities['font_backend'] = _font_backend(build_info)
+    for name in REQUIRED_ENCODERS:
+        if not capabilities['encoders'][name]:
+            problems.append(f'Encoder {name} indisponível')
+    for name in REQUIRED_FILTERS:
+        if not capabilities['filters'][name]:
+            problems.append(f'Filtro {name} indisponível')
+    if capabilities['filters']['drawtext'] and capabilities['font_backend'] != 'fontconfig':
+        problems.append('drawtext sem fontconfig: o texto dos templates não encontra a fonte')
+
+    if self_test and capabilities['encoders']['libx264']:
+        with_text = capabilities['filters']['drawtext'] and capabilities['font_backend'] == 'fontconfig'
+        capabilities['self_test'] = _self_test(with_text)
+        if not capabilities['self_test']['ok']:
+            problems.append(f"Self-test de codificação falhou: {capabilities['self_test']['error']}")
+
+    capabilities['ok'] = not problems
+    return capabilities
+
+
+def load_capabilities(cache_path=DEFAULT_CACHE_PATH, self_test=None):
+    """
+    Capacidades do ffmpeg desta máquina, do cache em disco se o ffmpeg, o
+    ffprobe e o número de núcleos não mudaram (reinícios ficam rápidos).
+    IMOVIBE_SKIP_SELF_TEST=1 pula o self-test de velocidade.
+
+    Vários processos subindo juntos (workers do gunicorn, workers de
+    renderização) esperam em um lock de arquivo: só o primeiro roda o probe
+    e os demais leem o cache que ele gravou. Para não pagar o self-test na
+    subida, rode `python ffmpeg_capabilities.py` no deploy.
+    """
+    if self_test is None:
+        self_test = os.environ.get('IMOVIBE_SKIP_SELF_TEST') != '1'
+    fingerprint = _fingerprint()
+    cached = _read_cache(cache_path, fingerprint, self_test)
+    if cached:
+        return cached
+
+    directory = os.path.dirname(cache_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f"{cache_path}.lock", 'w') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        # Outro processo pode ter feito o probe enquanto esperávamos o lock
+        cached = _read_cache(cache_path, fingerprint, self_test)
+        if cached:
+            return cached
+
+        capabilities = probe_capabilities(self_test)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(capabilities, f, indent=2)
+        os.replace(temp_path, cache_path)
+        return capabilities
+
+
+def _read_cache(cache_path, fingerprint, self_test):
+    try:
+        with open(cache_path, 'r') as f:
+            cached = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if cached.get('fingerprint') == fingerprint and (cached.get('self_test') or not self_test
+                                                     or not cached.get('ok')):
+        return cached
+    return None
+
+
+def recommended_settings(capabilities):
+    """
+    Padrões do agendador a partir das capacidades: threads do x264 por
+    encoder (o suficiente para TARGET_ENCODER_FPS em 720p com a velocidade
+    por núcleo medida), quantos encoders cabem nos núcleos e o custo
+    estimado por frame usado nos planos. Sem self-test, metade dos
+    núcleos como encoders (padrão anterior).
+    """
+    cores = capabilities.get('cpu_count') or cpu_count()
+    self_test = capabilities.get('self_test') or {}
+    fps_per_thread = self_test.get('fps_per_thread') if self_test.get('ok') else None
+    if not fps_per_thread:
+        max_concurrency = max(1, cores // 2)
+        return {
+            'max_concurrency': max_concurrency,
+            'x264_threads': max(1, cores // max_concurrency),
+            'seconds_per_frame': None
+        }
+
+    x264_threads = min(cores, max(1, math.ceil(TARGET_ENCODER_FPS / fps_per_thread)))
+    return {
+        'max_concurrency': max(1, cores // x264_threads),
+        'x264_threads': x264_threads,
+        # O x264 não escala linearmente com as threads: conta 75% de eficiência
+        'seconds_per_frame': round(1 / (fps_per_thread * max(1, x264_threads * 0.75)), 5)
+    }
+
+
+if __name__ == '__main__':
+    # Etapa de deploy: faz o probe (com self-test) uma vez e grava o cache
+    result = load_capabilities()
+    print(json.dumps({'ok': result['ok'], 'problems': result['problems'],
+                      'settings': recommended_settings(result)}, indent=2))
+    raise SystemExit(0 if result['ok'] else 1)
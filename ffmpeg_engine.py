@@ -0,0 +1,235 @@
+import asyncio
+import collections
+import contextlib
+import os
+import re
+import threading
+
+
+class StderrRingBuffer:
+    """
+    Guarda apenas as últimas linhas do stderr do ffmpeg, evitando
+    manter toda a saída do processo em memória
+    """
+
+    def __init__(self, max_lines=200):
+        self.lines = collections.deque(maxlen=max_lines)
+        self._partial = ''
+
+    def feed(self, chunk):
+        # O ffmpeg usa '\r' nas linhas de progresso, então tratamos ambos
+        data = self._partial + chunk.decode('utf-8', errors='replace')
+        parts = re.split(r'[\r\n]', data)
+        self._partial = parts.pop()
+        for line in parts:
+            if line:
+                self.lines.append(line)
+
+    def text(self):
+        lines = list(self.lines)
+        if self._partial:
+            lines.append(self._partial)
+        return '\n'.join(lines)
+
+
+class FFmpegResult:
+    """Resultado de uma execução do ffmpeg (mesmos campos usados do subprocess)"""
+
+    def __init__(self, cmd, returncode, stderr, stdout=None):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+        self.stdout = stdout
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+
+class FFmpegEngine:
+    """
+    Motor de execução assíncrona do ffmpeg.
+
+    Todos os processos rodam em um único event loop (em uma thread própria),
+    com um semáforo limitando quantos encoders ficam ativos ao mesmo tempo.
+    """
+
+    def __init__(self, max_concurrency=None, stderr_lines=200):
+        if max_concurrency is None:
+            max_concurrency = max(1, (os.cpu_count() or 2) // 2)
+        self.max_concurrency = max_concurrency
+        self.stderr_lines = stderr_lines
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._acquire_lock = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name='ffmpeg-engine',
+                    daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    @contextlib.asynccontextmanager
+    async def _slots(self, count):
+        """
+        Reserva vagas de encoder. Um pipeline reserva todas as suas vagas de
+        uma vez (sob um lock) para que dois pipelines parcialmente
+        reservados nunca fiquem esperando um pelo outro.
+        """
+        # Criados sob demanda, já dentro do event loop do motor
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._acquire_lock = asyncio.Lock()
+
+        count = min(count, self.max_concurrency)
+        acquired = 0
+        try:
+            async with self._acquire_lock:
+                for _ in range(count):
+                    await self._semaphore.acquire()
+                    acquired += 1
+            yield
+        finally:
+            for _ in range(acquired):
+                self._semaphore.release()
+
+    async def run(self, cmd, capture_stdout=False, limited=True, timeout=None):
+        """
+        Executa um comando ffmpeg respeitando o limite de concorrência.
+        
+        capture_stdout: guarda a saída padrão (ex.: JSON do ffprobe)
+        limited: False para comandos leves (ffprobe) que não ocupam um encoder
+        timeout: segundos até o processo ser encerrado (lança asyncio.TimeoutError)
+        """
+        if not limited:
+            return await self._execute(cmd, capture_stdout, timeout)
+        async with self._slots(1):
+            return await self._execute(cmd, capture_stdout, timeout)
+
+    async def run_pipeline(self, cmds, slots=None):
+        """
+        Executa comandos ligados por pipes do sistema: o stdout de cada um
+        alimenta o stdin do seguinte (ex.: MPEG-TS em 'pipe:1' -> 'pipe:0').
+        Retorna um FFmpegResult por comando; o pipeline só deu certo se
+        todos terminarem com sucesso.
+        
+        slots: vagas de encoder reservadas (padrão: uma por comando); estágios
+        que só copiam streams (ex.: package) não precisam de vaga
+        """
+        async with self._slots(len(cmds) if slots is None else slots):
+            processes = []
+            read_fd = None
+            try:
+                for index, cmd in enumerate(cmds):
+                    last = index == len(cmds) - 1
+                    write_fd = None
+                    if not last:
+                        next_read_fd, write_fd = os.pipe()
+                    try:
+                        process = await asyncio.create_subprocess_exec(
+                            *cmd,
+                            stdin=read_fd if read_fd is not None else asyncio.subprocess.DEVNULL,
+                            stdout=write_fd if write_fd is not None else asyncio.subprocess.DEVNULL,
+                            stderr=asyncio.subprocess.PIPE
+                        )
+                    except (Exception, asyncio.CancelledError):
+                        # O pipe do próximo estágio ainda não passou para read_fd
+                        if not last:
+                            os.close(next_read_fd)
+                        raise
+                    finally:
+                        # O processo filho já herdou as pontas; o pai fecha as suas
+                        if read_fd is not None:
+                            os.close(read_fd)
+                            read_fd = None
+                        if write_fd is not None:
+                            os.close(write_fd)
+                    processes.append(process)
+                    if not last:
+                        read_fd = next_read_fd
+            except (Exception, asyncio.CancelledError):
+                if read_fd is not None:
+                    os.close(read_fd)
+                await self._kill(processes)
+                raise
+
+            buffers = [StderrRingBuffer(self.stderr_lines) for _ in processes]
+            try:
+                await asyncio.gather(*[
+                    self._drain(process.stderr, buffer) for process, buffer in zip(processes, buffers)
+                ])
+                returncodes = [await process.wait() for process in processes]
+            except asyncio.CancelledError:
+                # Etapa cancelada (ex.: outra etapa do plano falhou): nenhum
+                # estágio pode continuar rodando depois de liberar as vagas
+                await self._kill(processes)
+                raise
+
+        return [
+            FFmpegResult(cmd, returncode, buffer.text())
+            for cmd, returncode, buffer in zip(cmds, returncodes, buffers)
+        ]
+
+    async def _execute(self, cmd, capture_stdout, timeout=None):
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE if capture_stdout else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stderr = StderrRingBuffer(self.stderr_lines)
+        try:
+            if capture_stdout:
+                stdout, _ = await asyncio.wait_for(
+                    asyncio.gather(process.stdout.read(), self._drain(process.stderr, stderr)), timeout
+                )
+                stdout = stdout.decode('utf-8', errors='replace')
+            else:
+                stdout = None
+                await asyncio.wait_for(self._drain(process.stderr, stderr), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            await self._kill([process])
+            raise
+        returncode = await process.wait()
+        return FFmpegResult(cmd, returncode, stderr.text(), stdout)
+    
+    async def _kill(self, processes):
+        """Encerra os processos que ainda estão rodando e espera cada um sair"""
+        for process in processes:
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+        for process in processes:
+            await process.wait()
+
+    async def _drain(self, stream, buffer):
+        while True:
+            chunk = await stream.read(4096)
+            if not chunk:
+                break
+            buffer.feed(chunk)
+
+    def submit(self, coro):
+        """
+        Agenda uma corrotina no event loop do motor e retorna um
+        concurrent.futures.Future (pode ser usado a partir de qualquer thread)
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run_sync(self, coro):
+        """
+        Executa uma corrotina e bloqueia até o resultado.
+        Não deve ser chamado de dentro do próprio event loop do motor.
+        """
+        return self.submit(coro).result()
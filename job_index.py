@@ -0,0 +1,148 @@
+import base64
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_DB_PATH = os.environ.get('JOB_INDEX_DB', 'job_data/job_index.db')
+
+
+def encode_cursor(created_at, job_id):
+    return base64.urlsafe_b64encode(f"{created_at!r}|{job_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Retorna (created_at, job_id) do cursor, ou lança ValueError se for inválido"""
+    try:
+        created_at, job_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+        return float(created_at), job_id
+    except Exception:
+        raise ValueError('Cursor inválido')
+
+
+class JobIndex:
+    """
+    Índice dos jobs por usuário (histórico de vídeos), em SQLite.
+
+    Guarda só o necessário para listar: dono, data de criação, status e os
+    dados do imóvel. Jobs deduplicados apontam para o job primário
+    (primary_id), que é quem recebe as atualizações de status.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    primary_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    property_data TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_user_created ON jobs (user_id, created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_primary ON jobs (primary_id)')
+        finally:
+            conn.close()
+
+    def add(self, job_id, user_id, property_data, primary_id=None, status='processing'):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO jobs (job_id, user_id, primary_id, status, property_data, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, user_id, primary_id or job_id, status, json.dumps(property_data), now, now)
+            )
+        finally:
+            conn.close()
+
+    def update_status(self, job_id, status):
+        """Atualiza o status do job primário e de todos os jobs que apontam para ele"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                'UPDATE jobs SET status = ?, updated_at = ? WHERE (primary_id = ? OR job_id = ?) AND status != ?',
+                (status, time.time(), job_id, job_id, status)
+            )
+        finally:
+            conn.close()
+
+    def remove(self, job_id):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+        finally:
+            conn.close()
+
+    def owner(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT user_id FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return row['user_id'] if row else None
+
+    def list_jobs(self, user_id, status=None, since=None, until=None, cursor=None, limit=20):
+        """
+        Lista os jobs do usuário, do mais recente para o mais antigo
+        (paginação por cursor, sem OFFSET).
+        Retorna (jobs, cursor da próxima página ou None).
+        """
+        conditions = ['user_id = ?']
+        params = [user_id]
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        if since is not None:
+            conditions.append('created_at >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('created_at < ?')
+            params.append(until)
+        if cursor:
+            created_at, job_id = decode_cursor(cursor)
+            conditions.append('(created_at < ? OR (created_at = ? AND job_id < ?))')
+            params += [created_at, created_at, job_id]
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT job_id, primary_id, status, property_data, created_at, updated_at FROM jobs "
+                f"WHERE {' AND '.join(conditions)} ORDER BY created_at DESC, job_id DESC LIMIT ?",
+                params + [limit + 1]
+            ).fetchall()
+        finally:
+            conn.close()
+
+        jobs = [
+            {
+                'job_id': row['job_id'],
+                'primary_id': row['primary_id'],
+                'status': row['status'],
+                'property_data': json.loads(row['property_data']),
+                'created_at': row['created_at'],
+                'updated_at': row['updated_at']
+            }
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(jobs[-1]['created_at'], jobs[-1]['job_id'])
+        return jobs, next_cursor
@@ -0,0 +1,294 @@
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_DB_PATH = os.environ.get('RENDER_QUEUE_DB', 'job_data/render_queue.db')
+
+
+class RenderQueue:
+    """
+    Fila de renderização em SQLite compartilhada entre o web e os workers.
+
+    Cada job reservado por um worker recebe um lease que precisa ser renovado
+    (heartbeat). Se o worker morrer, o lease expira e o job volta para a fila
+    até atingir o número máximo de tentativas.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, lease_seconds=60, max_attempts=3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_db()
+
+    def _connect(self):
+        # isolation_level=None: controlamos as transações manualmente
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS render_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    message TEXT,
+                    result TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            # Colunas adicionadas depois da primeira versão da fila
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(render_jobs)')}
+            for column, definition in (('dedup_key', 'TEXT'), ('alias_of', 'TEXT'),
+                                       ('released', 'INTEGER NOT NULL DEFAULT 0')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE render_jobs ADD COLUMN {column} {definition}')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_render_jobs_state ON render_jobs (state, created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_render_jobs_dedup ON render_jobs (dedup_key, state)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_render_jobs_alias ON render_jobs (alias_of)')
+        finally:
+            conn.close()
+
+    def enqueue(self, job_id, payload, dedup_key=None):
+        """
+        Adiciona um job na fila.
+
+        Se dedup_key for informada e já houver um job idêntico em andamento,
+        o novo job vira um apelido dele e não é renderizado de novo.
+        Retorna o job primário nesse caso, ou None.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            primary = None
+            if dedup_key:
+                row = conn.execute(
+                    "SELECT job_id FROM render_jobs WHERE dedup_key = ? AND alias_of IS NULL "
+                    "AND state IN ('queued', 'processing') ORDER BY created_at LIMIT 1",
+                    (dedup_key,)
+                ).fetchone()
+                if row is not None:
+                    primary = row['job_id']
+
+            if primary:
+                conn.execute(
+                    'INSERT INTO render_jobs (job_id, payload, state, dedup_key, alias_of, created_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (job_id, json.dumps(payload), 'alias', dedup_key, primary, now, now)
+                )
+            else:
+                conn.execute(
+                    'INSERT INTO render_jobs (job_id, payload, state, progress, message, dedup_key, created_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job_id, json.dumps(payload), 'queued', 0, 'Na fila de renderização...', dedup_key, now, now)
+                )
+            conn.execute('COMMIT')
+            return primary
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def claim(self, worker_id):
+        """
+        Reserva o job mais antigo da fila para o worker.
+        Retorna (job_id, payload) ou None se a fila estiver vazia.
+        Jobs com lease expirado só voltam para a fila em recover_expired.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT job_id, payload FROM render_jobs WHERE state = 'queued' "
+                "ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                "UPDATE render_jobs SET state = 'processing', progress = 30, message = ?, "
+                "attempts = attempts + 1, worker_id = ?, lease_expires = ?, updated_at = ? "
+                "WHERE job_id = ?",
+                ('Processando mídia...', worker_id, now + self.lease_seconds, now, row['job_id'])
+            )
+            conn.execute('COMMIT')
+            return row['job_id'], json.loads(row['payload'])
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def recover_expired(self):
+        """
+        Jobs de workers que morreram (lease expirado) voltam para a fila, ou
+        falham de vez depois de max_attempts tentativas.
+        Retorna os ids dos jobs que falharam, para o chamador liberar as
+        vagas de renderização e atualizar o histórico.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            failed = self._recover_expired(conn, now)
+            conn.execute('COMMIT')
+            return failed
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _recover_expired(self, conn, now):
+        failed = [row['job_id'] for row in conn.execute(
+            "SELECT job_id FROM render_jobs WHERE state = 'processing' AND lease_expires < ? AND attempts >= ?",
+            (now, self.max_attempts)
+        )]
+        conn.executemany(
+            "UPDATE render_jobs SET state = 'failed', progress = 0, worker_id = NULL, lease_expires = NULL, "
+            "message = 'Erro: worker interrompido repetidamente', updated_at = ? WHERE job_id = ?",
+            [(now, job_id) for job_id in failed]
+        )
+        conn.execute(
+            "UPDATE render_jobs SET state = 'queued', progress = 0, worker_id = NULL, "
+            "message = 'Na fila de renderização (nova tentativa)...', updated_at = ? "
+            "WHERE state = 'processing' AND lease_expires < ?",
+            (now, now)
+        )
+        return failed
+
+    def heartbeat(self, job_id, worker_id):
+        """
+        Renova o lease do job. Retorna False se o worker perdeu o lease.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE render_jobs SET lease_expires = ?, updated_at = ? "
+                "WHERE job_id = ? AND worker_id = ? AND state = 'processing'",
+                (now + self.lease_seconds, now, job_id, worker_id)
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def complete(self, job_id, worker_id, result):
+        """Publica o resultado de um job concluído"""
+        return self._finish(job_id, worker_id, 'completed', 100, 'Vídeo gerado com sucesso!', result)
+
+    def fail(self, job_id, worker_id, message):
+        """Marca o job como falho"""
+        return self._finish(job_id, worker_id, 'failed', 0, message, None)
+
+    def _finish(self, job_id, worker_id, state, progress, message, result):
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE render_jobs SET state = ?, progress = ?, message = ?, result = ?, "
+                "lease_expires = NULL, updated_at = ? "
+                "WHERE job_id = ? AND worker_id = ? AND state = 'processing'",
+                (state, progress, message, json.dumps(result) if result else None,
+                 time.time(), job_id, worker_id)
+            )
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def get_status(self, job_id):
+        """
+        Retorna o status do job no mesmo formato usado por job_status nos apps
+        (para apelidos, o status do job primário)
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT COALESCE(p.state, j.state) AS state, COALESCE(p.progress, j.progress) AS progress, '
+                'COALESCE(p.message, j.message) AS message, COALESCE(p.result, j.result) AS result '
+                'FROM render_jobs j LEFT JOIN render_jobs p ON p.job_id = j.alias_of '
+                'WHERE j.job_id = ? AND j.released = 0',
+                (job_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+
+        if row is None:
+            return None
+
+        status = {
+            # Para o frontend, um job na fila ainda está "em processamento"
+            'status': 'processing' if row['state'] == 'queued' else row['state'],
+            'progress': row['progress'],
+            'message': row['message']
+        }
+        if row['result']:
+            status.update(json.loads(row['result']))
+        return status
+
+    def get_payload(self, job_id):
+        """
+        Retorna o pedido (payload) que foi renderizado para o job
+        (para apelidos, o do job primário), ou None
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT COALESCE(p.payload, j.payload) AS payload '
+                'FROM render_jobs j LEFT JOIN render_jobs p ON p.job_id = j.alias_of '
+                'WHERE j.job_id = ? AND j.released = 0',
+                (job_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row['payload']) if row else None
+
+    def release(self, job_id):
+        """
+        Remove a referência do job ao resultado compartilhado.
+        Retorna o status do resultado se esta era a última referência
+        (o chamador pode então apagar o arquivo), ou None.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT COALESCE(alias_of, job_id) AS primary_id FROM render_jobs '
+                'WHERE job_id = ? AND released = 0',
+                (job_id,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            primary = row['primary_id']
+            conn.execute('UPDATE render_jobs SET released = 1, updated_at = ? WHERE job_id = ?',
+                         (time.time(), job_id))
+            remaining = conn.execute(
+                'SELECT COUNT(*) FROM render_jobs WHERE (job_id = ? OR alias_of = ?) AND released = 0',
+                (primary, primary)
+            ).fetchone()[0]
+            result = conn.execute('SELECT result FROM render_jobs WHERE job_id = ?', (primary,)).fetchone()
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        if remaining or not result['result']:
+            return None
+        return json.loads(result['result'])
@@ -0,0 +1,99 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class JsonFileCache:
+    """
+    Cache de leitura (read-through) de um arquivo JSON de registros
+    (ex.: user_data/users.json), com os registros mais usados em um LRU.
+
+    O cache é invalidado pela assinatura do arquivo (mtime, tamanho e inode),
+    então gravações de outros processos (workers do gunicorn, render_worker)
+    também são vistas. Gravações feitas por este processo atualizam o cache
+    diretamente, sem precisar ler o arquivo de novo.
+    """
+
+    def __init__(self, path, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._records = OrderedDict()  # chave -> registro (ou _MISSING)
+        self._signature = None
+        self.hits = 0
+        self.misses = 0
+
+    def _current_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def load(self):
+        """Lê o arquivo inteiro (para quem vai alterar e gravar)"""
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def get(self, key, default=None):
+        """Retorna uma cópia do registro da chave, ou default se não existir"""
+        with self._lock:
+            signature = self._current_signature()
+            if signature != self._signature:
+                self._records.clear()
+                self._signature = signature
+            if key in self._records:
+                record = self._records[key]
+                self._records.move_to_end(key)
+                self.hits += 1
+                return default if record is _MISSING else copy.deepcopy(record)
+            self.misses += 1
+
+        data = self.load()
+        record = data.get(key, _MISSING)
+        with self._lock:
+            # Só guarda se o arquivo não mudou enquanto era lido
+            if self._signature == signature:
+                self._remember(key, record)
+        return default if record is _MISSING else copy.deepcopy(record)
+
+    def save(self, data):
+        """
+        Grava o arquivo inteiro de forma atômica (arquivo temporário + rename,
+        leitores nunca veem um JSON pela metade) e atualiza o cache
+        """
+        directory = os.path.dirname(self.path) or '.'
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=2)
+                f.flush()
+                os.fchmod(f.fileno(), 0o644)  # mkstemp cria com 0600
+                stat = os.fstat(f.fileno())
+            os.replace(temp_path, self.path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            keys = list(self._records)
+            self._records.clear()
+            self._signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            for key in keys:
+                record = data.get(key, _MISSING)
+                self._remember(key, record if record is _MISSING else copy.deepcopy(record))
+
+    def _remember(self, key, record):
+        self._records[key] = record
+        self._records.move_to_end(key)
+        while len(self._records) > self.max_entries:
+            self._records.popitem(last=False)
@@ -0,0 +1,555 @@
+"""
+Teste de carga da camada HTTP (app.py e app_with_auth.py) sem codificar vídeo.
+
+O gerador de vídeo é substituído por um falso (FakeVideoGenerator) com
+latência sintética configurável; todo o resto (validação de upload, blobs,
+fila, deduplicação, limites, status, download) é o código real dos apps.
+Cada usuário virtual repete o fluxo do frontend: registro e login (app com
+autenticação), templates, upload, polling do status, download e dashboard.
+
+Exemplos:
+    # Servidor embutido (werkzeug com threads) + clientes no mesmo processo
+    python load_test.py --app app_with_auth --users 20 --duration 60
+
+    # Contra um gunicorn já rodando com o gerador falso
+    IMOVIBE_LOADTEST_DIR=/tmp/imovibe_lt gunicorn -k gthread --threads 32 \\
+        'load_test:create_app("app_with_auth")'
+    python load_test.py --url http://127.0.0.1:8000 --app app_with_auth
+
+    # Comparar com uma execução anterior
+    python load_test.py --json atual.json --baseline anterior.json
+
+Com mais de um worker do gunicorn o status dos jobs precisa ser
+compartilhado: use IMOVIBE_RENDER_MODE=queue no servidor e
+--render-mode queue --render-workers N aqui (os workers de renderização
+falsos rodam neste processo, na mesma pasta de trabalho).
+"""
+import argparse
+import asyncio
+import http.client
+import importlib
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+
+import advanced_video_generator
+from advanced_video_generator import AdvancedVideoGenerator
+from ffmpeg_capabilities import cpu_count
+from ffmpeg_engine import FFmpegEngine, FFmpegResult
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), 'imovibe_loadtest')
+
+# Operações mostradas no relatório, na ordem do fluxo
+OPERATIONS = ('register', 'login', 'templates', 'upload', 'poll', 'download', 'dashboard')
+
+# Capacidades declaradas pelo gerador falso: o probe real (com self-test de
+# codificação) não roda, então o teste sobe igual com ou sem ffmpeg instalado
+FAKE_CAPABILITIES = {
+    'ok': True,
+    'ffmpeg': 'fake',
+    'ffprobe': 'fake',
+    'encoders': {'libx264': True, 'aac': True, 'libwebp': False},
+    'filters': {},
+    'font_backend': 'fontconfig',
+    'cpu_count': cpu_count(),
+    'self_test': None,
+    'probed_at': None,
+    'problems': []
+}
+
+
+class FakeEngine(FFmpegEngine):
+    """
+    Motor que não executa o ffmpeg: o ffprobe responde uma mídia 1280x720 de
+    5 segundos e qualquer outro comando termina com sucesso
+    """
+
+    async def run(self, cmd, capture_stdout=False, limited=True, timeout=None):
+        stdout = None
+        if cmd[0] == 'ffprobe':
+            stdout = json.dumps({
+                'streams': [{'width': 1280, 'height': 720}],
+                'format': {'duration': '5.0'}
+            })
+        return FFmpegResult(cmd, 0, '', stdout)
+
+
+class FakeVideoGenerator(AdvancedVideoGenerator):
+    """
+    Gerador com latência sintética. Cada job ocupa uma vaga de encoder do
+    motor durante a latência, como uma renderização real, e grava MP4s
+    falsos de video_kb KB.
+    """
+
+    latency = 2.0  # Segundos por job (variando ±jitter)
+    jitter = 0.5
+    failure_rate = 0.0
+    video_kb = 256
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('engine', FakeEngine())
+        kwargs.setdefault('capabilities', FAKE_CAPABILITIES)
+        super().__init__(*args, **kwargs)
+
+    async def create_property_video_async(self, files_data, property_data, job_id, master=None):
+        async with self.engine._slots(1):
+            await asyncio.sleep(max(0, self.latency * random.uniform(1 - self.jitter, 1 + self.jitter)))
+        if random.random() < self.failure_rate:
+            raise Exception('Falha sintética do teste de carga')
+
+        formats = self.resolve_output_formats(property_data)
+        video_paths = {}
+        for index, fmt in enumerate(formats):
+            suffix = '' if index == 0 else f'_{self.format_slug(fmt)}'
+            video_paths[fmt] = f"{self.output_folder}/final_{job_id}{suffix}.mp4"
+            with open(video_paths[fmt], 'wb') as f:
+                f.write(os.urandom(self.video_kb * 1024))
+        file_sizes = {fmt: os.path.getsize(path) for fmt, path in video_paths.items()}
+        poster_path = f"{self.output_folder}/final_{job_id}_poster.jpg"
+        with open(poster_path, 'wb') as f:
+            f.write(b'\xff\xd8\xff\xe0' + os.urandom(4 * 1024))
+        return {
+            'video_path': video_paths[formats[0]],
+            'video_paths': video_paths,
+            'file_size': file_sizes[formats[0]],
+            'file_sizes': file_sizes,
+            'delivery': None,
+            'previews': {'poster': poster_path},
+            'master': None
+        }
+
+
+def load_app(app_name, workdir, render_mode='inline', rate_limits=False):
+    """
+    Importa o app (app ou app_with_auth) com o gerador falso.
+
+    Os apps usam caminhos relativos ao diretório atual (uploads, vídeos,
+    bancos), como em produção, então o processo passa a rodar em workdir
+    para não misturar os arquivos do teste com os do repositório.
+    Sem rate_limits os limites de requisições são desligados para medir a
+    capacidade do servidor; os limites dos planos continuam valendo (veja
+    VirtualUser.iteration).
+    """
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    os.environ['IMOVIBE_RENDER_MODE'] = render_mode
+    advanced_video_generator.AdvancedVideoGenerator = FakeVideoGenerator
+
+    module = importlib.import_module(app_name)
+    if not rate_limits:
+        module.rate_limiter.limits = {'default': {'rate': 1e9, 'burst': 1e9}}
+    return module
+
+
+def create_app(app_name='app'):
+    """
+    Fábrica para o gunicorn ('load_test:create_app("app_with_auth")').
+    Configuração pelas variáveis IMOVIBE_LOADTEST_DIR, IMOVIBE_FAKE_LATENCY,
+    IMOVIBE_FAKE_FAILURE_RATE, IMOVIBE_FAKE_VIDEO_KB e
+    IMOVIBE_LOADTEST_RATE_LIMITS=1.
+    """
+    FakeVideoGenerator.latency = float(os.environ.get('IMOVIBE_FAKE_LATENCY', FakeVideoGenerator.latency))
+    FakeVideoGenerator.failure_rate = float(os.environ.get('IMOVIBE_FAKE_FAILURE_RATE', 0))
+    FakeVideoGenerator.video_kb = int(os.environ.get('IMOVIBE_FAKE_VIDEO_KB', FakeVideoGenerator.video_kb))
+    module = load_app(
+        app_name,
+        os.environ.get('IMOVIBE_LOADTEST_DIR', DEFAULT_WORKDIR),
+        os.environ.get('IMOVIBE_RENDER_MODE', 'inline'),
+        rate_limits=os.environ.get('IMOVIBE_LOADTEST_RATE_LIMITS') == '1'
+    )
+    return module.app
+
+
+class _NoDelayConnection(http.client.HTTPConnection):
+    """
+    Conexão com TCP_NODELAY: o http.client envia cabeçalhos e corpo em
+    pacotes separados, e o Nagle + ACK atrasado somaria ~40 ms às medições
+    """
+
+    def connect(self):
+        super().connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class HttpClient:
+    """Cliente HTTP/1.1 mínimo com keep-alive e cookies (sessão do Flask)"""
+
+    def __init__(self, base_url, timeout=60):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.cookies = {}
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = _NoDelayConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # Conexão keep-alive fechada pelo servidor: tenta uma vez com outra
+                self.close()
+                if attempt:
+                    raise
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            name, _, value = cookie.split(';', 1)[0].partition('=')
+            self.cookies[name.strip()] = value
+        return response.status, response.headers, data
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def encode_multipart(fields, files):
+    """Corpo multipart/form-data. files: lista de (campo, nome do arquivo, bytes)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, content in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def fake_jpeg(size_kb):
+    """Bytes com a assinatura JPEG (o validador do upload confere o conteúdo)"""
+    return b'\xff\xd8\xff\xe0' + os.urandom(size_kb * 1024)
+
+
+class Stats:
+    """Amostras de latência por operação (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}  # operação -> [(status, segundos)]
+        self.jobs = {'completed': 0, 'failed': 0, 'timeout': 0}
+        self.turnaround = []  # Upload -> vídeo pronto (segundos)
+
+    def record(self, operation, status, seconds):
+        with self._lock:
+            self.samples.setdefault(operation, []).append((status, seconds))
+
+    def record_job(self, outcome, seconds=None):
+        with self._lock:
+            self.jobs[outcome] += 1
+            if seconds is not None:
+                self.turnaround.append(seconds)
+
+
+def percentile(values, fraction):
+    """Percentil por posição (nearest-rank) de uma lista já ordenada"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'p50': percentile(values, 0.50),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+        'max': values[-1] if values else None
+    }
+
+
+class VirtualUser(threading.Thread):
+    """Usuário simulado repetindo o fluxo upload -> polling -> download até o fim do teste"""
+
+    def __init__(self, index, options, stats, deadline, media):
+        super().__init__(name=f'vu-{index}', daemon=True)
+        self.index = index
+        self.options = options
+        self.stats = stats
+        self.deadline = deadline
+        self.media = media
+        self.client = HttpClient(options.base_url)
+        self.templates_etag = None
+
+    def call(self, operation, method, path, body=None, headers=None):
+        started = time.perf_counter()
+        try:
+            status, response_headers, data = self.client.request(method, path, body, headers)
+        except (OSError, http.client.HTTPException):
+            self.stats.record(operation, 0, time.perf_counter() - started)
+            return 0, {}, b''
+        self.stats.record(operation, status, time.perf_counter() - started)
+        return status, response_headers, data
+
+    def call_json(self, operation, method, path, payload):
+        return self.call(operation, method, path, json.dumps(payload).encode(),
+                         {'Content-Type': 'application/json'})
+
+    def run(self):
+        try:
+            if self.options.app == 'app_with_auth' and not self.authenticate():
+                return
+            while time.time() < self.deadline:
+                self.iteration()
+                time.sleep(self.options.think_time * random.uniform(0.5, 1.5))
+        finally:
+            self.client.close()
+
+    def authenticate(self):
+        email = f'lt-{uuid.uuid4().hex[:12]}@example.com'
+        status, _, _ = self.call_json('register', 'POST', '/api/auth/register',
+                                      {'email': email, 'name': f'Usuário {self.index}'})
+        if status != 200:
+            return False
+        # Nova sessão, como um login vindo de outro dispositivo
+        self.client.cookies.clear()
+        status, _, _ = self.call_json('login', 'POST', '/api/auth/login', {'email': email})
+        return status == 200
+
+    def iteration(self):
+        # O frontend revalida a lista de templates (304 se nada mudou)
+        headers = {'If-None-Match': self.templates_etag} if self.templates_etag else {}
+        status, response_headers, _ = self.call('templates', 'GET', '/api/templates', headers=headers)
+        if status == 200:
+            self.templates_etag = response_headers.get('ETag')
+
+        files = [('files', f'foto_{index}.jpg', self.media[index % len(self.media)] if self.options.shared_media
+                  else fake_jpeg(self.options.media_kb))
+                 for index in range(self.options.files_per_upload)]
+        body, content_type = encode_multipart({
+            'name': f'Imóvel {self.index}',
+            'area': '120',
+            'price': '450.000',
+            'location': 'Centro',
+            'template': random.choice(['casa', 'apartamento', 'terreno']),
+            'music': '',
+            'formats': self.options.formats
+        }, files)
+        started = time.time()
+        status, _, data = self.call('upload', 'POST', '/api/upload', body, {'Content-Type': content_type})
+        if status != 200:
+            return
+        job_id = json.loads(data)['job_id']
+
+        while True:
+            time.sleep(self.options.poll_interval)
+            status, _, data = self.call('poll', 'GET', f'/api/video-status/{job_id}')
+            job = json.loads(data) if status == 200 else {}
+            if job.get('status') == 'completed':
+                self.stats.record_job('completed', time.time() - started)
+                self.call('download', 'GET', f'/api/download/{job_id}')
+                break
+            if job.get('status') == 'failed':
+                self.stats.record_job('failed')
+                break
+            if time.time() - started > self.options.job_timeout:
+                self.stats.record_job('timeout')
+                break
+
+        if self.options.app == 'app_with_auth':
+            status, _, data = self.call('dashboard', 'GET', '/api/dashboard')
+            # Plano gratuito esgotado: um novo cadastro, como um usuário novo
+            # chegando (com --enforce-plans a conta continua e recebe os 403)
+            if status == 200 and not self.options.enforce_plans and \
+                    json.loads(data)['usage']['videos_remaining'] == 0:
+                self.authenticate()
+
+
+def build_report(stats, elapsed):
+    operations = {}
+    total = 0
+    for operation in OPERATIONS + tuple(sorted(set(stats.samples) - set(OPERATIONS))):
+        samples = stats.samples.get(operation)
+        if not samples:
+            continue
+        total += len(samples)
+        errors = sum(1 for status, _ in samples if status == 0 or status >= 500)
+        rejected = sum(1 for status, _ in samples if 400 <= status < 500)
+        operations[operation] = {
+            'count': len(samples),
+            'throughput': len(samples) / elapsed,
+            'error_rate': errors / len(samples),
+            'rejected_rate': rejected / len(samples),
+            'latency': summarize([seconds for _, seconds in samples])
+        }
+    return {
+        'elapsed': elapsed,
+        'requests': total,
+        'throughput': total / elapsed,
+        'operations': operations,
+        'jobs': dict(stats.jobs, turnaround=summarize(stats.turnaround))
+    }
+
+
+def _ms(value):
+    return '-' if value is None else f'{value * 1000:.1f}'
+
+
+def print_report(report, baseline=None):
+    print(f"\n{report['requests']} requisições em {report['elapsed']:.1f}s "
+          f"({report['throughput']:.1f} req/s)")
+    print(f"{'operação':<11}{'total':>7}{'req/s':>8}{'erros':>8}{'4xx':>8}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for operation, data in report['operations'].items():
+        latency = data['latency']
+        line = (f"{operation:<11}{data['count']:>7}{data['throughput']:>8.1f}"
+                f"{data['error_rate']:>8.1%}{data['rejected_rate']:>8.1%}"
+                f"{_ms(latency['p50']):>9}{_ms(latency['p95']):>9}{_ms(latency['p99']):>9}{_ms(latency['max']):>9}")
+        previous = (baseline or {}).get('operations', {}).get(operation)
+        if previous and previous['latency']['p95'] and latency['p95']:
+            change = latency['p95'] / previous['latency']['p95'] - 1
+            line += f"   p95 {change:+.0%} vs. base"
+        print(line)
+
+    jobs = report['jobs']
+    turnaround = jobs['turnaround']
+    print(f"\njobs: {jobs['completed']} prontos, {jobs['failed']} falharam, {jobs['timeout']} sem resposta; "
+          f"upload -> pronto p50 {_ms(turnaround['p50'])} ms, p95 {_ms(turnaround['p95'])} ms")
+    if baseline:
+        print(f"vazão: {report['throughput']:.1f} req/s (base {baseline['throughput']:.1f} req/s)")
+
+
+def start_server(app):
+    """Servidor werkzeug com threads em uma porta livre; retorna (servidor, URL)"""
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    # Herdado pelas conexões aceitas (o werkzeug também grava cabeçalhos e corpo separados)
+    server.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    threading.Thread(target=server.serve_forever, name='loadtest-server', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def start_render_workers(count, concurrency, module=None):
+    """
+    Workers de renderização (modo fila) com o gerador falso, em threads.
+    Sem module (servidor externo), usam a fila e os bancos da pasta atual.
+    """
+    from render_worker import RenderWorker
+    if module is not None:
+        queue, generator = module.render_queue, module.video_generator
+        rate_limiter, job_index = module.rate_limiter, getattr(module, 'job_index', None)
+    else:
+        from job_index import JobIndex
+        from job_queue import RenderQueue
+        from rate_limit import create_rate_limiter
+        queue, generator = RenderQueue(), FakeVideoGenerator()
+        rate_limiter, job_index = create_rate_limiter(), JobIndex()
+
+    workers = [RenderWorker(queue, generator, concurrency, 0.2, rate_limiter, job_index) for _ in range(count)]
+    for index, worker in enumerate(workers):
+        worker.worker_id += f'-lt{index}'
+        threading.Thread(target=worker.run, name=f'render-worker-{index}', daemon=True).start()
+    return workers
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga HTTP do ImoVibe com gerador de vídeo falso')
+    parser.add_argument('--app', default='app_with_auth', choices=['app', 'app_with_auth'])
+    parser.add_argument('--url', help='Servidor já rodando (padrão: servidor embutido neste processo)')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help='Pasta de uploads, vídeos e bancos do teste')
+    parser.add_argument('--users', type=int, default=10, help='Usuários virtuais simultâneos')
+    parser.add_argument('--duration', type=float, default=30, help='Duração do teste em segundos')
+    parser.add_argument('--ramp-up', type=float, default=5, help='Segundos para iniciar todos os usuários')
+    parser.add_argument('--think-time', type=float, default=1.0, help='Pausa média entre vídeos de um usuário')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--job-timeout', type=float, default=120)
+    parser.add_argument('--files-per-upload', type=int, default=3)
+    parser.add_argument('--media-kb', type=int, default=200, help='Tamanho de cada arquivo enviado')
+    parser.add_argument('--shared-media', action='store_true',
+                        help='Todos enviam as mesmas fotos (exercita blobs e deduplicação)')
+    parser.add_argument('--formats', default='', help='Formatos pedidos no upload (padrão: todos do template)')
+    parser.add_argument('--latency', type=float, default=FakeVideoGenerator.latency,
+                        help='Segundos de renderização sintética por job')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fração de jobs que falham')
+    parser.add_argument('--video-kb', type=int, default=FakeVideoGenerator.video_kb, help='Tamanho dos MP4s falsos')
+    parser.add_argument('--render-mode', default='inline', choices=['inline', 'queue'])
+    parser.add_argument('--render-workers', type=int, default=None,
+                        help='Workers de renderização falsos no modo fila (padrão: 1, ou 0 com --url)')
+    parser.add_argument('--render-concurrency', type=int, default=4, help='Jobs por worker de renderização')
+    parser.add_argument('--rate-limits', action='store_true', help='Mantém os limites de requisições')
+    parser.add_argument('--enforce-plans', action='store_true',
+                        help='Cada usuário mantém sua conta depois de esgotar o plano gratuito (uploads com 403)')
+    parser.add_argument('--json', help='Grava o relatório em JSON')
+    parser.add_argument('--baseline', help='Relatório JSON anterior para comparação')
+    options = parser.parse_args()
+
+    FakeVideoGenerator.latency = options.latency
+    FakeVideoGenerator.failure_rate = options.failure_rate
+    FakeVideoGenerator.video_kb = options.video_kb
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+    # Caminhos de saída relativos à pasta de onde o teste foi chamado
+    json_path = os.path.abspath(options.json) if options.json else None
+
+    server = None
+    render_workers = options.render_workers
+    if render_workers is None:
+        render_workers = 0 if options.url else 1
+    if options.url:
+        options.base_url = options.url
+        if options.render_mode == 'queue' and render_workers:
+            os.makedirs(options.workdir, exist_ok=True)
+            os.chdir(options.workdir)
+            workers = start_render_workers(render_workers, options.render_concurrency)
+        else:
+            workers = []
+    else:
+        module = load_app(options.app, options.workdir, options.render_mode, options.rate_limits)
+        server, options.base_url = start_server(module.app)
+        workers = []
+        if options.render_mode == 'queue':
+            workers = start_render_workers(render_workers, options.render_concurrency, module)
+
+    print(f"Teste de carga: {options.app} em {options.base_url}, {options.users} usuários, "
+          f"{options.duration:.0f}s, renderização sintética de {options.latency}s")
+
+    stats = Stats()
+    media = [fake_jpeg(options.media_kb) for _ in range(options.files_per_upload)]
+    started = time.time()
+    deadline = started + options.duration
+    users = []
+    for index in range(options.users):
+        user = VirtualUser(index, options, stats, deadline, media)
+        user.start()
+        users.append(user)
+        time.sleep(options.ramp_up / max(1, options.users))
+    for user in users:
+        user.join(timeout=max(0, deadline - time.time()) + options.job_timeout)
+    elapsed = time.time() - started
+
+    for worker in workers:
+        worker.stop()
+    if server is not None:
+        server.shutdown()
+
+    report = build_report(stats, elapsed)
+    print_report(report, baseline)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
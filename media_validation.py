@@ -0,0 +1,183 @@
+import asyncio
+import json
+import os
+
+# Assinaturas (magic bytes) dos formatos aceitos: (deslocamento, bytes, formato)
+SIGNATURES = (
+    (0, b'\x89PNG\r\n\x1a\n', 'png'),
+    (0, b'\xff\xd8\xff', 'jpeg'),
+    (0, b'GIF87a', 'gif'),
+    (0, b'GIF89a', 'gif'),
+    (0, b'\x1a\x45\xdf\xa3', 'webm'),  # EBML (WebM/Matroska)
+    (4, b'ftyp', 'mp4'),  # ISO BMFF (MP4/MOV)
+    (4, b'moov', 'mov'),  # QuickTime antigo, sem ftyp
+    (4, b'mdat', 'mov'),
+    (4, b'wide', 'mov'),
+)
+
+IMAGE_FORMATS = {'png', 'jpeg', 'gif'}
+VIDEO_FORMATS = {'mp4', 'mov', 'webm', 'avi'}
+
+# Formato esperado pelo conteúdo para cada extensão aceita no upload
+EXTENSION_FORMATS = {
+    'png': 'image', 'jpg': 'image', 'jpeg': 'image', 'gif': 'image',
+    'mp4': 'video', 'mov': 'video', 'avi': 'video', 'webm': 'video'
+}
+
+# Limites de dimensão e duração
+MIN_WIDTH = 320
+MIN_HEIGHT = 240
+MAX_PIXELS = 8192 * 8192  # Evita "bombas" de descompressão
+MIN_VIDEO_DURATION = 0.5
+MAX_VIDEO_DURATION = 300
+
+# ffprobe/ffmpeg de validação rodando ao mesmo tempo (em todos os uploads do processo)
+MAX_CONCURRENT_CHECKS = int(os.environ.get('IMOVIBE_VALIDATION_CONCURRENCY', '4'))
+
+
+class InvalidMediaError(Exception):
+    """Arquivo enviado recusado na validação (reason é mostrado ao usuário)"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def sniff_format(path):
+    """
+    Identifica o formato pelo conteúdo do arquivo (magic bytes),
+    ou None se não for um formato aceito
+    """
+    with open(path, 'rb') as f:
+        header = f.read(16)
+    if header[:4] == b'RIFF' and header[8:12] == b'AVI ':
+        return 'avi'
+    for offset, signature, media_format in SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            return media_format
+    return None
+
+
+class MediaValidator:
+    """
+    Validação dos arquivos no momento do upload, antes de ocupar um worker:
+    conteúdo compatível com a extensão, decodificação rápida do primeiro
+    frame (ou do primeiro segundo, para vídeos) e limites de dimensão e
+    duração.
+
+    As verificações não ocupam vagas de encoder, mas têm seu próprio limite
+    (max_concurrency) para que uma rajada de uploads não dispare um número
+    ilimitado de processos.
+    """
+
+    def __init__(self, engine, timeout=5, max_concurrency=MAX_CONCURRENT_CHECKS):
+        self.engine = engine
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    async def _run(self, cmd, capture_stdout=False):
+        # Criado sob demanda, já dentro do event loop do motor
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await self.engine.run(cmd, capture_stdout=capture_stdout, limited=False, timeout=self.timeout)
+
+    def validate_files(self, files):
+        """
+        Valida vários arquivos ao mesmo tempo.
+
+        files: lista de (caminho, extensão)
+        Retorna, para cada arquivo, (informações, None) se for válido
+        ou (None, motivo da recusa).
+        """
+        async def validate_all():
+            return await asyncio.gather(*[self.validate(path, extension) for path, extension in files],
+                                        return_exceptions=True)
+
+        results = []
+        for outcome in self.engine.run_sync(validate_all()):
+            if isinstance(outcome, InvalidMediaError):
+                results.append((None, outcome.reason))
+            elif isinstance(outcome, Exception):
+                results.append((None, f'Erro ao validar arquivo: {str(outcome)}'))
+            else:
+                results.append((outcome, None))
+        return results
+
+    async def validate(self, path, extension):
+        """
+        Valida um arquivo e retorna {'type', 'format', 'width', 'height', 'duration'}.
+        Lança InvalidMediaError com o motivo da recusa.
+        """
+        if os.path.getsize(path) == 0:
+            raise InvalidMediaError('Arquivo vazio')
+
+        media_format = sniff_format(path)
+        if media_format is None:
+            raise InvalidMediaError('Conteúdo do arquivo não é uma imagem ou vídeo suportado')
+        media_type = 'image' if media_format in IMAGE_FORMATS else 'video'
+        if EXTENSION_FORMATS.get(extension) != media_type:
+            raise InvalidMediaError(f'Extensão .{extension} não corresponde ao conteúdo ({media_format})')
+
+        info = await self._probe(path)
+        info.update({'type': media_type, 'format': media_format})
+        self._check_limits(info)
+        await self._decode_check(path, media_type)
+        return info
+
+    async def _probe(self, path):
+        cmd = [
+            'ffprobe', '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'stream=width,height:format=duration',
+            '-of', 'json',
+            path
+        ]
+        try:
+            result = await self._run(cmd, capture_stdout=True)
+        except asyncio.TimeoutError:
+            raise InvalidMediaError('Tempo esgotado ao ler o arquivo')
+        if result.returncode != 0:
+            raise InvalidMediaError('Arquivo corrompido ou ilegível')
+
+        probe = json.loads(result.stdout)
+        streams = probe.get('streams', [])
+        if not streams:
+            raise InvalidMediaError('Arquivo não tem imagem/vídeo')
+        duration = probe.get('format', {}).get('duration')
+        return {
+            'width': int(streams[0].get('width') or 0),
+            'height': int(streams[0].get('height') or 0),
+            'duration': float(duration) if duration not in (None, 'N/A') else None
+        }
+
+    def _check_limits(self, info):
+        width, height = info['width'], info['height']
+        if width < MIN_WIDTH or height < MIN_HEIGHT:
+            raise InvalidMediaError(f'Resolução muito baixa ({width}x{height}, mínimo {MIN_WIDTH}x{MIN_HEIGHT})')
+        if width * height > MAX_PIXELS:
+            raise InvalidMediaError(f'Resolução muito alta ({width}x{height})')
+        if info['type'] == 'video':
+            duration = info['duration']
+            if duration is None or duration < MIN_VIDEO_DURATION:
+                raise InvalidMediaError('Vídeo curto demais ou sem duração')
+            if duration > MAX_VIDEO_DURATION:
+                raise InvalidMediaError(f'Vídeo longo demais ({duration:.0f}s, máximo {MAX_VIDEO_DURATION}s)')
+
+    async def _decode_check(self, path, media_type):
+        """Decodifica o primeiro frame (imagem) ou o primeiro segundo (vídeo)"""
+        limit = ['-frames:v', '1'] if media_type == 'image' else ['-t', '1']
+        cmd = [
+            'ffmpeg', '-v', 'error', '-xerror',
+            '-i', path,
+            '-map', '0:v:0',
+            *limit,
+            '-f', 'null', '-'
+        ]
+        try:
+            result = await self._run(cmd)
+        except asyncio.TimeoutError:
+            raise InvalidMediaError('Tempo esgotado ao decodificar o arquivo')
+        if result.returncode != 0:
+            raise InvalidMediaError('Arquivo corrompido: falha ao decodificar')
@@ -0,0 +1,252 @@
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB_PATH = os.environ.get('RATE_LIMIT_DB', 'job_data/rate_limits.db')
+
+# Token bucket por endpoint: 'rate' fichas por segundo, até 'burst' acumuladas.
+# Vale separadamente para cada IP e para cada usuário logado.
+DEFAULT_RATE_LIMITS = {
+    'upload_files': {'rate': 10 / 60, 'burst': 5},
+    'edit_job': {'rate': 10 / 60, 'burst': 5},
+    'register': {'rate': 5 / 3600, 'burst': 5},
+    'login': {'rate': 10 / 60, 'burst': 10},
+    'video_status': {'rate': 2, 'burst': 20},
+    'download_video': {'rate': 1, 'burst': 10},
+    'default': {'rate': 5, 'burst': 30}
+}
+
+# Renderizações presas (processo morto sem liberar a vaga) expiram depois disso
+DEFAULT_SLOT_TTL = 2 * 60 * 60
+
+# Intervalo entre as limpezas de buckets já cheios no SQLite
+PRUNE_INTERVAL = 60
+
+
+def _refill(tokens, updated, rate, burst, now):
+    return min(burst, tokens + max(0, now - updated) * rate)
+
+
+def _full_at(tokens, rate, burst, now):
+    # Depois desse instante o bucket estaria cheio: esquecê-lo não muda nada
+    return now + (burst - tokens) / rate
+
+
+class MemoryRateLimitBackend:
+    """
+    Backend em memória (um único processo). Um lock torna cada operação atômica.
+    """
+
+    def __init__(self, max_buckets=100000):
+        self._lock = threading.Lock()
+        self._buckets = {}  # chave -> (fichas, atualizado em, cheio em)
+        self._slots = {}  # job -> (dono, iniciado em)
+        self.max_buckets = max_buckets
+
+    def take(self, buckets, now):
+        with self._lock:
+            states = []
+            retry_after = 0
+            for key, rate, burst in buckets:
+                tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+                tokens = _refill(tokens, updated, rate, burst, now)
+                states.append((key, tokens, rate, burst))
+                if tokens < 1:
+                    retry_after = max(retry_after, (1 - tokens) / rate)
+            # Só consome se todos os buckets tiverem ficha (tudo ou nada)
+            for key, tokens, rate, burst in states:
+                tokens = tokens if retry_after else tokens - 1
+                self._buckets[key] = (tokens, now, _full_at(tokens, rate, burst, now))
+            if len(self._buckets) > self.max_buckets:
+                self._prune(now)
+            return retry_after
+
+    def _prune(self, now):
+        # Buckets que já teriam se enchido de novo podem ser esquecidos
+        for key, (_, _, full_at) in list(self._buckets.items()):
+            if full_at <= now:
+                del self._buckets[key]
+
+    def acquire_slot(self, owner, job_id, limit, now, ttl):
+        with self._lock:
+            self._expire_slots(now, ttl)
+            if sum(1 for slot_owner, _ in self._slots.values() if slot_owner == owner) >= limit:
+                return False
+            self._slots[job_id] = (owner, now)
+            return True
+
+    def release_slot(self, job_id):
+        with self._lock:
+            self._slots.pop(job_id, None)
+
+    def count_slots(self, owner, now, ttl):
+        with self._lock:
+            self._expire_slots(now, ttl)
+            return sum(1 for slot_owner, _ in self._slots.values() if slot_owner == owner)
+
+    def _expire_slots(self, now, ttl):
+        for job_id, (_, started_at) in list(self._slots.items()):
+            if now - started_at > ttl:
+                del self._slots[job_id]
+
+
+class SQLiteRateLimitBackend:
+    """
+    Backend em SQLite, compartilhado entre os workers do gunicorn e os
+    workers de renderização. Cada operação roda em uma transação
+    BEGIN IMMEDIATE, então a leitura e a escrita são atômicas entre processos.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self._last_prune = 0
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        # Com WAL, NORMAL só sincroniza no checkpoint: sem um fsync por
+        # requisição (uma queda perde no máximo as últimas fichas gastas)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            # Coluna adicionada depois da primeira versão: instante em que o bucket estaria cheio
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(rate_buckets)')}
+            if 'full_at' not in columns:
+                conn.execute('ALTER TABLE rate_buckets ADD COLUMN full_at REAL NOT NULL DEFAULT 0')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_rate_buckets_full ON rate_buckets (full_at)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS render_slots (
+                    job_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    started_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_render_slots_owner ON render_slots (owner)')
+        finally:
+            conn.close()
+
+    def _transaction(self, operation):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = operation(conn)
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def take(self, buckets, now):
+        def operation(conn):
+            states = []
+            retry_after = 0
+            for key, rate, burst in buckets:
+                row = conn.execute('SELECT tokens, updated_at FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+                tokens = _refill(row[0], row[1], rate, burst, now) if row else burst
+                states.append((key, tokens, rate, burst))
+                if tokens < 1:
+                    retry_after = max(retry_after, (1 - tokens) / rate)
+            for key, tokens, rate, burst in states:
+                tokens = tokens if retry_after else tokens - 1
+                conn.execute(
+                    'INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)',
+                    (key, tokens, now, _full_at(tokens, rate, burst, now))
+                )
+            if now - self._last_prune >= PRUNE_INTERVAL:
+                # Buckets que já teriam se enchido de novo equivalem a não existir
+                conn.execute('DELETE FROM rate_buckets WHERE full_at <= ?', (now,))
+                self._last_prune = now
+            return retry_after
+        return self._transaction(operation)
+
+    def acquire_slot(self, owner, job_id, limit, now, ttl):
+        def operation(conn):
+            conn.execute('DELETE FROM render_slots WHERE started_at < ?', (now - ttl,))
+            count = conn.execute('SELECT COUNT(*) FROM render_slots WHERE owner = ?', (owner,)).fetchone()[0]
+            if count >= limit:
+                return False
+            conn.execute('INSERT OR REPLACE INTO render_slots (job_id, owner, started_at) VALUES (?, ?, ?)',
+                         (job_id, owner, now))
+            return True
+        return self._transaction(operation)
+
+    def release_slot(self, job_id):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM render_slots WHERE job_id = ?', (job_id,))
+        finally:
+            conn.close()
+
+    def count_slots(self, owner, now, ttl):
+        conn = self._connect()
+        try:
+            return conn.execute(
+                'SELECT COUNT(*) FROM render_slots WHERE owner = ? AND started_at >= ?',
+                (owner, now - ttl)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+
+class RateLimiter:
+    """
+    Limites de requisições (token bucket por endpoint, por IP e por usuário)
+    e de renderizações simultâneas por dono (usuário)
+    """
+
+    def __init__(self, backend, limits=None, slot_ttl=DEFAULT_SLOT_TTL):
+        self.backend = backend
+        self.limits = limits or DEFAULT_RATE_LIMITS
+        self.slot_ttl = slot_ttl
+
+    def hit(self, endpoint, identities):
+        """
+        Registra uma requisição ao endpoint para cada identidade
+        (ex.: 'ip:1.2.3.4', 'user:<id>'). Retorna 0 se permitida, ou
+        quantos segundos esperar antes de tentar de novo.
+        """
+        limit = self.limits.get(endpoint, self.limits['default'])
+        buckets = [(f"{endpoint}:{identity}", limit['rate'], limit['burst']) for identity in identities]
+        return self.backend.take(buckets, time.time())
+
+    def acquire_slot(self, owner, job_id, limit):
+        """Reserva uma vaga de renderização; False se o dono já está no limite"""
+        return self.backend.acquire_slot(owner, job_id, limit, time.time(), self.slot_ttl)
+
+    def release_slot(self, job_id):
+        self.backend.release_slot(job_id)
+
+    def in_flight(self, owner):
+        """Quantas renderizações do dono estão em andamento"""
+        return self.backend.count_slots(owner, time.time(), self.slot_ttl)
+
+
+def create_rate_limiter(default_backend='sqlite', db_path=DEFAULT_DB_PATH):
+    """
+    Cria o limitador com o backend da variável IMOVIBE_RATE_LIMIT_BACKEND
+    ('memory' ou 'sqlite'), ou default_backend se ela não estiver definida.
+    O padrão é 'sqlite' porque os limites (principalmente as vagas de
+    renderização por plano) precisam valer para todos os workers do
+    gunicorn; 'memory' só serve com um único processo.
+    """
+    backend = os.environ.get('IMOVIBE_RATE_LIMIT_BACKEND', default_backend)
+    if backend == 'sqlite':
+        return RateLimiter(SQLiteRateLimitBackend(db_path))
+    return RateLimiter(MemoryRateLimitBackend())
@@ -0,0 +1,116 @@
+import hashlib
+import threading
+
+# Campos do formulário que influenciam o vídeo final
+PROPERTY_FIELDS = ('name', 'area', 'price', 'location', 'template', 'music', 'formats', 'text_style',
+                   'target_size_mb', 'max_bitrate_kbps')
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Calcula o SHA-256 do conteúdo de um arquivo"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def media_sha256(file_data):
+    """
+    SHA-256 de um arquivo enviado: o que veio do armazenamento de blobs já
+    traz o hash, os demais são lidos do disco
+    """
+    return file_data.get('sha256') or file_sha256(file_data['path'])
+
+
+def compute_render_key(files_data, property_data, owner=None):
+    """
+    Chave de deduplicação de uma renderização: hash do conteúdo dos arquivos
+    (na ordem enviada) + template, música e textos do imóvel.
+    owner (ex.: user_id) separa as renderizações de cada dono: jobs de
+    usuários diferentes nunca viram apelidos um do outro (uso, vagas e
+    permissões continuam por usuário).
+    """
+    digest = hashlib.sha256()
+    if owner is not None:
+        digest.update(f"owner:{owner}".encode('utf-8'))
+        digest.update(b'\0')
+    for file_data in files_data:
+        digest.update(file_data['type'].encode())
+        digest.update(media_sha256(file_data).encode())
+    for field in PROPERTY_FIELDS:
+        digest.update(b'\0')
+        digest.update(str(property_data.get(field, '')).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """
+    Deduplicação de renderizações em andamento dentro de um processo.
+
+    O primeiro job com uma chave é o "primário" e renderiza; os seguintes
+    com a mesma chave viram apelidos dele. O resultado pertence a todos os
+    jobs do grupo e só pode ser apagado quando o último for liberado.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}  # chave -> job primário
+        self._keys = {}  # job primário -> chave
+        self._aliases = {}  # job -> job primário
+        self._members = {}  # job primário -> jobs do grupo
+        self._released = set()  # Jobs liberados de grupos que ainda têm referências
+
+    def attach(self, key, job_id):
+        """
+        Registra o job. Retorna o job primário se já existir uma renderização
+        idêntica em andamento, ou None se este job deve renderizar.
+        """
+        with self._lock:
+            primary = self._in_flight.get(key)
+            if primary is None:
+                self._in_flight[key] = job_id
+                self._keys[job_id] = key
+                primary = job_id
+                attached = None
+            else:
+                attached = primary
+            self._aliases[job_id] = primary
+            self._members.setdefault(primary, set()).add(job_id)
+            return attached
+
+    def finish(self, job_id):
+        """Marca a renderização do job primário como terminada"""
+        with self._lock:
+            key = self._keys.pop(job_id, None)
+            if key is not None and self._in_flight.get(key) == job_id:
+                del self._in_flight[key]
+
+    def resolve(self, job_id):
+        """
+        Retorna o job primário que renderiza para este job (None se o job
+        foi liberado e outro job do grupo ainda referencia o resultado;
+        depois da última liberação o grupo é esquecido)
+        """
+        with self._lock:
+            if job_id in self._released:
+                return None
+            return self._aliases.get(job_id, job_id)
+
+    def release(self, job_id):
+        """
+        Remove a referência do job ao resultado.
+        Retorna (job primário, True se era a última referência).
+        """
+        with self._lock:
+            primary = self._aliases.get(job_id, job_id)
+            self._released.add(job_id)
+            members = self._members.get(primary, set())
+            if not members <= self._released:
+                return primary, False
+            # Última referência: o grupo inteiro sai das estruturas
+            for member in members | {job_id}:
+                self._released.discard(member)
+                self._aliases.pop(member, None)
+            self._members.pop(primary, None)
+            return primary, True
@@ -0,0 +1,366 @@
+import asyncio
+import hashlib
+import inspect
+import os
+import shutil
+
+
+class RenderError(Exception):
+    """
+    Falha definitiva de uma etapa do plano de renderização.
+
+    A mensagem é curta e fixa porque vai para o status do job, visto pelo
+    usuário; detail (ex.: o stderr do ffmpeg, com caminhos do servidor)
+    só aparece no log.
+    """
+
+    def __init__(self, node, detail=''):
+        super().__init__(f"Etapa '{node.node_id}' falhou")
+        self.node = node
+        self.detail = detail
+
+
+class RenderNode:
+    """
+    Etapa do plano de renderização.
+
+    command: lista de argumentos do ffmpeg, ou função (síncrona ou async)
+             que recebe os resultados das etapas anteriores e retorna a lista
+    action: corrotina para etapas que não rodam ffmpeg (ex.: probe);
+            recebe os resultados das etapas anteriores
+    depends_on: ids das etapas que precisam terminar antes
+    outputs: arquivos gerados (vazio para etapas que só escrevem em pipe)
+    pipe_to: id da etapa que consome o stdout desta (MPEG-TS por pipe)
+    cache_params: texto que descreve tudo que influencia a saída;
+                  None desliga o cache da etapa
+    estimated_cost: tempo estimado em segundos
+    encoder: False para etapas que só copiam streams (ex.: concat, package),
+             que não ocupam uma vaga de encoder do motor
+    """
+
+    def __init__(self, node_id, kind, command=None, action=None, inputs=(), outputs=(),
+                 depends_on=(), pipe_to=None, cache_params=None, estimated_cost=0.0, encoder=True):
+        self.node_id = node_id
+        self.kind = kind
+        self.command = command
+        self.action = action
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.depends_on = list(depends_on)
+        self.pipe_to = pipe_to
+        self.cache_params = cache_params
+        self.estimated_cost = estimated_cost
+        self.encoder = encoder
+        self.cache_key = None
+
+    @property
+    def cacheable(self):
+        return self.cache_key is not None and bool(self.outputs) and self.pipe_to is None
+
+
+class RenderPlan:
+    """
+    Grafo (DAG) de etapas de uma renderização
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.nodes = {}
+        self.targets = []
+
+    def add(self, node, target=False):
+        for dependency in node.depends_on:
+            if dependency not in self.nodes:
+                raise ValueError(f"Etapa '{node.node_id}' depende de etapa inexistente '{dependency}'")
+        if node.cache_params is not None:
+            dependency_keys = [self.nodes[dependency].cache_key for dependency in node.depends_on]
+            # Se alguma etapa anterior não tem chave, a saída desta também não é reproduzível
+            if all(dependency_keys):
+                digest = hashlib.sha256()
+                for part in [node.kind, node.cache_params, *dependency_keys]:
+                    digest.update(part.encode('utf-8'))
+                    digest.update(b'\0')
+                node.cache_key = digest.hexdigest()
+        self.nodes[node.node_id] = node
+        if target:
+            self.targets.append(node.node_id)
+        return node
+
+    def groups(self):
+        """
+        Agrupa as etapas ligadas por pipe: cada grupo roda como um único pipeline
+        """
+        consumers = {node.pipe_to for node in self.nodes.values() if node.pipe_to}
+        groups = []
+        for node in self.nodes.values():
+            if node.node_id in consumers:
+                continue  # Entra no grupo do produtor
+            group = [node]
+            while group[-1].pipe_to:
+                group.append(self.nodes[group[-1].pipe_to])
+            groups.append(group)
+        return groups
+
+    def group_dependencies(self, group):
+        members = {node.node_id for node in group}
+        return {dependency for node in group for dependency in node.depends_on if dependency not in members}
+
+    def required_nodes(self, done):
+        """
+        Etapas que ainda precisam rodar para gerar os alvos, considerando
+        as que já estão prontas (ex.: restauradas do cache)
+        """
+        groups_by_node = {node.node_id: group for group in self.groups() for node in group}
+        required = set()
+        stack = [target for target in self.targets if target not in done]
+        while stack:
+            node_id = stack.pop()
+            if node_id in required:
+                continue
+            # Uma etapa em pipe só roda junto com o grupo inteiro
+            for member in groups_by_node[node_id]:
+                required.add(member.node_id)
+                for dependency in member.depends_on:
+                    if dependency not in done and dependency not in required:
+                        stack.append(dependency)
+        return required
+
+    def estimated_time(self, concurrency=1, done=()):
+        """
+        Simula a execução em paralelo (até `concurrency` grupos ao mesmo tempo)
+        e retorna o tempo total estimado em segundos
+        """
+        required = self.required_nodes(set(done))
+        pending = [group for group in self.groups() if group[0].node_id in required]
+        finished = set(done) | {node_id for node_id in self.nodes if node_id not in required}
+        running = []  # (instante de término, grupo)
+        now = 0.0
+        while pending or running:
+            ready = [group for group in pending if self.group_dependencies(group) <= finished]
+            while ready and len(running) < concurrency:
+                group = ready.pop(0)
+                pending.remove(group)
+                # As etapas de um pipeline rodam ao mesmo tempo
+                cost = max(node.estimated_cost for node in group)
+                running.append((now + cost, group))
+            if not running:
+                break
+            running.sort(key=lambda item: item[0])
+            now, group = running.pop(0)
+            finished.update(node.node_id for node in group)
+        return now
+
+    def describe(self, concurrency=1, cache=None):
+        """
+        Texto legível do plano (usado no dry-run)
+        """
+        cached = {node.node_id for node in self.nodes.values() if cache and cache.contains(node)}
+        required = self.required_nodes(cached)
+        lines = [f"Plano de renderização do job {self.job_id}:"]
+        for group in self.groups():
+            for index, node in enumerate(group):
+                if node.node_id in cached:
+                    state = 'cache'
+                elif node.node_id in required:
+                    state = 'executar'
+                else:
+                    state = 'dispensada'
+                prefix = '  |' if index else '  -'
+                lines.append(f"{prefix} {node.node_id} [{node.kind}] ({state}, ~{node.estimated_cost:.1f}s)")
+                if node.depends_on:
+                    lines.append(f"      depende de: {', '.join(node.depends_on)}")
+                if node.inputs:
+                    lines.append(f"      entradas: {', '.join(node.inputs)}")
+                outputs = node.outputs or []
+                if node.pipe_to:
+                    outputs = outputs + [f"pipe -> {node.pipe_to}"]
+                if outputs:
+                    lines.append(f"      saídas: {', '.join(outputs)}")
+                if node.cache_key:
+                    lines.append(f"      chave de cache: {node.cache_key[:16]}")
+                if isinstance(node.command, list):
+                    lines.append(f"      comando: {' '.join(node.command)}")
+        lines.append(
+            f"Tempo estimado: {self.estimated_time(concurrency, cached):.1f}s "
+            f"(até {concurrency} encoders em paralelo)"
+        )
+        return '\n'.join(lines)
+
+
+class NodeCache:
+    """
+    Cache em disco das saídas de etapas, indexado pela chave de cache da etapa
+    """
+
+    def __init__(self, folder, max_bytes=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    def _paths(self, node):
+        paths = []
+        for index, output in enumerate(node.outputs):
+            extension = os.path.splitext(output)[1]
+            paths.append(os.path.join(self.folder, node.cache_key[:2], f"{node.cache_key}_{index}{extension}"))
+        return paths
+
+    def contains(self, node):
+        return node.cacheable and all(os.path.exists(path) for path in self._paths(node))
+
+    def restore(self, node):
+        """Copia as saídas do cache para os caminhos da etapa; True se conseguiu"""
+        if not self.contains(node):
+            return False
+        try:
+            for cached_path, output in zip(self._paths(node), node.outputs):
+                link_or_copy(cached_path, output)
+                os.utime(cached_path)  # Marca como usado recentemente
+            return True
+        except OSError:
+            return False
+
+    def store(self, node):
+        if not node.cacheable:
+            return
+        try:
+            for cached_path, output in zip(self._paths(node), node.outputs):
+                os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+                temp_path = f"{cached_path}.{os.getpid()}.tmp"
+                link_or_copy(output, temp_path)
+                os.replace(temp_path, cached_path)
+        except OSError as e:
+            print(f"Erro ao guardar etapa {node.node_id} no cache: {str(e)}")
+            return
+        self.prune()
+
+    def prune(self):
+        """Remove as entradas menos usadas recentemente acima do limite de tamanho"""
+        if not self.max_bytes:
+            return
+        entries = []
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def link_or_copy(source, destination):
+    """Hardlink de source em destination (cópia se não for possível)"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        # Sistemas de arquivos diferentes (ex.: rascunho em tmpfs)
+        shutil.copyfile(source, destination)
+
+
+class PlanExecutor:
+    """
+    Executa um RenderPlan: grupos independentes rodam em paralelo (limitados
+    pelo semáforo do FFmpegEngine), etapas em cache são reaproveitadas e
+    etapas com falha são repetidas antes de desistir
+    """
+
+    def __init__(self, engine, cache=None, retries=1):
+        self.engine = engine
+        self.cache = cache
+        self.retries = retries
+
+    async def execute(self, plan):
+        """
+        Executa o plano e retorna os resultados por etapa (saídas ou retorno
+        da action). Lança RenderError se alguma etapa falhar de vez.
+        """
+        results = {}
+        done = set()
+        if self.cache:
+            for node in plan.nodes.values():
+                if self.cache.restore(node):
+                    results[node.node_id] = node.outputs
+                    done.add(node.node_id)
+
+        required = plan.required_nodes(done)
+        pending = [group for group in plan.groups() if group[0].node_id in required]
+        running = {}
+
+        try:
+            while pending or running:
+                for group in list(pending):
+                    if plan.group_dependencies(group) <= done:
+                        pending.remove(group)
+                        task = asyncio.ensure_future(self._run_group(group, results))
+                        running[task] = group
+                if not running:
+                    raise RenderError(pending[0][0], 'dependências que nunca ficam prontas')
+
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    group = running.pop(task)
+                    task.result()  # Propaga RenderError
+                    done.update(node.node_id for node in group)
+        finally:
+            for task in running:
+                task.cancel()
+            # Espera as etapas canceladas encerrarem seus processos antes de
+            # o chamador apagar o rascunho
+            await asyncio.gather(*running, return_exceptions=True)
+
+        return results
+
+    async def _run_group(self, group, results):
+        for attempt in range(self.retries + 1):
+            failure = await self._attempt_group(group, results)
+            if failure is None:
+                for node in group:
+                    if node.node_id not in results:
+                        results[node.node_id] = node.outputs
+                    if self.cache:
+                        self.cache.store(node)
+                return
+            node, message = failure
+            print(f"Erro na etapa {node.node_id} (tentativa {attempt + 1}): {message}")
+        raise RenderError(node, message)
+
+    async def _attempt_group(self, group, results):
+        """Retorna None em caso de sucesso ou (etapa, mensagem) da falha"""
+        head = group[0]
+        if head.action:
+            try:
+                results[head.node_id] = await head.action(results)
+                return None
+            except Exception as e:
+                return head, str(e)
+
+        commands = []
+        for node in group:
+            try:
+                command = node.command(results) if callable(node.command) else node.command
+                if inspect.isawaitable(command):
+                    command = await command
+            except Exception as e:
+                return node, str(e)
+            commands.append(command)
+
+        if len(commands) == 1:
+            outcomes = [await self.engine.run(commands[0], limited=head.encoder)]
+        else:
+            outcomes = await self.engine.run_pipeline(commands, slots=sum(node.encoder for node in group))
+
+        for node, outcome in zip(group, outcomes):
+            if outcome.returncode != 0:
+                return node, outcome.stderr
+        return None
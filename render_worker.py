@@ -0,0 +1,150 @@
+import argparse
+import os
+import signal
+import socket
+import time
+from advanced_video_generator import AdvancedVideoGenerator
+from job_queue import RenderQueue, DEFAULT_DB_PATH
+from job_index import JobIndex
+from rate_limit import create_rate_limiter
+from user_store import increment_user_usage
+
+
+class RenderWorker:
+    """
+    Worker de renderização: consome jobs da fila compartilhada e publica
+    os resultados de volta no job store
+    """
+
+    def __init__(self, queue, generator, concurrency=1, poll_interval=1.0, rate_limiter=None, job_index=None):
+        self.queue = queue
+        self.generator = generator
+        self.rate_limiter = rate_limiter  # Libera a vaga de renderização simultânea do usuário
+        self.job_index = job_index  # Histórico de jobs dos usuários
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.running = True
+        self.in_flight = {}  # job_id -> (future, payload)
+        self._last_heartbeat = 0
+
+    def stop(self, *args):
+        """Para de pegar novos jobs; os jobs em andamento terminam normalmente"""
+        print(f"[{self.worker_id}] Encerrando após os jobs em andamento...")
+        self.running = False
+
+    def run(self):
+        print(f"[{self.worker_id}] Worker iniciado (concorrência={self.concurrency})")
+        while self.running or self.in_flight:
+            self._collect_finished()
+            if self.running:
+                self._claim_jobs()
+            self._send_heartbeats()
+            time.sleep(self.poll_interval)
+        print(f"[{self.worker_id}] Worker finalizado")
+
+    def _claim_jobs(self):
+        # Jobs que falharam de vez por workers mortos: ninguém mais vai liberar a vaga
+        for job_id in self.queue.recover_expired():
+            print(f"[{self.worker_id}] Job {job_id} falhou após tentativas interrompidas")
+            if self.rate_limiter:
+                self.rate_limiter.release_slot(job_id)
+            if self.job_index:
+                self.job_index.update_status(job_id, 'failed')
+        while len(self.in_flight) < self.concurrency:
+            job = self.queue.claim(self.worker_id)
+            if job is None:
+                return
+            job_id, payload = job
+            print(f"[{self.worker_id}] Renderizando job {job_id}")
+            # Edições trazem o master do job original para reaproveitar
+            future = self.generator.submit_property_video(
+                payload['files_data'], payload['property_data'], job_id, payload.get('master')
+            )
+            self.in_flight[job_id] = (future, payload)
+
+    def _send_heartbeats(self):
+        now = time.time()
+        if now - self._last_heartbeat < self.queue.lease_seconds / 3:
+            return
+        self._last_heartbeat = now
+        for job_id in list(self.in_flight):
+            if not self.queue.heartbeat(job_id, self.worker_id):
+                # O job já pode estar com outro worker: esta renderização para
+                # aqui (os processos do ffmpeg são encerrados) e a vaga e o
+                # status ficam com o novo dono
+                print(f"[{self.worker_id}] Lease perdido para o job {job_id}; renderização cancelada")
+                future, _ = self.in_flight.pop(job_id)
+                future.cancel()
+
+    def _collect_finished(self):
+        for job_id, (future, payload) in list(self.in_flight.items()):
+            if not future.done():
+                continue
+            del self.in_flight[job_id]
+            status = self._publish(job_id, future, payload)
+            if status is None:
+                # Lease perdido: o job já é de outro worker (vaga e status também)
+                print(f"[{self.worker_id}] Resultado do job {job_id} descartado (lease perdido)")
+                continue
+            if self.rate_limiter:
+                self.rate_limiter.release_slot(job_id)
+            if self.job_index:
+                self.job_index.update_status(job_id, status)
+
+    def _publish(self, job_id, future, payload):
+        """
+        Publica o resultado na fila e retorna o status final do job, ou None
+        se o worker perdeu o lease (a fila recusou o resultado)
+        """
+        try:
+            output = future.result()
+        except Exception as e:
+            return 'failed' if self.queue.fail(job_id, self.worker_id, f'Erro: {str(e)}') else None
+
+        if not output or not os.path.exists(output['video_path']):
+            return 'failed' if self.queue.fail(job_id, self.worker_id, 'Erro ao gerar vídeo') else None
+
+        result = {
+            'video_path': output['video_path'],
+            'video_paths': output['video_paths'],
+            'file_size': output['file_size'],
+            'file_sizes': output['file_sizes'],
+            'delivery': output['delivery'],
+            'previews': output['previews'],
+            'master': output['master']
+        }
+        user_id = payload.get('user_id')
+        if user_id:
+            result['user_id'] = user_id
+
+        if not self.queue.complete(job_id, self.worker_id, result):
+            return None
+        if user_id:
+            increment_user_usage(user_id)
+        return 'completed'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker de renderização do ImoVibe')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='Caminho do banco SQLite da fila')
+    parser.add_argument('--concurrency', type=int,
+                        default=int(os.environ.get('RENDER_WORKER_CONCURRENCY', '1')),
+                        help='Jobs renderizados ao mesmo tempo por este worker')
+    parser.add_argument('--lease', type=int, default=60, help='Duração do lease em segundos')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    args = parser.parse_args()
+
+    queue = RenderQueue(args.db, lease_seconds=args.lease)
+    generator = AdvancedVideoGenerator()
+    # Prepara as faixas de música em segundo plano enquanto já consome a fila
+    generator.engine.submit(generator.warm_up_music_cache())
+    worker = RenderWorker(queue, generator, args.concurrency, args.poll_interval,
+                          create_rate_limiter('sqlite'), JobIndex())
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()
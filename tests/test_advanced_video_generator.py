@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from advanced_video_generator import AdvancedVideoGenerator
+
+FAKE_CAPABILITIES = {'ok': True, 'problems': [], 'cpu_count': 4, 'encoders': {'libx264': True}, 'self_test': None}
+PROPERTY = {'name': 'Casa', 'area': '', 'price': '', 'location': '', 'template': 'casa', 'music': '', 'formats': '16:9'}
+
+
+@pytest.fixture
+def generator(tmp_path):
+    return AdvancedVideoGenerator(
+        upload_folder=str(tmp_path / 'uploads'), output_folder=str(tmp_path / 'out'),
+        assets_folder=str(tmp_path / 'assets'), scratch_folder=str(tmp_path / 'scratch'),
+        cache_folder=str(tmp_path / 'cache'), capabilities=FAKE_CAPABILITIES
+    )
+
+
+def build_plan(generator, tmp_path, media, property_data=None):
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    files_data = []
+    for index, media_type in enumerate(media):
+        path = tmp_path / f'{index}.{"mp4" if media_type == "video" else "jpg"}'
+        path.write_bytes(str(index).encode())
+        files_data.append({'id': str(index), 'path': str(path), 'type': media_type})
+    scratch_dir = tmp_path / 'scratch' / 'job'
+    scratch_dir.mkdir(parents=True, exist_ok=True)
+    return generator.build_render_plan(files_data, {**PROPERTY, **(property_data or {})}, 'job', str(scratch_dir))
+
+
+def test_preview_layout_caps_thumbnails_and_keeps_aspect(generator):
+    short = generator._preview_layout('16:9', 9)
+    assert (short['interval'], short['count'], short['columns'], short['rows']) == (2, 5, 5, 1)
+    assert short['height'] % 2 == 0
+
+    long = generator._preview_layout('9:16', 600)
+    assert long['count'] * long['interval'] >= 600
+    assert long['count'] <= 100
+    assert long['height'] > long['width']
+
+
+def test_sprite_vtt_cues_cover_the_video(generator, tmp_path):
+    path = tmp_path / 'sprite.vtt'
+    layout = {'interval': 2, 'count': 3, 'columns': 2, 'rows': 2, 'width': 160, 'height': 90}
+    generator._write_sprite_vtt(str(path), 'sprite.jpg', layout, 5.5)
+    lines = path.read_text().split('\n')
+    assert lines[0] == 'WEBVTT'
+    assert lines[2:4] == ['00:00:00.000 --> 00:00:02.000', 'sprite.jpg#xywh=0,0,160,90']
+    assert lines[5:7] == ['00:00:02.000 --> 00:00:04.000', 'sprite.jpg#xywh=160,0,160,90']
+    assert lines[8:10] == ['00:00:04.000 --> 00:00:05.500', 'sprite.jpg#xywh=0,90,160,90']
+
+
+@pytest.mark.parametrize('chunk_min_files', [12, 2])
+def test_sprite_vtt_is_written_only_after_the_sprite(generator, tmp_path, chunk_min_files):
+    generator.chunk_min_files = chunk_min_files  # 2: modo em trechos, com etapa própria de previews
+    plan = build_plan(generator, tmp_path, ('image', 'image', 'video'))
+    previews = generator.preview_paths('job')
+    node = plan.nodes['sprite_vtt']
+    producers = [plan.nodes[node_id] for node_id in node.depends_on
+                 if previews['sprite'] in plan.nodes[node_id].outputs]
+    assert len(producers) == 1
+    assert (producers[0].kind == 'previews') == (chunk_min_files == 2)
+    assert previews['sprite_vtt'] not in producers[0].outputs
+
+    results = {node_id: {'duration': 4.0, 'has_audio': False}
+               for node_id, other in plan.nodes.items() if other.kind == 'probe'}
+    # Montar os comandos do ffmpeg não grava nada
+    for other in plan.nodes.values():
+        if callable(other.command):
+            other.command(results)
+    assert not (tmp_path / 'out' / 'final_job_sprite.vtt').exists()
+
+    assert asyncio.run(node.action(results)) == [previews['sprite_vtt']]
+    assert (tmp_path / 'out' / 'final_job_sprite.vtt').read_text().startswith('WEBVTT')
+
+
+@pytest.mark.parametrize('chunk_min_files', [12, 2])
+def test_slideshow_gets_silent_audio_only_next_to_video_clips(generator, tmp_path, chunk_min_files):
+    generator.chunk_min_files = chunk_min_files
+    image_only = build_plan(generator, tmp_path / 'a', ('image', 'image', 'image'))
+    with_clip = build_plan(generator, tmp_path / 'b', ('image', 'image', 'video'))
+
+    for plan, has_audio in ((image_only, False), (with_clip, True)):
+        slideshows = [node for node in plan.nodes.values() if node.kind == 'slideshow']
+        assert slideshows
+        for node in slideshows:
+            assert ('anullsrc=r=48000:cl=stereo' in node.command) == has_audio
+        package = plan.nodes['package_16x9']
+        command = package.command if isinstance(package.command, list) else []
+        assert ('0:a' in command) == has_audio
+
+
+def test_trailing_copy_of_last_image_is_not_a_keyframe(generator, tmp_path):
+    plan = build_plan(generator, tmp_path, ('image', 'image', 'image'))
+    command = plan.nodes['slideshow'].command
+    duration = generator.templates['casa']['duration_per_image']
+    assert command[command.index('-force_key_frames') + 1] == f'expr:lt(n_forced,3)*gte(t,n_forced*{duration})'
+
+
+def test_resolve_delivery_parses_targets(generator):
+    assert generator.resolve_delivery({}) is None
+    assert generator.resolve_delivery({'target_size_mb': '8,5', 'max_bitrate_kbps': ''}) == {
+        'target_size': int(8.5 * 1024 * 1024), 'max_bitrate': None
+    }
+    assert generator.resolve_delivery({'max_bitrate_kbps': '2500'}) == {'target_size': None, 'max_bitrate': 2500}
+
+
+@pytest.mark.parametrize('value', ['abc', '0', '-3', 'nan', 'inf'])
+def test_resolve_delivery_rejects_invalid_values(generator, value):
+    with pytest.raises(ValueError):
+        generator.resolve_delivery({'target_size_mb': value})
+
+
+def test_target_size_uses_constrained_vbr(generator):
+    # 10 MB em 60 s: 10 * 1024 * 1024 * 8 * 0.95 / 60 / 1000 = 1328 kbps, menos 160 do áudio
+    options = generator._rate_control_options({'target_size': 10 * 1024 * 1024, 'max_bitrate': None}, 60)
+    assert options == ['-b:v', '1168k', '-maxrate', '1168k', '-bufsize', '1168k']
+
+
+def test_max_bitrate_only_caps_crf(generator):
+    options = generator._rate_control_options({'target_size': None, 'max_bitrate': 2160}, 60)
+    assert options == ['-crf', '23', '-maxrate', '2000k', '-bufsize', '4000k']
+
+
+def test_rate_control_takes_the_tighter_target_and_a_floor(generator):
+    both = generator._rate_control_options({'target_size': 10 * 1024 * 1024, 'max_bitrate': 1000}, 60)
+    assert both[:2] == ['-b:v', '840k']
+    tiny = generator._rate_control_options({'target_size': 1024 * 1024, 'max_bitrate': None}, 600)
+    assert tiny[:2] == ['-b:v', '250k']
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from blob_store import BlobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path / 'blobs'), str(tmp_path / 'blobs.db'))
+
+
+@pytest.fixture
+def upload(tmp_path):
+    incoming = tmp_path / 'incoming'
+    incoming.mkdir()
+    counter = iter(range(1000))
+
+    def write(content):
+        path = incoming / f'upload_{next(counter)}'
+        path.write_bytes(content)
+        return str(path)
+    return write
+
+
+def test_same_content_is_stored_once(store, upload):
+    first_path = upload(b'foto')
+    digest, path = store.store(first_path, 'jpg', 'job-1')
+    second_path = upload(b'foto')
+    assert store.store(second_path, 'jpg', 'job-2') == (digest, path)
+
+    assert open(path, 'rb').read() == b'foto'
+    # Os arquivos recebidos foram movidos ou descartados
+    assert not os.path.exists(first_path)
+    assert not os.path.exists(second_path)
+
+
+def test_blob_is_deleted_with_its_last_reference(store, upload):
+    _, path = store.store(upload(b'foto'), 'jpg', 'job-1')
+    store.store(upload(b'foto'), 'jpg', 'job-2')
+
+    assert store.release('job-1') == 0
+    assert os.path.exists(path)
+    assert store.release('job-2') == 1
+    assert not os.path.exists(path)
+    assert store.release('job-2') == 0
+
+
+def test_add_refs_keeps_blob_alive(store, upload):
+    digest, path = store.store(upload(b'foto'), 'jpg', 'job-1')
+    assert store.add_refs('edit-1', [digest, digest, 'inexistente']) == 1
+
+    store.release('job-1')
+    assert os.path.exists(path)
+    store.release('edit-1')
+    assert not os.path.exists(path)
+
+
+def test_released_content_can_be_stored_again(store, upload):
+    _, path = store.store(upload(b'foto'), 'jpg', 'job-1')
+    store.release('job-1')
+
+    assert store.store(upload(b'foto'), 'jpg', 'job-2')[1] == path
+    assert os.path.exists(path)
+
+
+def test_missing_file_is_recreated_by_next_store(store, upload):
+    # Queda entre o COMMIT e a movimentação do arquivo
+    _, path = store.store(upload(b'foto'), 'jpg', 'job-1')
+    os.remove(path)
+
+    store.store(upload(b'foto'), 'jpg', 'job-2')
+    assert open(path, 'rb').read() == b'foto'
+
+
+def test_sweep_removes_orphans(store, upload):
+    _, kept = store.store(upload(b'foto'), 'jpg', 'job-1')
+    # Arquivo sem linha (release interrompido antes de apagar)
+    orphan = os.path.join(store.root, 'ab', 'cd', 'orfao.jpg')
+    os.makedirs(os.path.dirname(orphan))
+    open(orphan, 'wb').close()
+
+    assert store.sweep() == 1
+    assert not os.path.exists(orphan)
+    assert os.path.exists(kept)
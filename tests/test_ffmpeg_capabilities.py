@@ -0,0 +1,53 @@
+import json
+
+from ffmpeg_capabilities import _read_cache, recommended_settings
+
+
+def test_recommended_settings_without_self_test_use_half_the_cores():
+    settings = recommended_settings({'cpu_count': 8, 'self_test': None})
+    assert settings == {'max_concurrency': 4, 'x264_threads': 2, 'seconds_per_frame': None}
+
+
+def test_recommended_settings_from_measured_speed():
+    # 20 fps por thread: 3 threads por encoder chegam aos 60 fps de 720p
+    settings = recommended_settings({'cpu_count': 8, 'self_test': {'ok': True, 'fps_per_thread': 20}})
+    assert settings['x264_threads'] == 3
+    assert settings['max_concurrency'] == 2
+    assert settings['seconds_per_frame'] == round(1 / (20 * 3 * 0.75), 5)
+
+
+def test_recommended_settings_ignore_a_failed_self_test():
+    capabilities = {'cpu_count': 2, 'self_test': {'ok': False, 'fps_per_thread': 500}}
+    assert recommended_settings(capabilities)['seconds_per_frame'] is None
+
+
+def test_slow_machine_still_gets_one_encoder():
+    settings = recommended_settings({'cpu_count': 4, 'self_test': {'ok': True, 'fps_per_thread': 1}})
+    assert settings['x264_threads'] == 4
+    assert settings['max_concurrency'] == 1
+
+
+def write_cache(tmp_path, content):
+    path = tmp_path / 'capabilities.json'
+    path.write_text(content if isinstance(content, str) else json.dumps(content))
+    return str(path)
+
+
+def test_read_cache_requires_the_same_fingerprint(tmp_path):
+    path = write_cache(tmp_path, {'fingerprint': 'a', 'ok': True, 'self_test': {'ok': True}})
+    assert _read_cache(path, 'a', self_test=True)['fingerprint'] == 'a'
+    assert _read_cache(path, 'b', self_test=True) is None
+
+
+def test_read_cache_without_self_test_is_redone_when_one_is_wanted(tmp_path):
+    path = write_cache(tmp_path, {'fingerprint': 'a', 'ok': True, 'self_test': None})
+    assert _read_cache(path, 'a', self_test=False) is not None
+    assert _read_cache(path, 'a', self_test=True) is None
+    # ffmpeg quebrado: o self-test não rodaria de qualquer jeito
+    broken = write_cache(tmp_path, {'fingerprint': 'a', 'ok': False, 'self_test': None})
+    assert _read_cache(broken, 'a', self_test=True) is not None
+
+
+def test_missing_or_corrupt_cache_is_ignored(tmp_path):
+    assert _read_cache(str(tmp_path / 'nada.json'), 'a', self_test=False) is None
+    assert _read_cache(write_cache(tmp_path, '{corrompido'), 'a', self_test=False) is None
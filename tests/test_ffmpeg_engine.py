@@ -0,0 +1,103 @@
+import asyncio
+import os
+
+import pytest
+
+from ffmpeg_engine import FFmpegEngine, StderrRingBuffer
+
+
+def test_ring_buffer_splits_progress_lines_and_keeps_the_tail():
+    buffer = StderrRingBuffer(max_lines=2)
+    buffer.feed(b'linha 1\nframe=1\rframe=2\r')
+    buffer.feed(b'frame=3\nfinal sem quebra')
+    assert buffer.text() == 'frame=2\nframe=3\nfinal sem quebra'
+
+
+def test_ring_buffer_joins_chunks_split_mid_line():
+    buffer = StderrRingBuffer()
+    buffer.feed('Stream #0: Vídeo'.encode()[:10])
+    buffer.feed('Stream #0: Vídeo'.encode()[10:] + b'\n')
+    assert buffer.text() == 'Stream #0: Vídeo'
+
+
+def run(engine, coro):
+    return engine.run_sync(coro)
+
+
+def test_slots_limit_concurrent_encoders():
+    engine = FFmpegEngine(max_concurrency=2)
+    active = []
+    peak = []
+
+    async def encode():
+        async with engine._slots(1):
+            active.append(1)
+            peak.append(len(active))
+            await asyncio.sleep(0.05)
+            active.pop()
+
+    async def main():
+        await asyncio.gather(*[encode() for _ in range(5)])
+    run(engine, main())
+    assert max(peak) == 2
+
+
+def test_pipeline_reservation_is_capped_and_released():
+    engine = FFmpegEngine(max_concurrency=2)
+
+    async def main():
+        # Pedir mais vagas que o limite não trava: reserva todas
+        async with engine._slots(5):
+            assert engine._semaphore._value == 0
+        return engine._semaphore._value
+    assert run(engine, main()) == 2
+
+
+def test_run_reports_returncode_and_stderr():
+    engine = FFmpegEngine(max_concurrency=1)
+    result = run(engine, engine.run(['sh', '-c', 'echo saída; echo erro >&2; exit 3'], capture_stdout=True))
+    assert result.returncode == 3
+    assert not result.ok
+    assert result.stdout == 'saída\n'
+    assert result.stderr == 'erro'
+
+
+def test_timeout_kills_the_process():
+    engine = FFmpegEngine(max_concurrency=1)
+    with pytest.raises(asyncio.TimeoutError):
+        run(engine, engine.run(['sleep', '30'], timeout=0.2))
+    # A vaga foi devolvida
+    assert run(engine, engine.run(['true'])).ok
+
+
+def open_fds():
+    return set(os.listdir('/proc/self/fd'))
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='precisa de /proc')
+def test_failed_spawn_does_not_leak_pipe_fds():
+    engine = FFmpegEngine(max_concurrency=2)
+    run(engine, engine.run(['true']))  # Cria o event loop e seus fds antes da contagem
+    before = open_fds()
+    with pytest.raises(FileNotFoundError):
+        run(engine, engine.run_pipeline([['programa-que-nao-existe'], ['cat']]))
+    assert open_fds() == before
+
+
+def test_pipeline_reserves_only_the_requested_slots():
+    engine = FFmpegEngine(max_concurrency=2)
+
+    async def main():
+        started = asyncio.Event()
+
+        async def hold_one_slot():
+            async with engine._slots(1):
+                started.set()
+                await asyncio.sleep(0.3)
+        holder = asyncio.ensure_future(hold_one_slot())
+        await started.wait()
+        # Com uma vaga ocupada, um pipeline de 2 estágios e 1 encoder não espera
+        results = await asyncio.wait_for(engine.run_pipeline([['echo', 'x'], ['cat']], slots=1), 0.2)
+        await holder
+        return results
+    assert [result.returncode for result in run(engine, main())] == [0, 0]
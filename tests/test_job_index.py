@@ -0,0 +1,66 @@
+import itertools
+
+import pytest
+
+import job_index
+from job_index import JobIndex, decode_cursor, encode_cursor
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    # Relógio controlado: created_at repetidos testam o desempate por job_id
+    clock = itertools.chain([100.0, 100.0, 100.0, 101.0, 102.0], itertools.count(200.0))
+    monkeypatch.setattr(job_index.time, 'time', lambda: next(clock))
+    return JobIndex(str(tmp_path / 'job_index.db'))
+
+
+def list_all(index, user_id, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        jobs, cursor = index.list_jobs(user_id, cursor=cursor, limit=limit, **filters)
+        pages.append([job['job_id'] for job in jobs])
+        if cursor is None:
+            return pages
+
+
+def test_cursor_pages_newest_first_without_gaps(index):
+    for job_id in ('a', 'c', 'b', 'd', 'e'):
+        index.add(job_id, 'u1', {'name': job_id})
+    index.add('outro', 'u2', {})
+
+    # created_at: a, c, b = 100; d = 101; e = 102
+    assert list_all(index, 'u1', limit=2) == [['e', 'd'], ['c', 'b'], ['a']]
+    assert list_all(index, 'u1', limit=10) == [['e', 'd', 'c', 'b', 'a']]
+
+
+def test_filters_by_status_and_period(index):
+    for job_id in ('a', 'b', 'c', 'd'):
+        index.add(job_id, 'u1', {})
+    index.update_status('d', 'completed')
+
+    assert list_all(index, 'u1', limit=10, status='completed') == [['d']]
+    assert list_all(index, 'u1', limit=10, since=100.5) == [['d']]
+    assert list_all(index, 'u1', limit=10, until=100.5) == [['c', 'b', 'a']]
+
+
+def test_alias_follows_primary_status(index):
+    index.add('a', 'u1', {})
+    index.add('b', 'u1', {}, primary_id='a')
+    index.update_status('a', 'completed')
+
+    statuses = {job['job_id']: job['status'] for job in index.list_jobs('u1')[0]}
+    assert statuses == {'a': 'completed', 'b': 'completed'}
+
+
+def test_owner_and_remove(index):
+    index.add('a', 'u1', {})
+    assert index.owner('a') == 'u1'
+    index.remove('a')
+    assert index.owner('a') is None
+    assert index.list_jobs('u1') == ([], None)
+
+
+def test_cursor_round_trip_and_invalid_cursor(index):
+    assert decode_cursor(encode_cursor(100.25, 'job-1')) == (100.25, 'job-1')
+    with pytest.raises(ValueError):
+        index.list_jobs('u1', cursor='não é um cursor')
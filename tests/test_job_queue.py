@@ -0,0 +1,109 @@
+from job_queue import RenderQueue
+
+
+def make_queue(tmp_path, **kwargs):
+    return RenderQueue(str(tmp_path / 'render_queue.db'), **kwargs)
+
+
+def test_claim_returns_oldest_job_first(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue('a', {'n': 1})
+    queue.enqueue('b', {'n': 2})
+
+    assert queue.claim('w1') == ('a', {'n': 1})
+    assert queue.claim('w1') == ('b', {'n': 2})
+    assert queue.claim('w1') is None
+
+
+def test_complete_publishes_result(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue('a', {})
+    queue.claim('w1')
+
+    assert queue.complete('a', 'w1', {'video_path': 'final_a.mp4'})
+    status = queue.get_status('a')
+    assert status['status'] == 'completed'
+    assert status['video_path'] == 'final_a.mp4'
+
+
+def test_expired_lease_goes_back_to_queue(tmp_path):
+    # Lease negativo: expira assim que é concedido
+    queue = make_queue(tmp_path, lease_seconds=-1)
+    queue.enqueue('a', {})
+    assert queue.claim('w1') == ('a', {})
+
+    # Outro worker recupera o job do worker "morto"
+    assert queue.recover_expired() == []
+    assert queue.claim('w2') == ('a', {})
+    assert queue.get_status('a')['status'] == 'processing'
+
+
+def test_lost_lease_rejects_old_worker(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=-1)
+    queue.enqueue('a', {})
+    queue.claim('w1')
+    queue.recover_expired()
+    queue.claim('w2')
+
+    assert not queue.heartbeat('a', 'w1')
+    assert not queue.complete('a', 'w1', {'video_path': 'x.mp4'})
+    assert not queue.fail('a', 'w1', 'Erro')
+    assert queue.heartbeat('a', 'w2')
+
+
+def test_job_fails_after_max_attempts(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=-1, max_attempts=2)
+    queue.enqueue('a', {})
+    assert queue.claim('w1') is not None
+    assert queue.recover_expired() == []
+    assert queue.claim('w2') is not None
+
+    # A terceira tentativa passaria do limite: o job falha e é informado
+    assert queue.recover_expired() == ['a']
+    assert queue.recover_expired() == []
+    assert queue.claim('w3') is None
+    status = queue.get_status('a')
+    assert status['status'] == 'failed'
+    assert 'interrompido' in status['message']
+
+
+def test_alias_follows_primary_status(tmp_path):
+    queue = make_queue(tmp_path)
+    assert queue.enqueue('a', {'n': 1}, dedup_key='k') is None
+    assert queue.enqueue('b', {'n': 2}, dedup_key='k') == 'a'
+
+    # O apelido nunca é reservado por um worker
+    assert queue.claim('w1') == ('a', {'n': 1})
+    assert queue.claim('w1') is None
+    assert queue.get_status('b')['status'] == 'processing'
+    assert queue.get_payload('b') == {'n': 1}
+
+    queue.complete('a', 'w1', {'video_path': 'final_a.mp4'})
+    status = queue.get_status('b')
+    assert status['status'] == 'completed'
+    assert status['video_path'] == 'final_a.mp4'
+
+
+def test_finished_job_is_not_a_dedup_target(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue('a', {}, dedup_key='k')
+    queue.claim('w1')
+    queue.complete('a', 'w1', {'video_path': 'final_a.mp4'})
+
+    assert queue.enqueue('b', {}, dedup_key='k') is None
+
+
+def test_release_returns_result_only_for_last_reference(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue('a', {}, dedup_key='k')
+    queue.enqueue('b', {}, dedup_key='k')
+    queue.claim('w1')
+    queue.complete('a', 'w1', {'video_path': 'final_a.mp4'})
+
+    # O primário liberado primeiro: o apelido ainda usa o resultado
+    assert queue.release('a') is None
+    assert queue.get_status('a') is None
+    assert queue.get_status('b')['status'] == 'completed'
+
+    assert queue.release('b')['video_path'] == 'final_a.mp4'
+    assert queue.release('b') is None
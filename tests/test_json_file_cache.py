@@ -0,0 +1,77 @@
+import json
+import os
+
+from json_file_cache import JsonFileCache
+
+
+def write_json(path, data):
+    # Gravação de "outro processo": novo arquivo + rename, como o save()
+    temp_path = f"{path}.outro"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def test_missing_file_reads_as_empty(tmp_path):
+    cache = JsonFileCache(str(tmp_path / 'users.json'))
+    assert cache.load() == {}
+    assert cache.get('a', 'padrão') == 'padrão'
+
+
+def test_repeated_gets_hit_the_cache(tmp_path):
+    path = str(tmp_path / 'users.json')
+    write_json(path, {'a': {'plan': 'free'}})
+    cache = JsonFileCache(path)
+
+    assert cache.get('a') == {'plan': 'free'}
+    assert cache.get('a') == {'plan': 'free'}
+    assert cache.get('b') is None
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_external_write_invalidates(tmp_path):
+    path = str(tmp_path / 'users.json')
+    write_json(path, {'a': {'plan': 'free'}})
+    cache = JsonFileCache(path)
+    cache.get('a')
+
+    write_json(path, {'a': {'plan': 'paid'}, 'extra': 1})
+    assert cache.get('a') == {'plan': 'paid'}
+
+
+def test_save_updates_cached_records(tmp_path):
+    path = str(tmp_path / 'users.json')
+    cache = JsonFileCache(path)
+    cache.get('a')
+    cache.save({'a': {'plan': 'paid'}})
+
+    misses = cache.misses
+    assert cache.get('a') == {'plan': 'paid'}
+    assert cache.misses == misses
+    assert cache.load() == {'a': {'plan': 'paid'}}
+
+
+def test_returned_records_are_copies(tmp_path):
+    path = str(tmp_path / 'users.json')
+    write_json(path, {'a': {'plan': 'free'}})
+    cache = JsonFileCache(path)
+
+    cache.get('a')['plan'] = 'paid'
+    assert cache.get('a') == {'plan': 'free'}
+
+
+def test_lru_keeps_most_recent_entries(tmp_path):
+    path = str(tmp_path / 'users.json')
+    write_json(path, {'a': 1, 'b': 2, 'c': 3})
+    cache = JsonFileCache(path, max_entries=2)
+    cache.get('a')
+    cache.get('b')
+    cache.get('a')
+    cache.get('c')  # Descarta b, o menos usado
+
+    misses = cache.misses
+    cache.get('a')
+    assert cache.misses == misses
+    cache.get('b')
+    assert cache.misses == misses + 1
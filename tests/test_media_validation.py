@@ -0,0 +1,32 @@
+import pytest
+
+from media_validation import sniff_format
+
+HEADERS = {
+    'png': b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR',
+    'jpeg': b'\xff\xd8\xff\xe0\x00\x10JFIF\x00',
+    'gif': b'GIF89a\x01\x00\x01\x00',
+    'webm': b'\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01',
+    'mp4': b'\x00\x00\x00\x20ftypisom\x00\x00\x02\x00',
+    'mov': b'\x00\x00\x00\x08wide\x00\x00\x00\x00',
+    'avi': b'RIFF\x24\x00\x00\x00AVI LIST',
+}
+
+
+@pytest.mark.parametrize('media_format', sorted(HEADERS))
+def test_sniff_format_reads_magic_bytes(tmp_path, media_format):
+    path = tmp_path / 'arquivo.bin'
+    path.write_bytes(HEADERS[media_format] + b'\x00' * 32)
+    assert sniff_format(str(path)) == media_format
+
+
+@pytest.mark.parametrize('content', [
+    b'',
+    b'<?php echo 1; ?>',
+    b'RIFF\x24\x00\x00\x00WAVEfmt ',  # RIFF que não é AVI
+    b'\x00\x00\x00\x20ftyp'[:6],  # Cortado antes da assinatura
+])
+def test_sniff_format_rejects_other_content(tmp_path, content):
+    path = tmp_path / 'foto.jpg'
+    path.write_bytes(content)
+    assert sniff_format(str(path)) is None
@@ -0,0 +1,84 @@
+import pytest
+
+from rate_limit import MemoryRateLimitBackend, PRUNE_INTERVAL, RateLimiter, SQLiteRateLimitBackend
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryRateLimitBackend()
+    return SQLiteRateLimitBackend(str(tmp_path / 'rate_limits.db'))
+
+
+def test_bucket_allows_burst_then_waits(backend):
+    buckets = [('upload:ip:1', 1.0, 3)]
+    assert [backend.take(buckets, 100.0) for _ in range(3)] == [0, 0, 0]
+    assert backend.take(buckets, 100.0) == pytest.approx(1.0)
+    # Uma ficha por segundo
+    assert backend.take(buckets, 101.0) == 0
+
+
+def test_take_is_all_or_nothing(backend):
+    ip, user = ('upload:ip:1', 1.0, 1), ('upload:user:u', 1.0, 5)
+    assert backend.take([ip, user], 100.0) == 0
+    assert backend.take([ip, user], 100.0) > 0
+    # A recusa pelo IP não gastou a ficha do usuário
+    assert [backend.take([user], 100.0) for _ in range(4)] == [0, 0, 0, 0]
+
+
+def test_slots_are_limited_per_owner(backend):
+    assert backend.acquire_slot('user:a', 'j1', 1, 100.0, 60)
+    assert not backend.acquire_slot('user:a', 'j2', 1, 100.0, 60)
+    assert backend.acquire_slot('user:b', 'j3', 1, 100.0, 60)
+
+    backend.release_slot('j1')
+    assert backend.acquire_slot('user:a', 'j2', 1, 100.0, 60)
+    assert backend.count_slots('user:a', 100.0, 60) == 1
+
+
+def test_stuck_slots_expire(backend):
+    assert backend.acquire_slot('user:a', 'j1', 1, 100.0, 60)
+    assert backend.count_slots('user:a', 161.0, 60) == 0
+    assert backend.acquire_slot('user:a', 'j2', 1, 161.0, 60)
+
+
+def test_memory_backend_prunes_full_buckets():
+    backend = MemoryRateLimitBackend(max_buckets=2)
+    backend.take([('a', 1.0, 2)], 100.0)
+    backend.take([('b', 1.0, 2)], 100.0)
+    # a e b já teriam se enchido de novo
+    backend.take([('c', 1.0, 2)], 110.0)
+    assert set(backend._buckets) == {'c'}
+
+
+def test_sqlite_backend_prunes_full_buckets(tmp_path):
+    backend = SQLiteRateLimitBackend(str(tmp_path / 'rate_limits.db'))
+    backend.take([('a', 1.0, 2)], 1000.0)
+    backend.take([('b', 1.0, 2)], 1000.0 + PRUNE_INTERVAL)
+
+    conn = backend._connect()
+    try:
+        keys = {row[0] for row in conn.execute('SELECT key FROM rate_buckets')}
+    finally:
+        conn.close()
+    assert keys == {'b'}
+
+
+def test_rate_limiter_uses_endpoint_limits():
+    limiter = RateLimiter(MemoryRateLimitBackend(), limits={
+        'login': {'rate': 1, 'burst': 1},
+        'default': {'rate': 1, 'burst': 100}
+    })
+    assert limiter.hit('login', ['ip:1']) == 0
+    assert limiter.hit('login', ['ip:1']) > 0
+    assert limiter.hit('templates', ['ip:1']) == 0
+
+
+def test_sqlite_backend_uses_wal_without_full_sync(tmp_path):
+    backend = SQLiteRateLimitBackend(str(tmp_path / 'rate_limits.db'))
+    conn = backend._connect()
+    try:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+    finally:
+        conn.close()
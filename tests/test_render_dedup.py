@@ -0,0 +1,71 @@
+from render_dedup import SingleFlight, compute_render_key, file_sha256
+
+PROPERTY = {'name': 'Casa', 'area': '120', 'price': '450.000', 'location': 'Centro', 'template': 'casa'}
+
+
+def make_files(folder, contents):
+    folder.mkdir(exist_ok=True)
+    files = []
+    for index, content in enumerate(contents):
+        path = folder / f'foto_{index}.jpg'
+        path.write_bytes(content)
+        files.append({'path': str(path), 'type': 'image'})
+    return files
+
+
+def test_same_content_gives_same_key(tmp_path):
+    first = make_files(tmp_path / 'a', [b'x', b'y'])
+    second = make_files(tmp_path / 'b', [b'x', b'y'])
+    assert compute_render_key(first, PROPERTY) == compute_render_key(second, PROPERTY)
+
+
+def test_key_depends_on_order_and_fields(tmp_path):
+    files = make_files(tmp_path, [b'x', b'y'])
+    key = compute_render_key(files, PROPERTY)
+
+    assert compute_render_key(list(reversed(files)), PROPERTY) != key
+    assert compute_render_key(files, dict(PROPERTY, price='500.000')) != key
+
+
+def test_key_separates_owners(tmp_path):
+    files = make_files(tmp_path, [b'x'])
+    assert compute_render_key(files, PROPERTY, owner='u1') != compute_render_key(files, PROPERTY, owner='u2')
+    assert compute_render_key(files, PROPERTY, owner='u1') == compute_render_key(files, PROPERTY, owner='u1')
+
+
+def test_known_sha256_skips_reading_the_file(tmp_path):
+    files = make_files(tmp_path, [b'x'])
+    digest = file_sha256(files[0]['path'])
+    stored = [{'path': str(tmp_path / 'apagado.jpg'), 'type': 'image', 'sha256': digest}]
+    assert compute_render_key(stored, PROPERTY) == compute_render_key(files, PROPERTY)
+
+
+def test_single_flight_aliases_and_release():
+    flight = SingleFlight()
+    assert flight.attach('k', 'a') is None
+    assert flight.attach('k', 'b') == 'a'
+    assert flight.resolve('b') == 'a'
+
+    assert flight.release('a') == ('a', False)
+    assert flight.resolve('a') is None
+    assert flight.release('b') == ('a', True)
+
+
+def test_single_flight_finish_ends_dedup():
+    flight = SingleFlight()
+    flight.attach('k', 'a')
+    flight.finish('a')
+    assert flight.attach('k', 'b') is None
+
+
+def test_single_flight_forgets_the_group_after_last_release():
+    flight = SingleFlight()
+    for job_id in ('a', 'b', 'c'):
+        flight.attach('k', job_id)
+    flight.finish('a')
+    assert flight.release('b') == ('a', False)
+    assert flight.release('a') == ('a', False)
+    assert flight.release('c') == ('a', True)
+    assert flight._aliases == {}
+    assert flight._released == set()
+    assert flight._members == {}
@@ -0,0 +1,191 @@
+import asyncio
+
+import pytest
+
+from advanced_video_generator import AdvancedVideoGenerator
+from ffmpeg_engine import FFmpegResult
+from render_plan import NodeCache, PlanExecutor, RenderError, RenderNode, RenderPlan
+
+FAKE_CAPABILITIES = {'ok': True, 'problems': [], 'cpu_count': 4, 'encoders': {'libx264': True}, 'self_test': None}
+
+
+class RecordingEngine:
+    """Motor falso: cada comando ['write', caminho, texto] grava o arquivo"""
+
+    def __init__(self, failing=()):
+        self.commands = []
+        self.limited = []
+        self.slots = []
+        self.failing = set(failing)
+
+    async def run(self, cmd, capture_stdout=False, limited=True, timeout=None):
+        self.commands.append(cmd)
+        self.limited.append(limited)
+        if cmd[1] in self.failing:
+            return FFmpegResult(cmd, 1, 'falha sintética')
+        with open(cmd[1], 'w') as f:
+            f.write(cmd[2])
+        return FFmpegResult(cmd, 0, '')
+
+    async def run_pipeline(self, cmds, slots=None):
+        self.slots.append(slots)
+        return [await self.run(cmd) for cmd in cmds]
+
+
+def build_plan(tmp_path, text, probe_calls):
+    """
+    Probe (sem saída, nunca em cache) -> clip -> final, em que o comando do
+    final lê a duração do probe, como o overlay do gerador
+    """
+    plan = RenderPlan('job')
+    clip_path = str(tmp_path / 'clip.ts')
+    final_path = str(tmp_path / 'final.mp4')
+
+    async def probe(results):
+        probe_calls.append(1)
+        return {'duration': 5.0}
+
+    plan.add(RenderNode('probe', 'probe', action=probe, cache_params='video'))
+    plan.add(RenderNode('clip', 'normalize_clip', command=['write', clip_path, 'clip'],
+                        outputs=[clip_path], depends_on=['probe'], cache_params='filtros'))
+    plan.add(RenderNode('final', 'overlay',
+                        command=lambda results: ['write', final_path, f"{text}|{results['probe']['duration']}"],
+                        outputs=[final_path], depends_on=['clip', 'probe'], cache_params=text), target=True)
+    return plan
+
+
+def run(executor, plan):
+    return asyncio.run(executor.execute(plan))
+
+
+def test_cache_key_includes_dependencies():
+    first, second = RenderPlan('a'), RenderPlan('b')
+    for plan, params in ((first, 'x'), (second, 'y')):
+        plan.add(RenderNode('source', 'probe', cache_params=params))
+        plan.add(RenderNode('output', 'overlay', depends_on=['source'], cache_params='mesmo'))
+    assert first.nodes['output'].cache_key != second.nodes['output'].cache_key
+
+
+def test_node_without_key_makes_dependents_uncacheable():
+    plan = RenderPlan('job')
+    plan.add(RenderNode('source', 'probe'))
+    node = plan.add(RenderNode('output', 'overlay', outputs=['x.mp4'], depends_on=['source'], cache_params='p'))
+    assert node.cache_key is None
+    assert not node.cacheable
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError):
+        RenderPlan('job').add(RenderNode('output', 'overlay', depends_on=['missing']))
+
+
+def test_required_nodes_skip_what_is_done():
+    plan = RenderPlan('job')
+    plan.add(RenderNode('a', 'probe'))
+    plan.add(RenderNode('b', 'clip', depends_on=['a']))
+    plan.add(RenderNode('c', 'overlay', depends_on=['b']), target=True)
+    assert plan.required_nodes(set()) == {'a', 'b', 'c'}
+    assert plan.required_nodes({'b'}) == {'c'}
+
+
+def test_piped_nodes_run_as_one_group():
+    plan = RenderPlan('job')
+    plan.add(RenderNode('a', 'probe'))
+    plan.add(RenderNode('producer', 'overlay', depends_on=['a'], pipe_to='consumer'))
+    plan.add(RenderNode('consumer', 'package', depends_on=['producer']), target=True)
+    assert [[node.node_id for node in group] for group in plan.groups()] == [['a'], ['producer', 'consumer']]
+    # O consumidor arrasta o produtor junto, mesmo se o produtor "estivesse pronto"
+    assert plan.required_nodes({'producer'}) == {'a', 'producer', 'consumer'}
+
+
+def test_second_run_is_restored_from_cache(tmp_path):
+    cache = NodeCache(str(tmp_path / 'cache'))
+    probe_calls = []
+    engine = RecordingEngine()
+    run(PlanExecutor(engine, cache), build_plan(tmp_path, 'texto', probe_calls))
+    assert len(engine.commands) == 2
+
+    engine.commands.clear()
+    results = run(PlanExecutor(engine, cache), build_plan(tmp_path, 'texto', probe_calls))
+    assert engine.commands == []
+    assert results['final'] == [str(tmp_path / 'final.mp4')]
+    assert (tmp_path / 'final.mp4').read_text() == 'texto|5.0'
+
+
+def test_partial_restore_reruns_probes_read_by_commands(tmp_path):
+    # Só o final muda: o clip vem do cache, mas o comando do final ainda lê o
+    # probe, que precisa rodar de novo (antes dava KeyError)
+    cache = NodeCache(str(tmp_path / 'cache'))
+    probe_calls = []
+    engine = RecordingEngine()
+    run(PlanExecutor(engine, cache), build_plan(tmp_path, 'antes', probe_calls))
+
+    engine.commands.clear()
+    results = run(PlanExecutor(engine, cache), build_plan(tmp_path, 'depois', probe_calls))
+    assert [cmd[1] for cmd in engine.commands] == [str(tmp_path / 'final.mp4')]
+    assert results['probe'] == {'duration': 5.0}
+    assert len(probe_calls) == 2
+    assert (tmp_path / 'final.mp4').read_text() == 'depois|5.0'
+
+
+def test_failing_node_raises_after_retries(tmp_path):
+    final_path = str(tmp_path / 'final.mp4')
+    engine = RecordingEngine(failing=[final_path])
+    with pytest.raises(RenderError) as error:
+        run(PlanExecutor(engine, retries=1), build_plan(tmp_path, 'texto', []))
+    assert error.value.node.node_id == 'final'
+    # O stderr (com caminhos do servidor) fica fora da mensagem mostrada ao usuário
+    assert str(error.value) == "Etapa 'final' falhou"
+    assert error.value.detail == 'falha sintética'
+    assert [cmd[1] for cmd in engine.commands].count(final_path) == 2
+
+
+def test_generator_plan_restored_from_cache_has_every_probe_it_reads(tmp_path):
+    """
+    No plano real do gerador, com tudo que é cacheável restaurado, cada
+    comando a executar encontra nos resultados as etapas que lê
+    """
+    generator = AdvancedVideoGenerator(
+        upload_folder=str(tmp_path / 'uploads'), output_folder=str(tmp_path / 'out'),
+        assets_folder=str(tmp_path / 'assets'), scratch_folder=str(tmp_path / 'scratch'),
+        cache_folder=str(tmp_path / 'cache'), capabilities=FAKE_CAPABILITIES
+    )
+    files_data = []
+    for index, (name, media_type) in enumerate((('a.jpg', 'image'), ('b.jpg', 'image'), ('c.mp4', 'video'))):
+        path = tmp_path / name
+        path.write_bytes(name.encode())
+        files_data.append({'id': str(index), 'path': str(path), 'type': media_type})
+    property_data = {'name': 'Casa', 'area': '', 'price': '', 'location': '', 'template': 'casa',
+                     'music': '', 'formats': '16:9'}
+    scratch_dir = tmp_path / 'scratch' / 'job'
+    scratch_dir.mkdir(parents=True)
+    plan = generator.build_render_plan(files_data, property_data, 'job', str(scratch_dir))
+
+    # Como se só o overlay e o package tivessem mudado (ex.: outro texto)
+    cached = {node_id for node_id, node in plan.nodes.items()
+              if node.cacheable and node.kind not in ('overlay', 'package')}
+    required = plan.required_nodes(cached)
+    assert 'probe_clip_0' in required
+
+    results = {node_id: plan.nodes[node_id].outputs for node_id in cached}
+    results.update({node_id: {'duration': 5.0, 'has_audio': False}
+                    for node_id in required if plan.nodes[node_id].kind == 'probe'})
+    for node_id in required:
+        command = plan.nodes[node_id].command
+        if callable(command):
+            command(results)
+
+
+def test_stream_copy_stages_do_not_take_encoder_slots(tmp_path):
+    plan = RenderPlan('job')
+    body, final = str(tmp_path / 'body.ts'), str(tmp_path / 'final.mp4')
+    plan.add(RenderNode('overlay', 'overlay', command=['write', body, 'v'], pipe_to='package'))
+    plan.add(RenderNode('package', 'package', command=['write', final, 'mp4'], outputs=[final],
+                        depends_on=['overlay'], encoder=False), target=True)
+    plan.add(RenderNode('copy', 'concat', command=['write', str(tmp_path / 'c.ts'), 'c'],
+                        outputs=[str(tmp_path / 'c.ts')], encoder=False), target=True)
+    engine = RecordingEngine()
+    run(PlanExecutor(engine), plan)
+    assert engine.slots == [1]
+    copy_index = [cmd[2] for cmd in engine.commands].index('c')
+    assert engine.limited[copy_index] is False
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+from ffmpeg_engine import FFmpegEngine
+from job_index import JobIndex
+from job_queue import RenderQueue
+from render_worker import RenderWorker
+
+
+class SlowGenerator:
+    """Renderização que só termina se for cancelada"""
+
+    def __init__(self):
+        self.engine = FFmpegEngine(1)
+        self.cancelled = threading.Event()
+
+    def submit_property_video(self, files_data, property_data, job_id, master=None):
+        return self.engine.submit(self._render())
+
+    async def _render(self):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+
+
+def test_lost_lease_cancels_the_render(tmp_path):
+    # Lease negativo: expira assim que é concedido, então outro worker o toma
+    queue = RenderQueue(str(tmp_path / 'render_queue.db'), lease_seconds=-1)
+    queue.enqueue('job-1', {'files_data': [], 'property_data': {}})
+    generator = SlowGenerator()
+    worker = RenderWorker(queue, generator)
+
+    worker._claim_jobs()
+    future, _ = worker.in_flight['job-1']
+    queue.recover_expired()
+    assert queue.claim('outro-worker')[0] == 'job-1'
+
+    worker._send_heartbeats()
+    assert 'job-1' not in worker.in_flight
+    assert future.cancelled()
+    assert generator.cancelled.wait(5)
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.released = []
+
+    def release_slot(self, job_id):
+        self.released.append(job_id)
+
+
+def test_job_failed_by_recovery_releases_slot_and_updates_index(tmp_path):
+    queue = RenderQueue(str(tmp_path / 'render_queue.db'), lease_seconds=-1, max_attempts=1)
+    queue.enqueue('job-1', {'files_data': [], 'property_data': {}})
+    queue.claim('worker-morto')
+    limiter, index = RecordingLimiter(), JobIndex(str(tmp_path / 'job_index.db'))
+    index.add('job-1', 'u1', {})
+
+    RenderWorker(queue, SlowGenerator(), rate_limiter=limiter, job_index=index)._claim_jobs()
+    assert limiter.released == ['job-1']
+    assert index.list_jobs('u1')[0][0]['status'] == 'failed'
+    assert queue.get_status('job-1')['status'] == 'failed'
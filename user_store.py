@@ -0,0 +1,68 @@
+import os
+from datetime import datetime, timedelta
+from json_file_cache import JsonFileCache
+
+# Usuários e uso mensal em arquivos JSON (em produção, usar banco de dados),
+# compartilhados pelo app web e pelos workers de renderização
+USERS_FILE = 'user_data/users.json'
+USAGE_FILE = 'user_data/usage.json'
+
+# Leituras de usuários e uso por requisição vêm do cache (invalidado quando o arquivo muda)
+users_cache = JsonFileCache(USERS_FILE)
+usage_cache = JsonFileCache(USAGE_FILE)
+
+os.makedirs(os.path.dirname(USERS_FILE), exist_ok=True)
+
+
+def load_users():
+    """Carrega dados dos usuários (arquivo inteiro, para alterar e salvar)"""
+    return users_cache.load()
+
+
+def save_users(users):
+    """Salva dados dos usuários"""
+    users_cache.save(users)
+
+
+def load_usage():
+    """Carrega dados de uso (arquivo inteiro, para alterar e salvar)"""
+    return usage_cache.load()
+
+
+def save_usage(usage):
+    """Salva dados de uso"""
+    usage_cache.save(usage)
+
+
+def get_user_limits(email):
+    """Retorna os limites do usuário (users.json é indexado pelo email, como no login)"""
+    user = users_cache.get(email, {})
+    
+    if user.get('plan') == 'paid':
+        return {'videos_per_month': -1, 'concurrent_renders': 3, 'plan': 'paid'}  # Ilimitado
+    else:
+        return {'videos_per_month': 3, 'concurrent_renders': 1, 'plan': 'free'}  # Teste gratuito
+
+
+def check_user_usage(user_id):
+    """Verifica o uso atual do usuário"""
+    user_usage = usage_cache.get(user_id, {'videos_generated': 0, 'last_reset': datetime.now().isoformat()})
+    
+    # Verificar se precisa resetar (novo mês)
+    last_reset = datetime.fromisoformat(user_usage['last_reset'])
+    if datetime.now() - last_reset > timedelta(days=30):
+        user_usage = {'videos_generated': 0, 'last_reset': datetime.now().isoformat()}
+        usage = load_usage()
+        usage[user_id] = user_usage
+        save_usage(usage)
+    
+    return user_usage
+
+
+def increment_user_usage(user_id):
+    """Incrementa o uso do usuário"""
+    usage = load_usage()
+    user_usage = usage.get(user_id, {'videos_generated': 0, 'last_reset': datetime.now().isoformat()})
+    user_usage['videos_generated'] += 1
+    usage[user_id] = user_usage
+    save_usage(usage)